@@ -1,102 +1,217 @@
 import streamlit as st
-from openai import OpenAI
+from kimi import DATA_DIR
+from kimi.batch import BATCH_CONCURRENCY, load_rows, plan_batch, run_batch
+from kimi.cancel import CancelToken, ticking
+from kimi.content import (
+    content_stats, content_usage, format_bytes, load_content, load_content_bytes, release_content, store_content
+)
+from kimi.backend import (
+    cache_stats, estimate_caption, find_similar, generate_stream, generate_variants_stream, get_history_entry,
+    route_caption, search_history
+)
+from kimi.engine import MAX_VARIANTS, PROMPT_TEMPLATES, render_prompt
+from kimi.history import HISTORY_PAGE_SIZE, describe_entry
+from kimi.jobs import cancel_job, describe_job, job_owner, new_job_session, submit_job, watch_job
+from kimi.length import TRIMMED_NOTE, count_cjk_chars, is_trimmed
+from kimi.longform import (
+    LONGFORM_MAX_SECTION_CHARS, LONGFORM_MAX_SECTIONS, LONGFORM_SECTION_CHARS, LONGFORM_TEMPLATES, LongformProgress,
+    assemble, describe_progress, generate_longform_stream
+)
+from kimi.metrics import observe_render, start_metrics_server
+from kimi.refine import REFINE_HISTORY_TURNS, RefineSession, paragraph_ref, split_paragraphs
+from kimi.similar import SIMILAR_THRESHOLD, describe_match
 import time
 from datetime import datetime
-import re
+from functools import lru_cache
+import hashlib
+import json
+import os
 
 # ===================== 1. 自定义配置 =====================
-KIMI_BASE_URL = "https://api.moonshot.cn/v1"
-KIMI_MODEL = "moonshot-v1-8k"  # 可选moonshot-v1-32k/moonshot-v1-128k
-
-PROMPT_TEMPLATES = {
-    "故事生成": {
-        "template": "请以{主题}为核心，写一个{风格}风格的短篇故事，字数控制在{字数}字左右。要求情节完整，角色鲜明，语言流畅。",
-        "params": ["主题", "风格", "字数"]
-    },
-    "营销文案": {
-        "template": "为{产品名称}撰写{平台}平台的营销文案，突出{核心卖点}，语言风格{风格}，字数控制在{字数}字内。需吸引目标用户，激发购买欲。",
-        "params": ["产品名称", "平台", "核心卖点", "风格", "字数"]
-    },
-    "论文提纲": {
-        "template": "为《{论文题目}》（{学科}领域）设计详细提纲，逻辑清晰，结构完整，至少包含{章节数}个章节。需列出每个章节的核心研究内容和逻辑关联。",
-        "params": ["论文题目", "学科", "章节数"]
-    },
-    "自由创作": {
-        "template": "{用户输入}",
-        "params": ["用户输入"]
+# 模型、模板与校验规则统一在 kimi/engine.py 中维护；设置 KIMI_SERVICE_URL 后通过 kimi.server 生成
+STREAM_RENDER_INTERVAL = 0.05  # 流式输出的最小刷新间隔（秒）
+METRICS_PORT = 9465  # /metrics 旁路端口（KIMI_METRICS_PORT 可覆盖）
+
+# 自定义CSS美化 - 重点优化背景和视觉效果
+APP_CSS = """
+    <style>
+    /* 全局背景样式 */
+    [data-testid="stAppViewContainer"] {
+        background: linear-gradient(135deg, #f5f7fa 0%, #e4eaf5 100%);
+        background-attachment: fixed;
     }
-}
 
+    /* 主容器样式 */
+    [data-testid="stMainContainer"] {
+        padding-top: 1rem;
+        padding-bottom: 2rem;
+    }
 
-# ===================== 2. AI 生成核心函数 =====================
-def generate_content(kimi_api_key, template_type):
-    if not kimi_api_key or not str(kimi_api_key).strip().startswith("sk-"):
-        return "❌ 请输入有效的 Kimi API 密钥（以 sk- 开头）！"
+    /* 基础样式优化 */
+    .stButton>button {
+        height: 3em;
+        border-radius: 8px;
+        border: none;
+        transition: all 0.2s ease;
+    }
 
-    try:
-        client = OpenAI(
-            api_key=kimi_api_key.strip(),
-            base_url=KIMI_BASE_URL
-        )
-    except Exception as e:
-        return f"❌ 客户端初始化失败：{str(e)}"
+    .stButton>button:hover {
+        transform: translateY(-2px);
+        box-shadow: 0 4px 12px rgba(0,0,0,0.1);
+    }
 
-    try:
-        template_info = PROMPT_TEMPLATES[template_type]
-        template = template_info["template"]
-        required_params = template_info["params"]
-    except KeyError:
-        return "❌ 模板类型错误，无此生成模板！"
+    .stTextInput>div>div>input {
+        border-radius: 6px;
+        border: 1px solid #e0e0e0;
+        padding: 8px 12px;
+    }
+
+    .stTextArea>div>div>textarea {
+        border-radius: 6px;
+        font-size: 16px;
+        line-height: 1.6;
+        border: 1px solid #e0e0e0;
+        padding: 12px;
+    }
+
+    .stNumberInput>div>div>input {
+        border-radius: 6px;
+        border: 1px solid #e0e0e0;
+    }
+
+    .main-header {
+        font-size: 2.5rem;
+        color: #2E86AB;
+        font-weight: 700;
+        text-align: center;
+        margin-bottom: 1rem;
+        text-shadow: 0 2px 4px rgba(0,0,0,0.05);
+    }
+
+    /* 生成结果卡片样式 - 增强视觉效果 */
+    .result-card {
+        background: rgba(255, 255, 255, 0.95);
+        border-radius: 16px;
+        padding: 25px;
+        box-shadow: 0 4px 20px rgba(0,0,0,0.08);
+        margin-bottom: 20px;
+        border: 1px solid #f0f0f0;
+    }
 
+    /* 加载动画优化 */
+    @keyframes pulse {
+        0% { opacity: 1; }
+        50% { opacity: 0.7; }
+        100% { opacity: 1; }
+    }
+    .pulse {
+        animation: pulse 1.5s infinite;
+    }
+
+    /* 按钮组样式 */
+    .btn-group {
+        display: flex;
+        gap: 10px;
+        margin-top: 10px;
+    }
+
+    /* 统计信息样式 */
+    .word-count {
+        font-size: 0.9rem;
+        color: #666;
+        margin-top: 8px;
+        padding: 4px 12px;
+        background-color: #f5f5f5;
+        border-radius: 6px;
+        display: inline-block;
+    }
+
+    /* 响应式调整 */
+    @media (max-width: 768px) {
+        .main-header {
+            font-size: 2rem;
+        }
+        .result-card {
+            padding: 15px;
+        }
+    }
+    </style>
+    """
+
+
+# ===================== 2. AI 生成核心函数 =====================
+def collect_params(template_type):
+    """从页面状态读取当前模板的参数"""
+    required_params = PROMPT_TEMPLATES.get(template_type, {}).get("params", [])
     param_dict = {}
     for param in required_params:
         param_dict[param] = st.session_state.get(param, "")
+    return param_dict
 
-    invalid_or_missing = []
-    for param in required_params:
-        value = param_dict.get(param, "")
-        if param in ["字数", "章节数"]:
-            try:
-                num_value = int(value) if value else 0
-                if num_value <= 0:
-                    invalid_or_missing.append(param)
-            except (ValueError, TypeError):
-                invalid_or_missing.append(param)
-        else:
-            if not str(value).strip():
-                invalid_or_missing.append(param)
 
-    if invalid_or_missing:
-        return f"❌ 缺少或无效参数：{', '.join(invalid_or_missing)}（请填写有效且非空的内容）"
+def generate_content_stream(kimi_api_key, template_type, use_cache=True, cancel=None):
+    """流式生成：从页面状态读取参数，逐块产出累计文本，出错时产出以 ❌ 开头的提示
+    use_cache=False 表示强制重新生成：既不读缓存，也不与进行中的相同请求合并；cancel 取消时断开上游
+    参数在调用时立即读取（生成在后台线程中进行，后台线程不能访问页面状态）"""
+    return generate_stream(kimi_api_key, template_type, collect_params(template_type), use_cache,
+                           coalesce=use_cache, cancel=cancel)
 
-    try:
-        prompt = template.format(**param_dict)
-        response = client.chat.completions.create(
-            model=KIMI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=8192
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        error_info = str(e)
-        if "invalid api key" in error_info.lower():
-            return "❌ Kimi API密钥无效或已过期！"
-        elif "insufficient funds" in error_info.lower():
-            return "❌ Kimi账户余额不足，请充值！"
-        elif "rate limit" in error_info.lower():
-            return "❌ 请求频率过高，请稍后再试！"
-        else:
-            return f"❌ 生成失败：{error_info}"
+
+def generate_content_variants_stream(kimi_api_key, template_type, variants, use_cache=True, cancel=None):
+    """多候选流式生成：并发生成 variants 个版本，产出 (各候选当前文本, 各候选是否结束)"""
+    return generate_variants_stream(kimi_api_key, template_type, collect_params(template_type), variants,
+                                    use_cache, coalesce=use_cache, cancel=cancel)
+
+
+def collect_longform_params(template_type):
+    """长文模式的参数：模板参数 + 章节数（故事生成在长文设置中填写）+ 每章字数"""
+    param_dict = collect_params(template_type)
+    param_dict.setdefault("章节数", st.session_state.get("longform_chapters", 8))
+    param_dict["每章字数"] = st.session_state.get("每章字数", LONGFORM_SECTION_CHARS)
+    return param_dict
+
+
+def generate_content_longform_stream(kimi_api_key, template_type, use_cache=True, cancel=None):
+    """长文流式生成：先生成大纲，再并发撰写各章节，产出 LongformProgress"""
+    return generate_longform_stream(kimi_api_key, template_type, collect_longform_params(template_type),
+                                    use_cache, coalesce=use_cache, cancel=cancel)
+
+
+def generate_content(kimi_api_key, template_type, use_cache=True, variants=1):
+    """非流式生成：消费流式结果，返回最终完整文本；variants>1 时返回各候选最终文本的列表"""
+    if variants > 1:
+        contents = []
+        for contents, _ in generate_content_variants_stream(kimi_api_key, template_type, variants, use_cache):
+            pass
+        return contents
+    result = ""
+    for result in generate_content_stream(kimi_api_key, template_type, use_cache):
+        pass
+    return result
 
 
 # ===================== 3. 辅助函数 =====================
-def copy_to_clipboard(text):
-    """复制文本到剪贴板（修复版）"""
+def set_result(content):
+    """把结果写入正文存储，页面状态只保存句柄；返回写入的正文"""
+    st.session_state['result_handle'] = store_content(content, st.session_state['content_session'])
+    return content
+
+
+def result_text():
+    """当前结果的全文（按句柄从正文存储读取，正文已过期清理时返回提示）"""
+    content = load_content(st.session_state['result_handle'], st.session_state['content_session'])
+    return "❌ 该结果已过期清理，请重新生成或从历史记录中复用" if content is None else content
+
+
+def copy_to_clipboard(handle):
+    """复制文本到剪贴板（修复版）：点击时才按句柄读取正文"""
+    # 正文按 JSON 字符串写入脚本，反引号、${}、</script> 等都不会破坏脚本
+    content = load_content(handle, st.session_state['content_session'])
+    payload = json.dumps(content or "", ensure_ascii=False).replace("</", "<\\/")
     # 使用Streamlit的原生复制功能
     st.write(f"""
         <script>
-        navigator.clipboard.writeText(`{text.replace('`', '\\`')}`).then(() => {{
+        navigator.clipboard.writeText({payload}).then(() => {{
             alert('✅ 内容已复制到剪贴板！');
         }}).catch(err => {{
             alert('❌ 复制失败：' + err);
@@ -106,37 +221,690 @@ def copy_to_clipboard(text):
     st.toast("✅ 内容已复制到剪贴板！", icon="📋")
 
 
-def download_content(text, template_type):
-    """下载生成的内容为txt文件"""
+def download_content(handle, template_type):
+    """下载生成的内容为txt文件：点击下载时才从正文存储读取 UTF-8 字节，重跑页面不再编码、缓存全文"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{template_type}_{timestamp}.txt"
-    # 确保文本编码正确
-    text = text.encode('utf-8').decode('utf-8')
     return st.download_button(
         label="📥 下载",
-        data=text,
+        data=lambda: load_content_bytes(handle) or b"",
         file_name=filename,
         mime="text/plain; charset=utf-8",
         use_container_width=True
     )
 
 
+@lru_cache(maxsize=64)
 def count_words(text):
-    """统计文本字数（中文字符数）"""
-    # 移除标点符号和空格
-    cleaned_text = re.sub(r'[^\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff\uff00-\uffef]', '', text)
-    return len(cleaned_text)
+    """统计文本字数（中文字符数，与生成时的字数预算同一规则），按文本缓存，未改动的结果重跑时不再重复统计"""
+    return count_cjk_chars(text)
+
+
+@st.fragment
+def render_batch_panel(kimi_api_key, template_type):
+    """批量生成面板：上传 CSV/JSONL，并发生成并提供结果下载（同一文件重复上传会从断点续跑）"""
+    with st.expander("📦 批量生成（上传 CSV / JSONL）", expanded=False):
+        st.caption(f"每行一组参数，列名与模板参数一致；可选 template 列指定模板，缺省使用当前模板【{template_type}】")
+        uploaded = st.file_uploader("上传参数文件", type=["csv", "jsonl"], key="batch_file")
+        concurrency = st.number_input("并发数", min_value=1, max_value=16, value=BATCH_CONCURRENCY, step=1,
+                                      key="batch_concurrency")
+        if uploaded is None or not st.button("📦 开始批量生成", key="batch_start"):
+            return
+
+        # 以文件内容哈希命名，重复上传同一文件时自动跳过已成功的行
+        data = uploaded.getvalue()
+        batch_dir = os.path.join(DATA_DIR, "batch")
+        os.makedirs(batch_dir, exist_ok=True)
+        digest = hashlib.sha1(data).hexdigest()[:12]
+        input_path = os.path.join(batch_dir, f"{digest}{os.path.splitext(uploaded.name)[1].lower()}")
+        output_path = os.path.join(batch_dir, f"{digest}_result.jsonl")
+        with open(input_path, "wb") as f:
+            f.write(data)
+
+        try:
+            rows = load_rows(input_path, template_type)
+        except (ValueError, KeyError) as e:
+            st.error(f"❌ 文件解析失败：{str(e)}", icon="🚨")
+            return
+
+        plan = plan_batch(rows, int(concurrency))
+        st.caption(f"💰 有效 {plan['valid']}/{plan['rows']} 行，预计消耗约 "
+                   f"{plan['input_tokens'] + plan['output_tokens']} tokens，约 ¥{plan['cost_yuan']:.2f}，"
+                   f"预计耗时约 {plan['estimated_seconds']:.0f} 秒")
+        progress = st.progress(0.0, text="准备中...")
+
+        def on_result(record, done, total):
+            progress.progress(done / total, text=f"已完成 {done}/{total}（最新：第 {record['id']} 行 {record['status']}）")
+
+        summary = run_batch(kimi_api_key, rows, output_path, int(concurrency), on_result=on_result)
+        st.success(f"✅ 批量生成结束：共 {summary['total']} 行，成功 {summary['ok']}，失败 {summary['error']}，"
+                   f"断点跳过 {summary['skipped']}")
+        with open(output_path, encoding="utf-8") as f:
+            st.download_button("📥 下载结果（JSONL）", data=f.read(), file_name=f"batch_{digest}.jsonl",
+                               mime="application/json", use_container_width=True)
+
+
+@st.fragment
+def render_param_form(template_type):
+    """参数表单片段：按模板渲染参数输入框与生成前预估，输入变化时只重跑本片段"""
+    current_params = PROMPT_TEMPLATES[template_type]["params"]
+    st.subheader(f"✏️ 填写【{template_type}】参数", divider="blue")
+    col1, col2 = st.columns([0.7, 0.3])
+    with col1:
+        for param in current_params:
+            if param == "主题":
+                st.text_input("主题", placeholder="友情、星空、冒险、成长...", key="主题")
+            elif param == "风格":
+                st.text_input("风格", placeholder="治愈、悬疑、科幻、古风、幽默...", key="风格")
+            elif param == "字数":
+                st.number_input("字数限制", min_value=100, max_value=2000, value=500, step=100, key="字数")
+            elif param == "产品名称":
+                st.text_input("产品名称", placeholder="无线蓝牙耳机、智能保温杯、代餐奶昔...", key="产品名称")
+            elif param == "平台":
+                st.text_input("推广平台", placeholder="小红书、抖音、朋友圈、知乎、B站...", key="平台")
+            elif param == "核心卖点":
+                st.text_input("核心卖点", placeholder="超长续航、便携小巧、0糖0卡、性价比高...", key="核心卖点")
+            elif param == "论文题目":
+                st.text_input("论文题目", placeholder="基于深度学习的图像识别技术研究...", key="论文题目")
+            elif param == "学科":
+                st.text_input("学科领域", placeholder="计算机科学、汉语言文学、市场营销、教育学...", key="学科")
+            elif param == "章节数":
+                st.number_input("章节数量", min_value=3, max_value=10, value=5, step=1, key="章节数")
+            elif param == "用户输入":
+                st.text_area("自由创作需求", placeholder="请详细描述你的创作需求，越详细生成效果越好...", height=200,
+                             key="用户输入")
+
+        # 长文模式：先出大纲，再并发撰写各章节（总耗时约为大纲 + 最长一章，不受单次输出上限限制）
+        if template_type in LONGFORM_TEMPLATES and st.toggle(
+                "📚 长文模式（先生成大纲，再并发撰写各章节并按顺序拼接）", key="longform"):
+            col_chapters, col_chars = st.columns(2)
+            with col_chapters:
+                if "章节数" in current_params:
+                    chapters = st.session_state.get("章节数", 5)
+                else:
+                    chapters = st.number_input("章节数量", min_value=3, max_value=LONGFORM_MAX_SECTIONS, value=8,
+                                               step=1, key="longform_chapters")
+            with col_chars:
+                section_chars = st.number_input("每章字数", min_value=300, max_value=LONGFORM_MAX_SECTION_CHARS,
+                                                value=LONGFORM_SECTION_CHARS, step=100, key="每章字数")
+            st.caption(f"📚 预计全文约 {chapters * section_chars} 字，各章节同时撰写")
+
+    with col2:
+        st.info("""
+        💡 填写提示：
+        - 参数越详细，生成效果越好
+        - 字数请填写合理范围
+        - 风格描述越具体越好
+        """)
+
+    # 生成前预估（本地估算，按输入文本缓存）
+    preflight = estimate_caption(template_type, collect_params(template_type))
+    if preflight:
+        st.caption(f"💰 {preflight}")
+
+
+@st.fragment
+def render_result_panel(template_type):
+    """结果面板片段：展示、编辑、复制、下载生成结果，这些交互只重跑本片段"""
+    if st.session_state['result_handle']:
+        content = result_text()
+
+        # 创建卡片式布局
+        st.markdown('<div class="result-card">', unsafe_allow_html=True)
+
+        if content.startswith("❌"):
+            # 错误信息展示
+            st.error(content, icon="🚨")
+        else:
+            # 成功结果展示（重点优化）
+            # 显示生成信息和操作按钮
+            col_info, col_actions = st.columns([0.7, 0.3])
+            with col_info:
+                if st.session_state.get('generate_stopped'):
+                    st.warning(f"⏹ 已停止生成，以下为停止前已生成的部分内容（已记入生成历史）"
+                               f"｜停止时间：{st.session_state['generate_time']}", icon="⏹")
+                else:
+                    st.success(f"✅ 生成完成！生成时间：{st.session_state['generate_time']}", icon="🎉")
+                # 字数统计
+                word_count = count_words(content)
+                st.markdown(f'<div class="word-count">📊 字数统计：{word_count} 个中文字符</div>',
+                            unsafe_allow_html=True)
+                if st.session_state.get('generate_trimmed'):
+                    st.caption(TRIMMED_NOTE)
+                if st.session_state['generate_route']:
+                    st.caption(f"🧭 {st.session_state['generate_route']}")
+
+            with col_actions:
+                # 操作按钮组 - 增加悬停效果
+                col_copy, col_download = st.columns(2)
+                with col_copy:
+                    st.button(
+                        "📋 复制",
+                        on_click=copy_to_clipboard,
+                        args=(st.session_state['result_handle'],),
+                        use_container_width=True
+                    )
+                with col_download:
+                    download_content(st.session_state['result_handle'], template_type)
+
+            # 内容展示区域 - 优化排版和阅读体验；只在编辑时使用文本框（文本框会在页面状态中再保存一份全文）
+            if st.toggle("✏️ 编辑全文", key="result_editing"):
+                edited_content = st.text_area(
+                    "生成内容",
+                    value=content,
+                    height=500,
+                    label_visibility="collapsed",
+                    placeholder="生成的内容将显示在这里...",
+                    key="result_textarea"
+                )
+
+                # 实时更新结果（支持编辑后复制/下载）
+                if edited_content != content:
+                    content = set_result(edited_content)
+            else:
+                with st.container(height=500):
+                    st.markdown(content)
+
+            # 额外提示
+            st.caption("💡 提示：打开「✏️ 编辑全文」可直接修改内容，修改后仍可复制/下载")
+            # 局部修改：只改写选中的段落
+            render_refine_panel(content, template_type)
+            usage = content_usage(st.session_state['content_session'])
+            memory = content_stats()
+            st.caption(f"🧠 本会话内存中的正文 {format_bytes(usage['memory_bytes'])} / {format_bytes(usage['limit'])} | "
+                       f"全部会话 {format_bytes(memory['memory_bytes'])} / {format_bytes(memory['memory_limit'])}"
+                       "（超出时最久未用的正文只保留在磁盘上）")
+            stats = cache_stats()
+            st.caption(f"缓存命中 {stats['hits']} 次 | 未命中 {stats['misses']} 次 | "
+                       f"合并相同请求 {stats.get('coalesced', 0)} 次"
+                       + (f" | 对冲请求 {stats['hedged']} 次（先于原请求响应 {stats.get('hedge_wins', 0)} 次）"
+                          if stats.get('hedged') else ""))
+
+        # 关闭卡片容器
+        st.markdown('</div>', unsafe_allow_html=True)
+    elif st.session_state.get('generate_stopped') and not st.session_state['variants']:
+        st.info("⏹ 已停止生成，停止前尚未产出内容", icon="⏹")
+    elif st.session_state['variants']:
+        st.info("👆 请在上方候选中点击「📌 选用」，选中的一版会放到这里继续编辑、复制或下载", icon="🎯")
+    else:
+        # 无结果时显示更友好的提示
+        st.markdown("""
+        <div class="result-card">
+            <div style="text-align: center; padding: 40px 0; color: #666;">
+                <span style="font-size: 3rem; margin-bottom: 1rem; display: block;">✏️</span>
+                <p style="font-size: 1.1rem; margin-bottom: 0;">填写参数后点击「立即生成」按钮</p>
+                <p style="font-size: 0.9rem; color: #999;">AI生成的内容将展示在这里</p>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
+
+def reset_refine(request=""):
+    """新结果放入结果区时重置局部修改会话；request 为该结果的原始提示词"""
+    st.session_state['refine_session'] = None
+    st.session_state['generate_request'] = request
+
+
+def current_refine_session(template_type):
+    """当前结果的局部修改会话（只保存原始要求与修改记录，全文每次从结果区传入）"""
+    session = st.session_state.get('refine_session')
+    if session is None:
+        request = st.session_state.get('generate_request') or \
+            render_prompt(template_type, collect_params(template_type))[0] or ""
+        session = RefineSession(request, st.session_state['content_session'])
+        st.session_state['refine_session'] = session
+    return session
+
+
+def stream_refine(session, content, index, instruction):
+    """流式显示改写中的段落；成功时返回改写结果，出错或停止时返回 None（错误提示保留在原位）"""
+    placeholder = st.empty()
+    timer = st.empty()
+    cancel = start_generation()
+    updates = ticking(session.stream(st.session_state.get('kimi_api_key', ''), content, index, instruction,
+                                     cancel=cancel), cancel)
+    revision = ""
+    started = time.monotonic()
+    last_render = 0.0
+    try:
+        for update in updates:
+            now = time.monotonic()
+            if update is None:
+                render_heartbeat(timer, started)
+                continue
+            revision = update
+            if now - last_render >= STREAM_RENDER_INTERVAL:
+                render_partial(placeholder, revision)
+                last_render = now
+    finally:
+        updates.close()
+        st.session_state['cancel_token'] = None
+    timer.empty()
+    if revision.startswith("❌"):
+        placeholder.error(revision, icon="🚨")
+        return None
+    placeholder.empty()
+    if cancel.cancelled or not revision.strip() or revision.startswith("⏳"):
+        return None
+    return revision
+
+
+def show_refined(content):
+    """把修改后的全文放回结果区：清除文本框保存的旧内容，整页重跑后显示新的全文"""
+    if content is None:
+        st.error("❌ 修改前的内容已过期清理，无法撤销", icon="🚨")
+        return
+    set_result(content)
+    st.session_state.pop('result_textarea', None)
+    st.rerun()
+
+
+def render_refine_panel(content, template_type):
+    """局部修改：按修改要求只改写一个段落并拼回结果，只发送该段及其前后文，不重新生成全文"""
+    with st.expander("✏️ 局部修改（只改写一个段落，比整篇重新生成更快、更省令牌）"):
+        session = current_refine_session(template_type)
+        paragraphs = split_paragraphs(content)
+        if not paragraphs:
+            st.caption("暂无可修改的段落")
+            return
+        col_paragraph, col_instruction = st.columns([0.35, 0.65])
+        with col_paragraph:
+            selected = st.selectbox("段落", range(len(paragraphs)), key="refine_paragraph",
+                                    format_func=lambda i: f"第 {i + 1} 段：{paragraphs[i].text[:20]}")
+        with col_instruction:
+            instruction = st.text_input("修改要求", key="refine_instruction",
+                                        placeholder="例如：更有感染力一些 / 第3段改得更简洁 / 最后一段扩写到200字",
+                                        help="修改要求中写明“第N段”“最后一段”时修改该段，否则修改左侧选中的段落")
+        col_refine, col_undo, _ = st.columns([0.2, 0.2, 0.6])
+        with col_refine:
+            refine_btn = st.button("✏️ 修改该段", type="primary", use_container_width=True, key="refine_submit")
+        with col_undo:
+            undo_btn = st.button("↩️ 撤销上次修改", disabled=not session.turns, use_container_width=True,
+                                 key="refine_undo")
+        if session.turns:
+            st.caption("📝 已采纳的修改：" + "；".join(f"第 {turn.index + 1} 段 · {turn.instruction}"
+                                                   for turn in session.turns[-REFINE_HISTORY_TURNS:]))
+
+        if undo_btn:
+            show_refined(session.undo())
+        if refine_btn:
+            index = paragraph_ref(instruction, len(paragraphs))
+            index = selected if index is None else index
+            revision = stream_refine(session, content, index, instruction)
+            if revision is not None:
+                show_refined(session.accept(content, index, instruction, revision))
+
+
+@st.fragment
+def render_variants_panel():
+    """多候选片段：候选并排对比，选用其中一版后放入结果区；切换选用不重跑整页的生成区域"""
+    variants = st.session_state['variants']
+    if not variants:
+        return
+    pinned = st.session_state['variant_pinned']
+    stopped = " | ⏹ 已停止生成（部分内容）" if st.session_state.get('generate_stopped') else ""
+    st.caption(f"🎯 共 {len(variants)} 个候选 | 生成时间：{st.session_state['variants_time']}{stopped}")
+    for index, (col, content) in enumerate(zip(st.columns(len(variants)), variants)):
+        with col, st.container(border=True):
+            is_pinned = index == pinned
+            st.markdown(f"**候选 {index + 1}**" + (" · 📌 已选用" if is_pinned else ""))
+            if content.startswith("❌"):
+                st.error(content, icon="🚨")
+                continue
+            st.caption(f"📊 {count_words(content)} 个中文字符" + (f" | {TRIMMED_NOTE}" if is_trimmed(content) else ""))
+            with st.container(height=400, border=False):
+                st.markdown(content)
+            if st.button("📌 选用", key=f"variant_pin_{index}", disabled=is_pinned, use_container_width=True):
+                st.session_state['variant_pinned'] = index
+                set_result(content)
+                st.session_state['generate_time'] = st.session_state['variants_time']
+                st.session_state['generate_trimmed'] = is_trimmed(content)
+                reset_refine()
+                route = st.session_state['variants_route']
+                st.session_state['generate_route'] = f"{route} · 候选 {index + 1}" if route else f"候选 {index + 1}"
+                # 结果面板是另一个片段，需整页重跑才会刷新
+                st.rerun()
+
+
+def accept_similar():
+    """「✅ 采用」回调：把相似请求的结果放入结果区"""
+    match = st.session_state['similar_match']
+    set_result(match["content"])
+    st.session_state['generate_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    st.session_state['generate_route'] = f"♻️ 复用相似请求的结果（相似度 {match['similarity']:.0%}）"
+    st.session_state['generate_stopped'] = False
+    st.session_state['generate_trimmed'] = False
+    st.session_state['variants'] = []
+    st.session_state['similar_match'] = None
+    reset_refine()
+
+
+def regenerate_similar():
+    """「🔄 重新生成」回调：不采用相似结果，按当前参数重新生成"""
+    st.session_state['similar_match'] = None
+    st.session_state['similar_regenerate'] = True
+
+
+def render_similar_panel():
+    """相似请求命中时展示以前生成的结果，由用户选择采用或重新生成"""
+    match = st.session_state['similar_match']
+    if not match:
+        return
+    with st.container(border=True):
+        st.info(describe_match(match), icon="♻️")
+        with st.container(height=300, border=False):
+            st.markdown(match["content"])
+        col_accept, col_regenerate, _ = st.columns([0.2, 0.2, 0.6])
+        with col_accept:
+            st.button("✅ 采用", on_click=accept_similar, type="primary", use_container_width=True,
+                      help="直接使用该结果，不调用模型、不产生费用")
+        with col_regenerate:
+            st.button("🔄 重新生成", on_click=regenerate_similar, use_container_width=True,
+                      help="按当前参数调用模型重新生成")
+
+
+@st.fragment
+def render_history_panel():
+    """历史记录片段：打开后才查询；关键词检索、游标翻页，点击复用把历史结果放回结果区"""
+    if not st.toggle("📚 历史记录（检索并复用以前生成的内容，无需重新付费生成）", key="history_open"):
+        return
+    col_query, col_template = st.columns([0.7, 0.3])
+    with col_query:
+        query = st.text_input("关键词", placeholder="在提示词与生成内容中检索，多个关键词用空格分隔", key="history_query")
+    with col_template:
+        template_filter = st.selectbox("模板", ["全部"] + list(PROMPT_TEMPLATES.keys()), key="history_template")
+
+    # 游标翻页：记录每一页第一条之前的 id，检索条件变化时回到第一页
+    filters = (query, template_filter)
+    if st.session_state.get("history_filters") != filters:
+        st.session_state["history_filters"] = filters
+        st.session_state["history_cursors"] = [None]
+    cursors = st.session_state["history_cursors"]
+    entries = search_history(query, None if template_filter == "全部" else template_filter, cursors[-1],
+                             HISTORY_PAGE_SIZE + 1)
+    has_next = len(entries) > HISTORY_PAGE_SIZE
+    entries = entries[:HISTORY_PAGE_SIZE]
+    if not entries:
+        st.caption("暂无匹配的历史记录")
+        return
+
+    for entry in entries:
+        col_desc, col_use = st.columns([0.85, 0.15])
+        with col_desc:
+            st.caption(describe_entry(entry))
+            st.write(entry["preview"] + ("…" if entry["output_chars"] > len(entry["preview"]) else ""))
+        with col_use:
+            if st.button("♻️ 复用", key=f"history_use_{entry['id']}", use_container_width=True):
+                # 点击时才读取并解压全文
+                full = get_history_entry(entry["id"])
+                if full is None:
+                    st.error("❌ 该历史记录已不存在", icon="🚨")
+                else:
+                    set_result(full["output"])
+                    st.session_state['generate_time'] = full["created"]
+                    st.session_state['generate_route'] = f"来自历史记录 #{full['id']}（{full['model']}）"
+                    st.session_state['generate_stopped'] = full["status"] not in ("ok", "trimmed")
+                    st.session_state['generate_trimmed'] = full["status"] == "trimmed"
+                    reset_refine(full["prompt"])
+                    st.rerun()
+
+    col_prev, col_page, col_next = st.columns([0.2, 0.6, 0.2])
+    with col_prev:
+        if st.button("⬅️ 上一页", disabled=len(cursors) == 1, use_container_width=True, key="history_prev"):
+            cursors.pop()
+            st.rerun(scope="fragment")
+    with col_page:
+        st.caption(f"第 {len(cursors)} 页")
+    with col_next:
+        if st.button("下一页 ➡️", disabled=not has_next, use_container_width=True, key="history_next"):
+            cursors.append(entries[-1]["id"])
+            st.rerun(scope="fragment")
 
 
 # ===================== 4. Streamlit 页面主逻辑 =====================
+def start_generation():
+    """为本次生成创建取消令牌：点击「⏹ 停止生成」、页面重跑或关闭时取消，立即断开上游连接"""
+    cancel = CancelToken()
+    st.session_state['cancel_token'] = cancel
+    return cancel
+
+
+def stop_generation():
+    """「⏹ 停止生成」按钮回调：取消进行中的生成与本页跟随的后台任务
+    （点击会中断正在运行的脚本，生成循环退出时已取消令牌；这里兜底取消仍在进行的生成）"""
+    cancel = st.session_state.get('cancel_token')
+    if cancel is not None:
+        cancel.cancel()
+    cancel_job(st.session_state.get('job_id'))
+
+
+def track_job(job_id):
+    """本页跟随的后台任务：任务 id 同时写入页面地址，刷新页面或断线重连后按地址取回"""
+    st.session_state['job_id'] = job_id
+    st.session_state['job_loaded'] = None
+    if job_id:
+        st.query_params['job'] = job_id
+    elif 'job' in st.query_params:
+        del st.query_params['job']
+
+
+def render_heartbeat(placeholder, started):
+    """等待上游时的定期刷新：显示已用时；Streamlit 只在输出元素时响应停止、重跑与页面关闭"""
+    placeholder.caption(f"⏱️ 已用时 {time.monotonic() - started:.0f} 秒，可随时点击「⏹ 停止生成」")
+
+
+def finish_generation(cancel, content, route):
+    """保存生成结果（停止时为部分内容）；在 finally 中调用，只写页面状态、不输出元素"""
+    set_result(content)
+    st.session_state['generate_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    st.session_state['generate_route'] = route
+    st.session_state['generate_stopped'] = cancel.cancelled
+    st.session_state['generate_trimmed'] = is_trimmed(content)
+    st.session_state['cancel_token'] = None
+    reset_refine()
+
+
+def render_partial(placeholder, text, finished=False):
+    """流式输出的一次刷新：排队/重试提示、错误提示或带光标的正文"""
+    if text.startswith("⏳"):
+        placeholder.info(text)
+    elif text.startswith("❌"):
+        placeholder.error(text, icon="🚨")
+    else:
+        placeholder.markdown(text + ("" if finished else "▌"))
+
+
+def render_section(placeholder, section, content, finished):
+    """长文模式中一个章节的刷新"""
+    if not content or content.startswith("⏳"):
+        placeholder.caption(f"⏳ {section.title} · 撰写中...")
+    elif content.startswith("❌"):
+        placeholder.error(f"{section.title}：{content}", icon="🚨")
+    else:
+        placeholder.markdown(f"#### {section.title}\n\n{content}" + ("" if finished else "▌"))
+
+
+def stream_single(kimi_api_key, template_type, use_cache):
+    """单个结果：提交后台生成任务并跟随其进度；页面重跑、刷新或断线重连都不会中断任务"""
+    if 'job_session' not in st.session_state:
+        st.session_state['job_session'] = new_job_session()
+    job_id = submit_job(kimi_api_key, template_type, collect_params(template_type), use_cache=use_cache,
+                        owner=job_owner(kimi_api_key, st.session_state['job_session']))
+    track_job(job_id)
+    follow_job(job_id)
+
+
+def follow_job(job_id):
+    """跟随后台任务：首个token到达即开始显示，按固定间隔刷新避免过度重绘；任务结束后把结果放入结果区
+    停止跟随（重跑、刷新、关闭页面）不影响任务，下次运行时继续跟随或直接取回结果"""
+    status = st.empty()
+    stream_placeholder = st.empty()
+    timer = st.empty()
+    job = None
+    started = time.monotonic()
+    last_render = 0.0
+    render_seconds = 0.0
+    for update in watch_job(job_id):
+        now = time.monotonic()
+        if update is None:
+            render_heartbeat(timer, started)
+            continue
+        job = update
+        if job["status"] in ("queued", "running"):
+            # 排队、限流等待与自动重试提示
+            status.info(describe_job(job), icon="⏳")
+        if job["content"] and now - last_render >= STREAM_RENDER_INTERVAL:
+            stream_placeholder.markdown(job["content"] + "▌")
+            last_render = now
+        render_seconds += time.monotonic() - now
+    status.empty()
+    stream_placeholder.empty()
+    timer.empty()
+    if job is None:
+        # 任务已过期清理或来自其他数据目录
+        track_job(None)
+        return
+    set_result(job["content"])
+    st.session_state['generate_time'] = datetime.fromtimestamp(job["finished"]).strftime("%Y-%m-%d %H:%M:%S")
+    st.session_state['generate_route'] = route_caption(job["template"], job["params"])
+    st.session_state['generate_stopped'] = job["status"] == "cancelled"
+    st.session_state['generate_trimmed'] = job["status"] == "trimmed"
+    st.session_state['variants'] = []
+    st.session_state['job_loaded'] = job_id
+    reset_refine(render_prompt(job["template"], job["params"])[0] or "")
+    observe_render("1.py", job["template"], render_seconds)
+
+
+def stream_longform(kimi_api_key, template_type, use_cache):
+    """长文模式：先流式显示大纲，再按大纲顺序显示并发撰写中的各章节，完成后拼接放入结果区"""
+    status = st.empty()
+    outline_box = st.empty()
+    timer = st.empty()
+    section_boxes, rendered = [], []
+    cancel = start_generation()
+    updates = ticking(generate_content_longform_stream(kimi_api_key, template_type, use_cache, cancel), cancel)
+    progress = LongformProgress("", [], [], [])
+    started = time.monotonic()
+    last_render = 0.0
+    render_seconds = 0.0
+    try:
+        for update in updates:
+            now = time.monotonic()
+            if update is None:
+                render_heartbeat(timer, started)
+                continue
+            progress = update
+            if not progress.sections:
+                if now - last_render >= STREAM_RENDER_INTERVAL:
+                    status.info(describe_progress(progress))
+                    render_partial(outline_box, progress.outline)
+                    last_render = now
+            else:
+                if not section_boxes:
+                    # 大纲完成：收起大纲，按章节顺序预留位置
+                    with outline_box.container(), st.expander("🗂️ 大纲", expanded=False):
+                        st.markdown(progress.outline)
+                    section_boxes = [st.empty() for _ in progress.sections]
+                    rendered = [None] * len(section_boxes)
+                if now - last_render >= STREAM_RENDER_INTERVAL or all(progress.finished):
+                    status.info(describe_progress(progress))
+                    # 只重绘有变化的章节
+                    for index, placeholder in enumerate(section_boxes):
+                        state = (progress.contents[index], progress.finished[index])
+                        if state != rendered[index]:
+                            render_section(placeholder, progress.sections[index], *state)
+                            rendered[index] = state
+                    last_render = now
+            render_seconds += time.monotonic() - now
+    finally:
+        updates.close()
+        outline = "" if progress.outline.startswith("⏳") else progress.outline
+        finish_generation(cancel, assemble(progress._replace(outline=outline)),
+                          describe_progress(progress) if progress.sections else "")
+        st.session_state['variants'] = []
+    status.empty()
+    outline_box.empty()
+    timer.empty()
+    for placeholder in section_boxes:
+        placeholder.empty()
+    observe_render("1.py", template_type, render_seconds)
+
+
+def stream_variants(kimi_api_key, template_type, variant_count, use_cache):
+    """多个候选并排流式展示（并发生成，总耗时接近生成一个），结束后交给候选片段展示与选用"""
+    placeholders = [col.empty() for col in st.columns(variant_count)]
+    timer = st.empty()
+    rendered = [None] * variant_count
+    contents = [""] * variant_count
+    cancel = start_generation()
+    updates = ticking(generate_content_variants_stream(kimi_api_key, template_type, variant_count, use_cache,
+                                                       cancel), cancel)
+    started = time.monotonic()
+    last_render = 0.0
+    render_seconds = 0.0
+    try:
+        for update in updates:
+            now = time.monotonic()
+            if update is None:
+                render_heartbeat(timer, started)
+                continue
+            contents, finished = update
+            if now - last_render >= STREAM_RENDER_INTERVAL or all(finished):
+                # 只重绘有变化的候选
+                for index, placeholder in enumerate(placeholders):
+                    state = (contents[index], finished[index])
+                    if state != rendered[index]:
+                        render_partial(placeholder, *state)
+                        rendered[index] = state
+                last_render = now
+            render_seconds += time.monotonic() - now
+    finally:
+        updates.close()
+        # 结果区留给选用的候选
+        finish_generation(cancel, "", "")
+        st.session_state['generate_time'] = ""
+        st.session_state['variants'] = [
+            "❌ 已停止生成，该候选尚未产出内容" if cancel.cancelled and (not content or content.startswith("⏳"))
+            else content for content in contents
+        ]
+        st.session_state['variant_pinned'] = None
+        st.session_state['variants_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        st.session_state['variants_route'] = route_caption(template_type, collect_params(template_type))
+    for placeholder in placeholders:
+        placeholder.empty()
+    timer.empty()
+    observe_render("1.py", template_type, render_seconds)
+
+
 def main():
     # 初始化session state
     if 'clipboard_text' not in st.session_state:
         st.session_state['clipboard_text'] = ""
-    if 'generated_content' not in st.session_state:
-        st.session_state['generated_content'] = ""
+    if 'result_handle' not in st.session_state:
+        st.session_state['result_handle'] = ""  # 当前结果在正文存储中的句柄（页面状态不保存全文）
+        st.session_state['content_session'] = os.urandom(8).hex()  # 正文内存预算按该 id 记账
     if 'generate_time' not in st.session_state:
         st.session_state['generate_time'] = ""
+    if 'generate_route' not in st.session_state:
+        st.session_state['generate_route'] = ""
+    if 'variants' not in st.session_state:
+        st.session_state['variants'] = []  # 多候选生成的各候选文本
+        st.session_state['variant_pinned'] = None
+        st.session_state['variants_time'] = ""
+        st.session_state['variants_route'] = ""
+    if 'generate_stopped' not in st.session_state:
+        st.session_state['generate_stopped'] = False  # 结果是否为停止生成前的部分内容
+        st.session_state['generate_trimmed'] = False  # 结果是否按字数预算在句末提前结束
+        st.session_state['cancel_token'] = None  # 进行中生成的取消令牌
+    if 'similar_match' not in st.session_state:
+        st.session_state['similar_match'] = None  # 待用户选择采用或重新生成的相似请求结果
+    if 'refine_session' not in st.session_state:
+        st.session_state['refine_session'] = None  # 当前结果的局部修改会话（原始要求、已采纳的全文与修改记录）
+        st.session_state['generate_request'] = ""  # 当前结果的原始提示词（为空时按当前表单参数渲染）
+    if 'job_id' not in st.session_state:
+        # 本页跟随的后台任务；刷新页面后从地址中的 ?job= 取回
+        st.session_state['job_id'] = st.query_params.get('job')
+        st.session_state['job_loaded'] = None  # 结果已放入结果区的任务 id
 
     # 页面配置
     st.set_page_config(
@@ -145,112 +913,11 @@ def main():
         layout="wide",
         initial_sidebar_state="collapsed"
     )
+    # 指标旁路服务（进程内只启动一次）
+    start_metrics_server(METRICS_PORT)
 
-    # 自定义CSS美化 - 重点优化背景和视觉效果
-    st.markdown("""
-        <style>
-        /* 全局背景样式 */
-        [data-testid="stAppViewContainer"] {
-            background: linear-gradient(135deg, #f5f7fa 0%, #e4eaf5 100%);
-            background-attachment: fixed;
-        }
-
-        /* 主容器样式 */
-        [data-testid="stMainContainer"] {
-            padding-top: 1rem;
-            padding-bottom: 2rem;
-        }
-
-        /* 基础样式优化 */
-        .stButton>button {
-            height: 3em;
-            border-radius: 8px;
-            border: none;
-            transition: all 0.2s ease;
-        }
-
-        .stButton>button:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-        }
-
-        .stTextInput>div>div>input {
-            border-radius: 6px;
-            border: 1px solid #e0e0e0;
-            padding: 8px 12px;
-        }
-
-        .stTextArea>div>div>textarea {
-            border-radius: 6px;
-            font-size: 16px;
-            line-height: 1.6;
-            border: 1px solid #e0e0e0;
-            padding: 12px;
-        }
-
-        .stNumberInput>div>div>input {
-            border-radius: 6px;
-            border: 1px solid #e0e0e0;
-        }
-
-        .main-header {
-            font-size: 2.5rem;
-            color: #2E86AB;
-            font-weight: 700;
-            text-align: center;
-            margin-bottom: 1rem;
-            text-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        }
-
-        /* 生成结果卡片样式 - 增强视觉效果 */
-        .result-card {
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 16px;
-            padding: 25px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-            margin-bottom: 20px;
-            border: 1px solid #f0f0f0;
-        }
-
-        /* 加载动画优化 */
-        @keyframes pulse {
-            0% { opacity: 1; }
-            50% { opacity: 0.7; }
-            100% { opacity: 1; }
-        }
-        .pulse {
-            animation: pulse 1.5s infinite;
-        }
-
-        /* 按钮组样式 */
-        .btn-group {
-            display: flex;
-            gap: 10px;
-            margin-top: 10px;
-        }
-
-        /* 统计信息样式 */
-        .word-count {
-            font-size: 0.9rem;
-            color: #666;
-            margin-top: 8px;
-            padding: 4px 12px;
-            background-color: #f5f5f5;
-            border-radius: 6px;
-            display: inline-block;
-        }
-
-        /* 响应式调整 */
-        @media (max-width: 768px) {
-            .main-header {
-                font-size: 2rem;
-            }
-            .result-card {
-                padding: 15px;
-            }
-        }
-        </style>
-        """, unsafe_allow_html=True)
+    # 自定义CSS美化：整页重跑时必须重新输出（未输出的元素会被清除），片段重跑不会执行到这里
+    st.markdown(APP_CSS, unsafe_allow_html=True)
 
     # 页面标题
     st.markdown('<p class="main-header">📝 AI 文字生成工具 (Kimi 版)</p>', unsafe_allow_html=True)
@@ -267,7 +934,7 @@ def main():
         ⚠️ 注意：API密钥请妥善保管，不要分享给他人，使用产生的费用由账号所有者承担
         """)
 
-    st.caption(f"当前使用模型：{KIMI_MODEL} | 国内接口 ✔ 无需代理 ✔")
+    st.caption("模型按输入规模自动选择（moonshot-v1-8k / 32k / 128k）| 国内接口 ✔ 无需代理 ✔")
     st.divider()
 
     # 1. Kimi API密钥输入（使用st.text_input并缓存）
@@ -275,7 +942,7 @@ def main():
         label="🔑 Kimi API 密钥",
         type="password",
         placeholder="请输入你的Kimi密钥 (格式：sk-xxxxxxxxxxxxxxxxxx)",
-        help="密钥从月之暗面(Kimi)官网获取，请勿泄露给他人",
+        help="密钥从月之暗面(Kimi)官网获取，请勿泄露给他人；部署方配置了共享密钥池时可留空",
         value=st.session_state.get('kimi_api_key', ''),
         key='api_key_input'
     )
@@ -293,57 +960,51 @@ def main():
         index=0,
         help="选择不同模板将展示对应必填参数"
     )
-    current_params = PROMPT_TEMPLATES[template_type]["params"]
     st.divider()
 
-    # 3. 动态渲染对应参数输入框
-    st.subheader(f"✏️ 填写【{template_type}】参数", divider="blue")
-    col1, col2 = st.columns([0.7, 0.3])
-    with col1:
-        for param in current_params:
-            if param == "主题":
-                st.text_input("主题", placeholder="友情、星空、冒险、成长...", key="主题")
-            elif param == "风格":
-                st.text_input("风格", placeholder="治愈、悬疑、科幻、古风、幽默...", key="风格")
-            elif param == "字数":
-                st.number_input("字数限制", min_value=100, max_value=2000, value=500, step=100, key="字数")
-            elif param == "产品名称":
-                st.text_input("产品名称", placeholder="无线蓝牙耳机、智能保温杯、代餐奶昔...", key="产品名称")
-            elif param == "平台":
-                st.text_input("推广平台", placeholder="小红书、抖音、朋友圈、知乎、B站...", key="平台")
-            elif param == "核心卖点":
-                st.text_input("核心卖点", placeholder="超长续航、便携小巧、0糖0卡、性价比高...", key="核心卖点")
-            elif param == "论文题目":
-                st.text_input("论文题目", placeholder="基于深度学习的图像识别技术研究...", key="论文题目")
-            elif param == "学科":
-                st.text_input("学科领域", placeholder="计算机科学、汉语言文学、市场营销、教育学...", key="学科")
-            elif param == "章节数":
-                st.number_input("章节数量", min_value=3, max_value=10, value=5, step=1, key="章节数")
-            elif param == "用户输入":
-                st.text_area("自由创作需求", placeholder="请详细描述你的创作需求，越详细生成效果越好...", height=200,
-                             key="用户输入")
-
-    with col2:
-        st.info("""
-        💡 填写提示：
-        - 参数越详细，生成效果越好
-        - 字数请填写合理范围
-        - 风格描述越具体越好
-        """)
+    # 3. 动态渲染对应参数输入框（片段：修改参数只重跑表单与预估，不重跑整页）
+    render_param_form(template_type)
 
     st.divider()
 
     # 4. 生成按钮区域
-    col_btn, col_clear, _ = st.columns([0.2, 0.1, 0.7])
+    col_btn, col_stop, col_clear, col_variants, col_cache = st.columns([0.18, 0.12, 0.12, 0.15, 0.43])
     with col_btn:
         generate_btn = st.button("🚀 立即生成", type="primary", use_container_width=True)
 
+    with col_stop:
+        st.button("⏹ 停止生成", on_click=stop_generation, use_container_width=True,
+                  help="立即停止生成并断开与模型的连接，已生成的部分保留在结果区")
+
     with col_clear:
         if st.button("🧹 清空结果", use_container_width=True):
-            st.session_state['generated_content'] = ""
+            st.session_state['result_handle'] = ""
+            release_content(st.session_state['content_session'])
             st.session_state['generate_time'] = ""
+            st.session_state['generate_route'] = ""
+            st.session_state['generate_stopped'] = False
+            st.session_state['generate_trimmed'] = False
+            st.session_state['variants'] = []
+            st.session_state['similar_match'] = None
+            reset_refine()
+            cancel_job(st.session_state['job_id'])
+            track_job(None)
             st.rerun()
 
+    with col_variants:
+        variant_count = st.number_input("🎯 候选数量", min_value=1, max_value=MAX_VARIANTS, value=1, step=1,
+                                        help=f"一次并发生成多个版本并排对比（最多 {MAX_VARIANTS} 个），"
+                                             "总耗时接近生成一个；选用最满意的一版")
+
+    with col_cache:
+        bypass_cache = st.checkbox("🔄 跳过缓存，强制重新生成",
+                                   help="默认相同参数直接复用已生成的结果，并与他人同时发起的相同请求共用一次生成；"
+                                        "勾选后单独重新调用模型，得到新的结果")
+        similar_threshold = st.slider("♻️ 相似请求复用阈值", min_value=0.5, max_value=1.0, value=SIMILAR_THRESHOLD,
+                                      step=0.05, key="similar_threshold",
+                                      help="参数与以前的请求足够相似（仅空格、标点、卖点顺序等不同）时，先展示以前的结果"
+                                           "供采用或重新生成；1.0 表示只在归一化后完全相同时提供")
+
     st.divider()
 
     # ===================== 生成结果展示区域（重点优化） =====================
@@ -353,82 +1014,51 @@ def main():
     result_container = st.container()
 
     with result_container:
-        # 生成按钮点击后的处理
-        if generate_btn:
+        # 生成按钮点击后的处理（「🔄 重新生成」跳过相似请求检查）
+        regenerate = st.session_state.pop('similar_regenerate', False)
+        if generate_btn or regenerate:
+            st.session_state['similar_match'] = None
+            # 新的生成开始时取消本页仍在进行的上一个后台任务
+            cancel_job(st.session_state['job_id'])
+            track_job(None)
             # 显示加载状态
-            with st.spinner('<span class="pulse">✨ AI 正在生成内容，请稍候...</span>', unsafe_allow_html=True):
+            with st.spinner("✨ AI 正在生成内容，请稍候..."):
                 # 使用缓存的API密钥
                 api_key_to_use = st.session_state.get('kimi_api_key', kimi_api_key)
-                result = generate_content(api_key_to_use, template_type)
 
-                # 保存结果和生成时间
-                st.session_state['generated_content'] = result
-                st.session_state['generate_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if template_type in LONGFORM_TEMPLATES and st.session_state.get("longform"):
+                    stream_longform(api_key_to_use, template_type, not bypass_cache)
+                elif variant_count > 1:
+                    stream_variants(api_key_to_use, template_type, variant_count, not bypass_cache)
+                else:
+                    match = None
+                    if not bypass_cache and not regenerate:
+                        match = find_similar(template_type, collect_params(template_type),
+                                             threshold=similar_threshold)
+                    if match:
+                        st.session_state['similar_match'] = match
+                    else:
+                        stream_single(api_key_to_use, template_type, not bypass_cache)
+        elif st.session_state['job_id'] and st.session_state['job_loaded'] != st.session_state['job_id']:
+            # 重跑、刷新或重新连接：继续跟随后台任务，已结束的直接取回结果
+            follow_job(st.session_state['job_id'])
 
-        # 显示结果（包括历史结果）
-        if st.session_state['generated_content']:
-            content = st.session_state['generated_content']
+        # 相似请求的结果：采用或重新生成
+        render_similar_panel()
 
-            # 创建卡片式布局
-            st.markdown('<div class="result-card">', unsafe_allow_html=True)
+        # 多候选对比与选用
+        render_variants_panel()
 
-            if content.startswith("❌"):
-                # 错误信息展示
-                st.error(content, icon="🚨")
-            else:
-                # 成功结果展示（重点优化）
-                # 显示生成信息和操作按钮
-                col_info, col_actions = st.columns([0.7, 0.3])
-                with col_info:
-                    st.success(f"✅ 生成完成！生成时间：{st.session_state['generate_time']}", icon="🎉")
-                    # 字数统计
-                    word_count = count_words(content)
-                    st.markdown(f'<div class="word-count">📊 字数统计：{word_count} 个中文字符</div>',
-                                unsafe_allow_html=True)
-
-                with col_actions:
-                    # 操作按钮组 - 增加悬停效果
-                    col_copy, col_download = st.columns(2)
-                    with col_copy:
-                        st.button(
-                            "📋 复制",
-                            on_click=copy_to_clipboard,
-                            args=(content,),
-                            use_container_width=True
-                        )
-                    with col_download:
-                        download_content(content, template_type)
-
-                # 内容展示区域 - 优化排版和阅读体验
-                edited_content = st.text_area(
-                    "生成内容",
-                    value=content,
-                    height=500,
-                    label_visibility="collapsed",
-                    placeholder="生成的内容将显示在这里...",
-                    key="result_textarea"
-                )
+        # 显示结果（包括历史结果）
+        render_result_panel(template_type)
 
-                # 实时更新session state中的内容（支持编辑后复制/下载）
-                if edited_content != st.session_state['generated_content']:
-                    st.session_state['generated_content'] = edited_content
+    st.divider()
 
-                # 额外提示
-                st.caption("💡 提示：你可以直接编辑文本框中的内容，修改后仍可复制/下载")
+    # 生成历史
+    render_history_panel()
 
-            # 关闭卡片容器
-            st.markdown('</div>', unsafe_allow_html=True)
-        else:
-            # 无结果时显示更友好的提示
-            st.markdown("""
-            <div class="result-card">
-                <div style="text-align: center; padding: 40px 0; color: #666;">
-                    <span style="font-size: 3rem; margin-bottom: 1rem; display: block;">✏️</span>
-                    <p style="font-size: 1.1rem; margin-bottom: 0;">填写参数后点击「立即生成」按钮</p>
-                    <p style="font-size: 0.9rem; color: #999;">AI生成的内容将展示在这里</p>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+    # 批量生成
+    render_batch_panel(st.session_state.get('kimi_api_key', kimi_api_key), template_type)
 
 
 if __name__ == "__main__":
@@ -1,100 +1,126 @@
+import asyncio
+import os
+import time
+
 import gradio as gr
-from openai import OpenAI
+from kimi.backend import (
+    estimate_caption, find_similar, generate, generate_stream_async, generate_variants_stream_async,
+    get_history_entry, route_caption, search_history
+)
+from kimi.engine import MAX_VARIANTS, PROMPT_TEMPLATES, clamp_variants
+from kimi.history import HISTORY_PAGE_SIZE
+from kimi.length import TRIMMED_NOTE, is_trimmed
+from kimi.metrics import observe_render, start_metrics_server
+from kimi.similar import SIMILAR_THRESHOLD, describe_match
 
 # ===================== 1. 自定义配置（移除代理，适配Kimi国内API） =====================
-# Kimi API 配置（Kimi为国内接口，无需代理）
-KIMI_BASE_URL = "https://api.moonshot.cn/v1"
-KIMI_MODEL = "moonshot-v1-8k"  # 可选moonshot-v1-32k/moonshot-v1-128k
-
-PROMPT_TEMPLATES = {
-    "故事生成": {
-        "template": "请以{主题}为核心，写一个{风格}风格的短篇故事，字数控制在{字数}字左右。要求情节完整，角色鲜明，语言流畅。",
-        "params": ["主题", "风格", "字数"]
-    },
-    "营销文案": {
-        "template": "为{产品名称}撰写{平台}平台的营销文案，突出{核心卖点}，语言风格{风格}，字数控制在{字数}字内。需吸引目标用户，激发购买欲。",
-        "params": ["产品名称", "平台", "核心卖点", "风格", "字数"]
-    },
-    "论文提纲": {
-        "template": "为《{论文题目}》（{学科}领域）设计详细提纲，逻辑清晰，结构完整，至少包含{章节数}个章节。需列出每个章节的核心研究内容和逻辑关联。",
-        "params": ["论文题目", "学科", "章节数"]
-    },
-    "自由创作": {
-        "template": "{用户输入}",
-        "params": ["用户输入"]
-    }
-}
+# Kimi 接口地址、模型与模板统一在 kimi/engine.py 中维护（国内接口，无需代理）
+# 设置 KIMI_SERVICE_URL 后通过 kimi.server 生成，缓存、限流与连接池由服务进程统一管理
 
+# 排队配置：生成事件为异步处理，单进程即可同时服务大量用户
+GENERATE_CONCURRENCY = int(os.environ.get("KIMI_GRADIO_CONCURRENCY", "64"))  # 同时进行的生成数
+QUEUE_MAX_SIZE = int(os.environ.get("KIMI_GRADIO_QUEUE_SIZE", "256"))  # 排队上限，超出后新请求被拒绝
+METRICS_PORT = 9464  # /metrics 旁路端口（KIMI_METRICS_PORT 可覆盖）
 
-# ===================== 2. AI 生成核心函数（移除代理，简化客户端） =====================
-def generate_content(kimi_api_key, template_type, current_param_names, *all_inputs):
-    # 验证Kimi密钥
-    if not kimi_api_key or not str(kimi_api_key).strip().startswith("sk-"):
-        return "❌ 请输入有效的 Kimi API 密钥（以 sk- 开头）！"
 
-    # 初始化Kimi客户端（国内接口，无需代理）
-    try:
-        client = OpenAI(
-            api_key=kimi_api_key.strip(),
-            base_url=KIMI_BASE_URL
-        )
-    except Exception as e:
-        return f"❌ 客户端初始化失败：{str(e)}"
-
-    # 获取模板和参数
-    try:
-        template_info = PROMPT_TEMPLATES[template_type]
-        template = template_info["template"]
-        required_params = template_info["params"]
-    except KeyError:
-        return "❌ 模板类型错误，无此生成模板！"
-
-    # 构建参数字典
+# ===================== 2. AI 生成核心函数（异步，等待上游时不占用工作线程） =====================
+def collect_params(template_type, current_param_names, all_inputs):
+    """按参数名从全部参数组件的取值中组装当前模板的参数字典"""
+    required_params = PROMPT_TEMPLATES.get(template_type, {}).get("params", [])
     param_dict = {}
-    for i, param_name in enumerate(current_param_names):
-        if param_name in required_params and i < len(all_inputs):
-            input_value = all_inputs[i]
+    # 通过 API 调用时不会触发页面加载事件，参数名列表为空，按模板参数读取
+    for param_name in current_param_names or required_params:
+        if param_name in required_params and param_name in param_names_list:
+            input_value = all_inputs[param_names_list.index(param_name)]
             if isinstance(input_value, str):
                 param_dict[param_name] = input_value.strip()
             else:
                 param_dict[param_name] = input_value
+    return param_dict
+
+
+async def stream_generation(kimi_api_key, template_type, param_dict, bypass_cache):
+    """异步流式生成：逐块产出 (累计文本, 路由说明, 重新生成按钮)，出错时文本为以 ❌ 开头的提示
+    点击停止或页面断开时 Gradio 取消本任务，引擎随即关闭上游连接并把已生成的部分记入生成历史"""
+    caption = route_caption(template_type, param_dict)
+    route_info = f"🧭 {caption}" if caption else ""
+    # 产出到下一次取值之间的时间即 Gradio 处理并推送该次更新的耗时
+    render_seconds = 0.0
+    try:
+        async for partial in generate_stream_async(kimi_api_key, template_type, param_dict,
+                                                    use_cache=not bypass_cache, coalesce=not bypass_cache):
+            yielded = time.perf_counter()
+            if is_trimmed(partial):
+                route_info = f"{route_info}\n\n{TRIMMED_NOTE}" if route_info else TRIMMED_NOTE
+            yield partial, route_info, gr.update(visible=False)
+            render_seconds += time.perf_counter() - yielded
+    finally:
+        observe_render("2.py", template_type, render_seconds)
+
+
+async def generate_content_stream(kimi_api_key, template_type, current_param_names, bypass_cache, similar_threshold,
+                                  *all_inputs):
+    """生成按钮：参数与以前的请求足够相似时直接给出以前的结果（保留即采用，或点击重新生成），否则流式生成"""
+    param_dict = collect_params(template_type, current_param_names, all_inputs)
+    if not bypass_cache:
+        match = await asyncio.to_thread(find_similar, template_type, param_dict, threshold=similar_threshold)
+        if match:
+            yield (match["content"], f"{describe_match(match)}\n\n直接使用即为采用，需要新的结果请点击「🔄 重新生成」",
+                   gr.update(visible=True))
+            return
+    async for update in stream_generation(kimi_api_key, template_type, param_dict, bypass_cache):
+        yield update
+
+
+async def regenerate_content_stream(kimi_api_key, template_type, current_param_names, bypass_cache, *all_inputs):
+    """「🔄 重新生成」：不采用相似请求的结果，按当前参数调用模型生成"""
+    param_dict = collect_params(template_type, current_param_names, all_inputs)
+    async for update in stream_generation(kimi_api_key, template_type, param_dict, bypass_cache):
+        yield update
+
 
-    # 校验参数
-    invalid_or_missing = []
-    for param in required_params:
-        value = param_dict.get(param, "")
-        if param in ["字数", "章节数"]:
-            try:
-                num_value = int(value) if value else 0
-                if num_value <= 0:
-                    invalid_or_missing.append(param)
-            except (ValueError, TypeError):
-                invalid_or_missing.append(param)
+def variant_updates(contents, finished):
+    """多候选文本框的更新：前 len(contents) 个显示对应候选，其余隐藏"""
+    updates = []
+    for index in range(MAX_VARIANTS):
+        if index < len(contents):
+            status = "已完成" if finished[index] else "生成中…"
+            if is_trimmed(contents[index]):
+                status += "，已按字数提前结束"
+            updates.append(gr.update(visible=True, value=contents[index], label=f"候选 {index + 1}（{status}）"))
         else:
-            if not str(value).strip():
-                invalid_or_missing.append(param)
+            updates.append(gr.update(visible=False, value=""))
+    return updates
 
-    if invalid_or_missing:
-        return f"❌ 缺少或无效参数：{', '.join(invalid_or_missing)}（请填写有效且非空的内容）"
 
-    # 调用Kimi API
+async def generate_variants_content_stream(kimi_api_key, template_type, current_param_names, bypass_cache,
+                                           variant_count, *all_inputs):
+    """异步多候选生成：并发生成多个版本并排刷新（总耗时接近生成一个），全部结束后可选用其中一个"""
+    param_dict = collect_params(template_type, current_param_names, all_inputs)
+    caption = route_caption(template_type, param_dict)
+    route_info = f"🧭 {caption}" if caption else ""
+    hidden_pin = gr.update(choices=[], value=None, visible=False)
+    render_seconds = 0.0
+    contents, finished = [], []
     try:
-        prompt = template.format(**param_dict)
-        response = client.chat.completions.create(
-            model=KIMI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=8192
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        error_info = str(e)
-        if "invalid api key" in error_info.lower():
-            return "❌ Kimi API密钥无效或已过期！"
-        elif "insufficient funds" in error_info.lower():
-            return "❌ Kimi账户余额不足，请充值！"
-        else:
-            return f"❌ 生成失败：{error_info}"
+        async for contents, finished in generate_variants_stream_async(kimi_api_key, template_type, param_dict,
+                                                                       clamp_variants(variant_count),
+                                                                       use_cache=not bypass_cache,
+                                                                       coalesce=not bypass_cache):
+            yielded = time.perf_counter()
+            yield tuple(variant_updates(contents, finished) + [hidden_pin, route_info])
+            render_seconds += time.perf_counter() - yielded
+    finally:
+        observe_render("2.py", template_type, render_seconds)
+    choices = [f"候选 {index + 1}" for index, content in enumerate(contents) if not content.startswith("❌")]
+    yield tuple(variant_updates(contents, finished) +
+                [gr.update(choices=choices, value=None, visible=bool(choices)), route_info])
+
+
+def generate_content(kimi_api_key, template_type, current_param_names, bypass_cache, *all_inputs):
+    """同步非流式生成：返回最终完整文本（供脚本直接调用）"""
+    param_dict = collect_params(template_type, current_param_names, all_inputs)
+    return generate(kimi_api_key, template_type, param_dict, use_cache=not bypass_cache, coalesce=not bypass_cache)
 
 
 # ===================== 3. 参数组件（保留原逻辑） =====================
@@ -117,7 +143,7 @@ param_names_list = list(all_params.keys())
 with gr.Blocks(title="我的 AI 文字生成工具（Kimi版）", theme=gr.themes.Soft()) as demo:
     gr.Markdown("# 📝 我的 AI 文字生成工具（Kimi版）")
     gr.Markdown("### 操作步骤：1. 输入Kimi API密钥 → 2. 选择模板 → 3. 填写参数 → 4. 生成文本")
-    gr.Markdown(f"### 当前使用 Kimi {KIMI_MODEL} 模型（国内接口，无需代理）")
+    gr.Markdown("### 模型按输入规模自动选择 moonshot-v1-8k / 32k / 128k（国内接口，无需代理）")
     gr.Markdown("---")
 
     # Kimi密钥输入
@@ -126,7 +152,7 @@ with gr.Blocks(title="我的 AI 文字生成工具（Kimi版）", theme=gr.theme
         type="password",
         placeholder="sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
         max_lines=1,
-        info="密钥从Kimi（月之暗面）官网获取，请勿泄露"
+        info="密钥从Kimi（月之暗面）官网获取，请勿泄露；部署方配置了共享密钥池时可留空"
     )
 
     # 模板选择
@@ -140,19 +166,61 @@ with gr.Blocks(title="我的 AI 文字生成工具（Kimi版）", theme=gr.theme
     current_param_names = gr.State([])
 
     # 参数容器
-    param_column = gr.Column(spacing="md")
+    param_column = gr.Column()
     with param_column:
         for comp in param_components:
             comp.render()
 
+    # 生成前预估（参数变化时本地重新估算）
+    preflight_info = gr.Markdown()
+
     # 生成按钮和结果
-    generate_btn = gr.Button("🚀 生成文本", variant="primary", size="lg")
+    bypass_cache = gr.Checkbox(label="🔄 跳过缓存，强制重新生成", value=False,
+                               info="默认相同参数直接复用已生成的结果，并与他人同时发起的相同请求共用一次生成；"
+                                    "勾选后单独重新调用模型，得到新的结果")
+    similar_threshold = gr.Slider(label="♻️ 相似请求复用阈值", minimum=0.5, maximum=1.0, value=SIMILAR_THRESHOLD,
+                                  step=0.05, info="参数与以前的请求足够相似（仅空格、标点、卖点顺序等不同）时，"
+                                                  "直接给出以前的结果，可采用或重新生成；1.0 表示只在归一化后完全相同时提供")
+    with gr.Row():
+        generate_btn = gr.Button("🚀 生成文本", variant="primary", size="lg", scale=3)
+        regenerate_btn = gr.Button("🔄 重新生成", size="lg", scale=1, visible=False)
+        stop_btn = gr.Button("⏹ 停止生成", variant="stop", size="lg", scale=1)
     result = gr.Textbox(
         label="生成结果（Kimi模型输出）",
         lines=15,
         placeholder="生成的内容将显示在这里...",
         info="结果仅供参考，可自行修改"
     )
+    route_info = gr.Markdown()
+
+    # 多候选：并发生成多个版本并排对比，选用其中一个放入生成结果
+    with gr.Row():
+        variant_count = gr.Slider(label="🎯 候选数量", minimum=2, maximum=MAX_VARIANTS, value=3, step=1, scale=3,
+                                  info="一次并发生成多个版本，总耗时接近生成一个")
+        variants_btn = gr.Button("🎯 生成多个候选并排对比", scale=1)
+    with gr.Row():
+        variant_boxes = [gr.Textbox(label=f"候选 {index + 1}", lines=12, visible=False)
+                         for index in range(MAX_VARIANTS)]
+    pinned_variant = gr.Radio(label="📌 选用候选（放入上方生成结果，可继续修改）", choices=[], visible=False)
+
+    # 生成历史（点击检索或翻页时才查询，点击表格行选中记录，复用时才读取全文）
+    with gr.Accordion("📚 历史记录（检索并复用以前生成的内容，无需重新付费生成）", open=False):
+        with gr.Row():
+            history_query = gr.Textbox(label="关键词", placeholder="在提示词与生成内容中检索，多个关键词用空格分隔",
+                                       scale=3)
+            history_template = gr.Dropdown(label="模板", choices=["全部"] + list(PROMPT_TEMPLATES.keys()),
+                                           value="全部", scale=1)
+        history_search_btn = gr.Button("🔍 检索")
+        history_table = gr.Dataframe(headers=["编号", "时间", "模板", "模型", "字数", "预览"], type="array",
+                                     interactive=False, wrap=True)
+        with gr.Row():
+            history_prev_btn = gr.Button("⬅️ 上一页", interactive=False)
+            history_next_btn = gr.Button("下一页 ➡️", interactive=False)
+        with gr.Row():
+            history_id = gr.Number(label="记录编号（点击表格行自动填入）", precision=0)
+            history_use_btn = gr.Button("♻️ 复用到生成结果", variant="secondary")
+        history_cursors = gr.State([None])  # 每一页的游标（该页第一条之前的 id）
+        history_next_cursor = gr.State(None)
 
 
     # 模板切换事件
@@ -173,13 +241,124 @@ with gr.Blocks(title="我的 AI 文字生成工具（Kimi版）", theme=gr.theme
         outputs=param_components + [current_param_names]
     )
 
-    # 生成按钮事件
-    generate_btn.click(
-        fn=generate_content,
-        inputs=[kimi_api_key, template_type, current_param_names] + param_components,
-        outputs=result
+    def update_preflight(template_type, *all_inputs):
+        needed_params = PROMPT_TEMPLATES.get(template_type, {}).get("params", [])
+        caption = estimate_caption(template_type, collect_params(template_type, needed_params, all_inputs))
+        return f"💰 {caption}" if caption else ""
+
+
+    gr.on(
+        triggers=[demo.load, template_type.change] + [comp.change for comp in param_components],
+        fn=update_preflight,
+        inputs=[template_type] + param_components,
+        outputs=preflight_info,
+        queue=False
+    )
+
+    # 生成按钮事件（异步生成器，结果随输出逐步刷新；排队时结果框显示队列位置）
+    generate_event = generate_btn.click(
+        fn=generate_content_stream,
+        inputs=[kimi_api_key, template_type, current_param_names, bypass_cache, similar_threshold] + param_components,
+        outputs=[result, route_info, regenerate_btn],
+        api_name="generate",
+        concurrency_limit=GENERATE_CONCURRENCY,
+        concurrency_id="generate",
+        show_progress="full"
     )
 
+    # 不采用相似请求的结果时重新生成
+    regenerate_event = regenerate_btn.click(
+        fn=regenerate_content_stream,
+        inputs=[kimi_api_key, template_type, current_param_names, bypass_cache] + param_components,
+        outputs=[result, route_info, regenerate_btn],
+        concurrency_limit=GENERATE_CONCURRENCY,
+        concurrency_id="generate",
+        show_progress="full"
+    )
+
+    # 多候选按钮事件（与单次生成共用并发上限）
+    variants_event = variants_btn.click(
+        fn=generate_variants_content_stream,
+        inputs=[kimi_api_key, template_type, current_param_names, bypass_cache, variant_count] + param_components,
+        outputs=variant_boxes + [pinned_variant, route_info],
+        api_name="generate_variants",
+        concurrency_limit=GENERATE_CONCURRENCY,
+        concurrency_id="generate",
+        show_progress="minimal"
+    )
+
+    # 停止按钮：取消进行中的生成任务，上游连接随即断开并释放并发名额，已输出的部分保留在结果框中
+    # （关闭页面时 Gradio 同样会取消该会话的生成任务）
+    stop_btn.click(fn=None, cancels=[generate_event, regenerate_event, variants_event], queue=False)
+
+    def pin_variant(choice, *variant_texts):
+        if not choice:
+            return gr.update()
+        return variant_texts[int(choice.split()[-1]) - 1]
+
+
+    pinned_variant.change(fn=pin_variant, inputs=[pinned_variant] + variant_boxes, outputs=result, queue=False)
+
+
+    # 历史记录：游标翻页与复用
+    def show_history_page(query, template_filter, cursors):
+        entries = search_history(query, None if template_filter == "全部" else template_filter, cursors[-1],
+                                 HISTORY_PAGE_SIZE + 1)
+        has_next = len(entries) > HISTORY_PAGE_SIZE
+        entries = entries[:HISTORY_PAGE_SIZE]
+        rows = [[e["id"], e["created"], e["template"], e["model"], e["output_chars"], e["preview"]] for e in entries]
+        return (rows, cursors, entries[-1]["id"] if has_next else None, gr.update(interactive=len(cursors) > 1),
+                gr.update(interactive=has_next))
+
+
+    def first_history_page(query, template_filter):
+        return show_history_page(query, template_filter, [None])
+
+
+    def next_history_page(query, template_filter, cursors, next_cursor):
+        return show_history_page(query, template_filter, cursors + [next_cursor])
+
+
+    def prev_history_page(query, template_filter, cursors):
+        return show_history_page(query, template_filter, cursors[:-1] or [None])
+
+
+    history_outputs = [history_table, history_cursors, history_next_cursor, history_prev_btn, history_next_btn]
+    gr.on(
+        triggers=[history_search_btn.click, history_query.submit, history_template.change],
+        fn=first_history_page,
+        inputs=[history_query, history_template],
+        outputs=history_outputs,
+        queue=False
+    )
+    history_next_btn.click(
+        fn=next_history_page,
+        inputs=[history_query, history_template, history_cursors, history_next_cursor],
+        outputs=history_outputs,
+        queue=False
+    )
+    history_prev_btn.click(
+        fn=prev_history_page,
+        inputs=[history_query, history_template, history_cursors],
+        outputs=history_outputs,
+        queue=False
+    )
+
+    def pick_history(table, evt: gr.SelectData):
+        return table[evt.index[0]][0] if table else None
+
+
+    history_table.select(fn=pick_history, inputs=history_table, outputs=history_id, queue=False)
+
+    def reuse_history(entry_id):
+        entry = get_history_entry(int(entry_id)) if entry_id else None
+        if entry is None:
+            return "❌ 未找到该历史记录，请先检索并选择一条记录", ""
+        return entry["output"], f"📚 来自历史记录 #{entry['id']}（{entry['model']}，{entry['created']}）"
+
+
+    history_use_btn.click(fn=reuse_history, inputs=history_id, outputs=[result, route_info], queue=False)
+
 
     # 初始化默认模板
     def init_default():
@@ -200,7 +379,10 @@ with gr.Blocks(title="我的 AI 文字生成工具（Kimi版）", theme=gr.theme
     )
 
 # ===================== 运行工具（端口7861，避免占用） =====================
+demo.queue(max_size=QUEUE_MAX_SIZE, status_update_rate="auto")
+
 if __name__ == "__main__":
+    start_metrics_server(METRICS_PORT)
     demo.launch(
         share=False,
         server_port=7861,
@@ -1,88 +1,302 @@
 import streamlit as st
-from openai import OpenAI
+from kimi.backend import (
+    cache_stats, estimate_caption, find_similar, generate_stream, generate_variants_stream, get_history_entry,
+    route_caption, search_history
+)
+from kimi.cancel import CancelToken, ticking
+from kimi.engine import MAX_VARIANTS, TEMPLATE_SETS
+from kimi.history import HISTORY_PAGE_SIZE, describe_entry
+from kimi.jobs import cancel_job, describe_job, job_owner, new_job_session, submit_job, watch_job
+from kimi.length import TRIMMED_NOTE, is_trimmed
+from kimi.metrics import observe_render, start_metrics_server
+from kimi.similar import SIMILAR_THRESHOLD, describe_match
+import time
 
 # ===================== 1. 基础配置（新增背景参数） =====================
-KIMI_BASE_URL = "https://api.moonshot.cn/v1"
-KIMI_MODEL = "moonshot-v1-8k"
-
-# 新增背景参数（仅修改模板，不新增冗余代码）
-PROMPT_TEMPLATES = {
-    "故事生成": {
-        "template": "请以{主题}为核心，在{背景}背景下，写一个{风格}风格的短篇故事，字数控制在{字数}字左右。要求情节完整，角色鲜明，语言流畅。",
-        "params": ["主题", "背景", "风格", "字数"]
-    },
-    "营销文案": {
-        "template": "为{产品名称}撰写{平台}平台的营销文案，突出{核心卖点}，结合{背景}场景，语言风格{风格}，字数控制在{字数}字内。需吸引目标用户，激发购买欲。",
-        "params": ["产品名称", "平台", "核心卖点", "背景", "风格", "字数"]
-    },
-    "论文提纲": {
-        "template": "为《{论文题目}》（{学科}领域）设计详细提纲，结合{背景}研究背景，逻辑清晰，结构完整，至少包含{章节数}个章节。需列出每个章节的核心研究内容和逻辑关联。",
-        "params": ["论文题目", "学科", "背景", "章节数"]
-    },
-    "自由创作": {
-        "template": "{用户输入}",
-        "params": ["用户输入"]
-    }
-}
+STREAM_RENDER_INTERVAL = 0.05  # 流式输出的最小刷新间隔（秒）
+METRICS_PORT = 9466  # /metrics 旁路端口（KIMI_METRICS_PORT 可覆盖）
 
-# ===================== 2. AI 生成核心函数（无冗余修改） =====================
-def generate_content(kimi_api_key, template_type):
-    if not kimi_api_key or not str(kimi_api_key).strip().startswith("sk-"):
-        return "❌ 请输入有效的 Kimi API 密钥（以 sk- 开头）！"
-
-    try:
-        client = OpenAI(
-            api_key=kimi_api_key.strip(),
-            base_url=KIMI_BASE_URL
-        )
-    except Exception as e:
-        return f"❌ 客户端初始化失败：{str(e)}"
-
-    try:
-        template_info = PROMPT_TEMPLATES[template_type]
-        template = template_info["template"]
-        required_params = template_info["params"]
-    except KeyError:
-        return "❌ 模板类型错误，无此生成模板！"
+# 新增背景参数（仅修改模板，不新增冗余代码）；模板定义见 kimi/engine.py
+TEMPLATE_SET = "background"
+PROMPT_TEMPLATES = TEMPLATE_SETS[TEMPLATE_SET]
 
+# ===================== 2. AI 生成核心函数（无冗余修改） =====================
+def collect_params(template_type):
+    """从页面状态读取当前模板的参数"""
+    required_params = PROMPT_TEMPLATES.get(template_type, {}).get("params", [])
     param_dict = {}
     for param in required_params:
         param_dict[param] = st.session_state.get(param, "")
+    return param_dict
 
-    invalid_or_missing = []
-    for param in required_params:
-        value = param_dict.get(param, "")
-        if param in ["字数", "章节数"]:
-            try:
-                num_value = int(value) if value else 0
-                if num_value <= 0:
-                    invalid_or_missing.append(param)
-            except (ValueError, TypeError):
-                invalid_or_missing.append(param)
-        else:
-            if not str(value).strip():
-                invalid_or_missing.append(param)
 
-    if invalid_or_missing:
-        return f"❌ 缺少或无效参数：{', '.join(invalid_or_missing)}（请填写有效且非空的内容）"
+def generate_content_stream(kimi_api_key, template_type, use_cache=True, cancel=None):
+    """流式生成：从页面状态读取参数（使用本页带背景参数的模板），逐块产出累计文本
+    use_cache=False 表示强制重新生成：既不读缓存，也不与进行中的相同请求合并
+    参数在调用时立即读取（生成在后台线程中进行，后台线程不能访问页面状态）"""
+    return generate_stream(kimi_api_key, template_type, collect_params(template_type), use_cache, TEMPLATE_SET,
+                           coalesce=use_cache, cancel=cancel)
+
+
+def generate_content_variants_stream(kimi_api_key, template_type, variants, use_cache=True, cancel=None):
+    """多候选流式生成：并发生成 variants 个版本，产出 (各候选当前文本, 各候选是否结束)"""
+    return generate_variants_stream(kimi_api_key, template_type, collect_params(template_type), variants,
+                                    use_cache, TEMPLATE_SET, coalesce=use_cache, cancel=cancel)
+
+
+def generate_content(kimi_api_key, template_type, use_cache=True, variants=1):
+    """非流式生成：消费流式结果，返回最终完整文本；variants>1 时返回各候选最终文本的列表"""
+    if variants > 1:
+        contents = []
+        for contents, _ in generate_content_variants_stream(kimi_api_key, template_type, variants, use_cache):
+            pass
+        return contents
+    result = ""
+    for result in generate_content_stream(kimi_api_key, template_type, use_cache):
+        pass
+    return result
+
+
+def render_partial(placeholder, text, finished=False):
+    """流式输出的一次刷新：排队/重试提示、错误提示或带光标的正文"""
+    if text.startswith("⏳"):
+        placeholder.info(text)
+    elif text.startswith("❌"):
+        placeholder.error(text)
+    else:
+        placeholder.markdown(text + ("" if finished else "▌"))
+
+
+def start_generation():
+    """为本次生成创建取消令牌：点击「⏹ 停止生成」、页面重跑或关闭时取消，立即断开上游连接"""
+    cancel = CancelToken()
+    st.session_state["cancel_token"] = cancel
+    return cancel
+
+
+def stop_generation():
+    """「⏹ 停止生成」按钮回调：点击会中断正在运行的脚本并取消生成，这里兜底取消仍在进行的生成与后台任务"""
+    cancel = st.session_state.get("cancel_token")
+    if cancel is not None:
+        cancel.cancel()
+    cancel_job(st.session_state.get("job_id"))
+
+
+def track_job(job_id):
+    """本页跟随的后台任务：任务 id 同时写入页面地址，刷新页面或断线重连后按地址取回"""
+    st.session_state["job_id"] = job_id
+    if job_id:
+        st.query_params["job"] = job_id
+    elif "job" in st.query_params:
+        del st.query_params["job"]
+
+
+def show_job_result(result_box, job):
+    """展示已结束任务的结果（停止时为停止前已生成的部分）"""
+    content = job["content"]
+    if job["status"] == "cancelled":
+        if not content:
+            result_box.info("⏹ 已停止生成，停止前尚未产出内容")
+            return
+        result_box.warning("⏹ 已停止生成，以下为停止前已生成的部分内容（已记入生成历史）")
+        st.text_area("生成内容", value=content, height=500)
+    elif content.startswith("❌"):
+        result_box.error(content)
+    else:
+        result_box.success("✅ 生成完成！")
+        if job["status"] == "trimmed":
+            st.caption(TRIMMED_NOTE)
+        st.caption(f"🧭 {route_caption(job['template'], job['params'], job['template_set'])}")
+        st.text_area("生成内容", value=content, height=500)
+        stats = cache_stats()
+        st.caption(f"缓存命中 {stats['hits']} 次 | 未命中 {stats['misses']} 次 | "
+                   f"合并相同请求 {stats.get('coalesced', 0)} 次"
+                   + (f" | 对冲请求 {stats['hedged']} 次（先于原请求响应 {stats.get('hedge_wins', 0)} 次）"
+                      if stats.get('hedged') else ""))
+
 
+def follow_job(result_box, job_id):
+    """跟随后台任务：边生成边显示，按固定间隔刷新；任务结束后展示结果
+    停止跟随（重跑、刷新、关闭页面）不影响任务，下次运行时继续跟随或直接展示结果"""
+    timer = st.empty()
+    job = None
+    started = time.monotonic()
+    last_render = 0.0
+    render_seconds = 0.0
+    for update in watch_job(job_id):
+        now = time.monotonic()
+        if update is None:
+            render_heartbeat(timer, started)
+            continue
+        job = update
+        if job["status"] not in ("queued", "running"):
+            break
+        if not job["content"]:
+            # 排队、限流等待与自动重试提示
+            result_box.info(describe_job(job))
+        elif now - last_render >= STREAM_RENDER_INTERVAL:
+            result_box.markdown(job["content"] + "▌")
+            last_render = now
+        render_seconds += time.monotonic() - now
+    timer.empty()
+    if job is None:
+        # 任务已过期清理或来自其他数据目录
+        track_job(None)
+        return
+    if render_seconds:
+        observe_render("3.py", job["template"], render_seconds)
+    show_job_result(result_box, job)
+
+
+def render_heartbeat(placeholder, started):
+    """等待上游时的定期刷新：显示已用时；Streamlit 只在输出元素时响应停止、重跑与页面关闭"""
+    placeholder.caption(f"⏱️ 已用时 {time.monotonic() - started:.0f} 秒，可随时点击「⏹ 停止生成」")
+
+
+def stream_variants(kimi_api_key, template_type, variant_count, use_cache):
+    """多个候选并排流式展示，结束（或停止）后保存到页面状态，由候选片段展示与选用"""
+    placeholders = [col.empty() for col in st.columns(variant_count)]
+    timer = st.empty()
+    rendered = [None] * variant_count
+    contents = [""] * variant_count
+    cancel = start_generation()
+    updates = ticking(generate_content_variants_stream(kimi_api_key, template_type, variant_count, use_cache,
+                                                       cancel), cancel)
+    started = time.monotonic()
+    last_render = 0.0
+    render_seconds = 0.0
     try:
-        prompt = template.format(**param_dict)
-        response = client.chat.completions.create(
-            model=KIMI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=8192
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        error_info = str(e)
-        if "invalid api key" in error_info.lower():
-            return "❌ Kimi API密钥无效或已过期！"
-        elif "insufficient funds" in error_info.lower():
-            return "❌ Kimi账户余额不足，请充值！"
+        for update in updates:
+            now = time.monotonic()
+            if update is None:
+                render_heartbeat(timer, started)
+                continue
+            contents, finished = update
+            if now - last_render >= STREAM_RENDER_INTERVAL or all(finished):
+                for index, placeholder in enumerate(placeholders):
+                    state = (contents[index], finished[index])
+                    if state != rendered[index]:
+                        render_partial(placeholder, *state)
+                        rendered[index] = state
+                last_render = now
+            render_seconds += time.monotonic() - now
+    finally:
+        # 正常结束、点击停止、重跑或页面关闭都会走到这里：关闭生成（断开上游）并保存已生成的部分
+        updates.close()
+        st.session_state["cancel_token"] = None
+        st.session_state["variants"] = [
+            "❌ 已停止生成，该候选尚未产出内容" if cancel.cancelled and (not content or content.startswith("⏳"))
+            else content for content in contents
+        ]
+        st.session_state["variant_pinned"] = None
+        route = route_caption(template_type, collect_params(template_type), TEMPLATE_SET)
+        st.session_state["variants_route"] = route + (" · ⏹ 已停止生成（部分内容）" if cancel.cancelled else "")
+    for placeholder in placeholders:
+        placeholder.empty()
+    timer.empty()
+    observe_render("3.py", template_type, render_seconds)
+
+
+def accept_similar():
+    """「✅ 采用」回调：相似请求的结果作为本次结果展示（只展示一次）"""
+    st.session_state["adopted_result"] = st.session_state.pop("similar_match")
+
+
+def regenerate_similar():
+    """「🔄 重新生成」回调：不采用相似结果，按当前参数重新生成"""
+    st.session_state.pop("similar_match", None)
+    st.session_state["similar_regenerate"] = True
+
+
+def render_similar_panel(result_box, match):
+    """相似请求命中：展示以前生成的结果，由用户选择采用或重新生成"""
+    result_box.info(describe_match(match))
+    with st.container(height=300):
+        st.markdown(match["content"])
+    col_accept, col_regenerate, _ = st.columns([0.2, 0.2, 0.6])
+    with col_accept:
+        st.button("✅ 采用", on_click=accept_similar, type="primary", use_container_width=True,
+                  help="直接使用该结果，不调用模型、不产生费用")
+    with col_regenerate:
+        st.button("🔄 重新生成", on_click=regenerate_similar, use_container_width=True,
+                  help="按当前参数调用模型重新生成")
+
+
+def pin_variant(index):
+    st.session_state["variant_pinned"] = index
+
+
+@st.fragment
+def render_variants_panel():
+    """多候选片段：候选并排对比，选用其中一版后在下方展示全文，可直接复制编辑"""
+    variants = st.session_state.get("variants")
+    if not variants:
+        return
+    pinned = st.session_state.get("variant_pinned")
+    if st.session_state.get("variants_route"):
+        st.caption(f"🧭 {st.session_state['variants_route']}")
+    for index, (col, content) in enumerate(zip(st.columns(len(variants)), variants)):
+        with col, st.container(border=True):
+            st.markdown(f"**候选 {index + 1}**" + (" · 📌 已选用" if index == pinned else ""))
+            if content.startswith("❌"):
+                st.error(content)
+                continue
+            if is_trimmed(content):
+                st.caption(TRIMMED_NOTE)
+            with st.container(height=400, border=False):
+                st.markdown(content)
+            st.button("📌 选用", key=f"variant_pin_{index}", disabled=index == pinned, use_container_width=True,
+                      on_click=pin_variant, args=(index,))
+    if pinned is not None:
+        st.text_area(f"选用的候选 {pinned + 1}", value=variants[pinned], height=400, key=f"variant_text_{pinned}")
+
+
+@st.fragment
+def render_history_panel():
+    """历史记录片段：打开后才查询；关键词检索、游标翻页，点击查看时才读取全文"""
+    if not st.toggle("📚 历史记录（检索并复用以前生成的内容）", key="history_open"):
+        return
+    query = st.text_input("关键词", placeholder="在提示词与生成内容中检索，多个关键词用空格分隔", key="history_query")
+    if st.session_state.get("history_filter") != query:
+        st.session_state["history_filter"] = query
+        st.session_state["history_cursors"] = [None]
+    cursors = st.session_state["history_cursors"]
+    entries = search_history(query, None, cursors[-1], HISTORY_PAGE_SIZE + 1)
+    has_next = len(entries) > HISTORY_PAGE_SIZE
+    entries = entries[:HISTORY_PAGE_SIZE]
+    if not entries:
+        st.caption("暂无匹配的历史记录")
+        return
+
+    for entry in entries:
+        col_desc, col_view = st.columns([0.85, 0.15])
+        with col_desc:
+            st.caption(describe_entry(entry))
+            st.write(entry["preview"] + ("…" if entry["output_chars"] > len(entry["preview"]) else ""))
+        with col_view:
+            if st.button("📄 查看", key=f"history_view_{entry['id']}", use_container_width=True):
+                st.session_state["history_selected"] = entry["id"]
+
+    col_prev, col_page, col_next = st.columns([0.2, 0.6, 0.2])
+    with col_prev:
+        if st.button("⬅️ 上一页", disabled=len(cursors) == 1, use_container_width=True, key="history_prev"):
+            cursors.pop()
+            st.rerun(scope="fragment")
+    with col_page:
+        st.caption(f"第 {len(cursors)} 页")
+    with col_next:
+        if st.button("下一页 ➡️", disabled=not has_next, use_container_width=True, key="history_next"):
+            cursors.append(entries[-1]["id"])
+            st.rerun(scope="fragment")
+
+    selected = st.session_state.get("history_selected")
+    if selected:
+        full = get_history_entry(selected)
+        if full is None:
+            st.error("❌ 该历史记录已不存在")
         else:
-            return f"❌ 生成失败：{error_info}"
+            st.caption(f"📄 历史记录 #{full['id']} · 参数：{'，'.join(f'{k}={v}' for k, v in full['params'].items())}")
+            st.text_area("历史内容", value=full["output"], height=400, key=f"history_text_{full['id']}")
 
 # ===================== 3. 页面主逻辑（五彩渐变背景+背景参数） =====================
 def main():
@@ -91,6 +305,11 @@ def main():
         page_icon="✍️",
         layout="wide"
     )
+    # 指标旁路服务（进程内只启动一次）
+    start_metrics_server(METRICS_PORT)
+    # 本页跟随的后台任务；刷新页面后从地址中的 ?job= 取回
+    if "job_id" not in st.session_state:
+        st.session_state["job_id"] = st.query_params.get("job")
 
     # 五彩渐变背景（核心修改部分）
     st.markdown("""
@@ -125,7 +344,7 @@ def main():
     st.title("📝 AI 文字生成工具 (Kimi 版)")
     st.divider()
     st.info("✅ 操作步骤：1.输入Kimi密钥 → 2.选择模板 → 3.填写参数 → 4.点击生成")
-    st.caption(f"当前使用模型：{KIMI_MODEL} | 国内接口 ✔ 无需代理 ✔")
+    st.caption("模型按输入规模自动选择（moonshot-v1-8k / 32k / 128k）| 国内接口 ✔ 无需代理 ✔")
     st.divider()
 
     # 1. API密钥输入
@@ -133,7 +352,7 @@ def main():
         label="🔑 Kimi API 密钥",
         type="password",
         placeholder="请输入你的Kimi密钥 (格式：sk-xxxxxxxxxxxxxxxxxx)",
-        help="密钥从月之暗面(Kimi)官网获取，请勿泄露给他人"
+        help="密钥从月之暗面(Kimi)官网获取，请勿泄露给他人；部署方配置了共享密钥池时可留空"
     )
     st.divider()
 
@@ -175,25 +394,77 @@ def main():
             elif param == "用户输入":
                 st.text_area("自由创作需求", placeholder="请详细描述你的创作需求，越详细生成效果越好...", height=200, key="用户输入")
 
+    # 生成前预估（本地估算，按输入文本缓存）
+    preflight = estimate_caption(template_type, collect_params(template_type), TEMPLATE_SET)
+    if preflight:
+        st.caption(f"💰 {preflight}")
+
     st.divider()
 
     # 4. 生成按钮 + 结果展示（无修改）
-    col_btn, _ = st.columns([0.2, 0.8])
+    col_btn, col_stop, col_variants, col_cache, _ = st.columns([0.2, 0.15, 0.15, 0.3, 0.2])
     with col_btn:
         generate_btn = st.button("🚀 立即生成", type="primary", use_container_width=True)
+    with col_stop:
+        st.button("⏹ 停止生成", on_click=stop_generation, use_container_width=True,
+                  help="立即停止生成并断开与模型的连接，已生成的部分会保留")
+    with col_variants:
+        variant_count = st.number_input("🎯 候选数量", min_value=1, max_value=MAX_VARIANTS, value=1, step=1,
+                                        help=f"一次并发生成多个版本并排对比（最多 {MAX_VARIANTS} 个），"
+                                             "总耗时接近生成一个；选用最满意的一版")
+    with col_cache:
+        bypass_cache = st.checkbox("🔄 跳过缓存，强制重新生成",
+                                   help="默认相同参数直接复用已生成的结果，并与他人同时发起的相同请求共用一次生成；"
+                                        "勾选后单独重新调用模型，得到新的结果")
+        similar_threshold = st.slider("♻️ 相似请求复用阈值", min_value=0.5, max_value=1.0, value=SIMILAR_THRESHOLD,
+                                      step=0.05, key="similar_threshold",
+                                      help="参数与以前的请求足够相似时先展示以前的结果，供采用或重新生成")
 
     st.divider()
     st.subheader("📄 生成结果", divider=True)
     result_box = st.empty()
 
-    if generate_btn:
+    # 「🔄 重新生成」跳过相似请求检查
+    regenerate = st.session_state.pop("similar_regenerate", False)
+    match = None
+    if generate_btn and variant_count == 1 and not bypass_cache:
+        match = find_similar(template_type, collect_params(template_type), TEMPLATE_SET, similar_threshold)
+    if generate_btn or regenerate:
+        st.session_state.pop("similar_match", None)
+        # 新的生成开始时取消本页仍在进行的上一个后台任务
+        cancel_job(st.session_state.get("job_id"))
+        track_job(None)
+
+    if generate_btn and variant_count > 1:
+        with st.spinner("✨ AI 正在并发生成多个候选，请稍候..."):
+            stream_variants(kimi_api_key, template_type, variant_count, not bypass_cache)
+    elif match:
+        st.session_state["variants"] = []
+        st.session_state["similar_match"] = match
+        render_similar_panel(result_box, match)
+    elif generate_btn or regenerate:
+        st.session_state["variants"] = []
+        if "job_session" not in st.session_state:
+            st.session_state["job_session"] = new_job_session()
+        job_id = submit_job(kimi_api_key, template_type, collect_params(template_type), TEMPLATE_SET,
+                            not bypass_cache, job_owner(kimi_api_key, st.session_state["job_session"]))
+        track_job(job_id)
         with st.spinner("✨ AI 正在生成内容，请稍候..."):
-            result = generate_content(kimi_api_key, template_type)
-            if result.startswith("❌"):
-                result_box.error(result)
-            else:
-                result_box.success("✅ 生成完成！")
-                st.text_area("生成内容", value=result, height=500)
+            follow_job(result_box, job_id)
+    elif st.session_state.get("similar_match"):
+        render_similar_panel(result_box, st.session_state["similar_match"])
+    elif "adopted_result" in st.session_state:
+        # 采用了相似请求的结果（只展示一次）
+        adopted = st.session_state.pop("adopted_result")
+        result_box.success(f"✅ 已采用相似请求的结果（相似度 {adopted['similarity']:.0%}），未调用模型")
+        st.text_area("生成内容", value=adopted["content"], height=500)
+    elif st.session_state.get("job_id"):
+        # 重跑、刷新或重新连接：继续跟随后台任务，已结束的直接展示结果
+        follow_job(result_box, st.session_state["job_id"])
+    render_variants_panel()
+
+    st.divider()
+    render_history_panel()
 
 if __name__ == "__main__":
 
@@ -0,0 +1 @@
+"""本地压测与基准工具（不访问真实 Kimi 接口）"""
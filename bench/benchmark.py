@@ -0,0 +1,423 @@
+"""基准测试：在本地模拟接口上逐级加压，驱动三个界面的生成函数以及 2.py 的 Gradio HTTP 接口
+
+用法：
+    python -m bench.benchmark --targets 1.py 2.py 3.py gradio-http --users 1 10 50 --output bench_results.jsonl
+    python -m bench.benchmark --users 20 --rate-limit-rate 0.1 --seed 7      # 注入 429，观察重试对延迟的影响
+    python -m bench.benchmark --replay fixtures.jsonl                        # 用录制的真实回复节奏回放
+    python -m bench.benchmark --compare base.jsonl new.jsonl                 # 对比两次结果，退化时退出码为 1
+    python -m bench.benchmark --check-render --targets 1.py 3.py             # 检查页面流式刷新节流，超出时退出码为 1
+
+目标说明：
+- 1.py / 3.py：在同一进程内加载页面脚本，每个并发会话一个线程调用 generate_content_stream
+  （与 Streamlit 每个会话一个脚本线程一致）；
+- 2.py：在事件循环上并发调用异步的 generate_content_stream；
+- gradio-http：在本进程启动 2.py 的 Gradio 服务，用 gradio_client 通过 HTTP 调用 /generate。
+未安装 gradio / gradio_client 时跳过对应目标并提示，其余目标照常压测，结束时退出码为 1。
+每档输出一行 JSON：延迟与首字延迟（TTFT）的 p50/p95/p99、吞吐、每会话内存增量、模拟接口计数，
+并带上当前提交号，便于在不同提交之间对比。
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.load_test import percentile
+from bench.mock_server import add_mock_arguments, mock_config_from_args, start_mock_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = "sk-benchmark"
+TEMPLATE = "故事生成"
+PARAMS = {"主题": "星空", "风格": "治愈", "字数": 300}
+BACKGROUND_PARAMS = dict(PARAMS, 背景="校园")
+TARGETS = ["1.py", "2.py", "3.py", "gradio-http"]
+COMPARE_KEYS = [("p95", "higher"), ("ttft_p95", "higher"), ("requests_per_second", "lower")]
+
+
+# ===================== 1. 采样工具 =====================
+def current_rss():
+    """当前进程常驻内存（字节），非 Linux 平台退化为峰值常驻内存"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    """后台线程定期采样常驻内存，记录压测期间的峰值"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.baseline = current_rss()
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class Timing:
+    """单个请求的耗时记录：首个正文分块到达时间与结束时间（均相对压测开始）"""
+
+    def __init__(self, start):
+        self.start = start
+        self.ttft = None
+        self.latency = None
+        self.error = False
+
+    def see(self, text):
+        if self.ttft is None and text and not text.startswith(("⏳", "❌")):
+            self.ttft = time.perf_counter() - self.start
+
+    def finish(self, text):
+        self.latency = time.perf_counter() - self.start
+        self.error = not text or text.startswith("❌")
+
+
+# ===================== 2. 压测目标 =====================
+def load_app(name):
+    """按文件路径加载页面脚本（文件名以数字开头，无法直接 import）"""
+    spec = importlib.util.spec_from_file_location(f"kimi_bench_app_{name[0]}", os.path.join(ROOT, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StreamlitTarget:
+    """1.py / 3.py：参数从页面状态读取，无 Streamlit 运行时时 session_state 为进程内共享字典"""
+
+    def __init__(self, name):
+        self.module = load_app(name)
+        params = BACKGROUND_PARAMS if name == "3.py" else PARAMS
+        for param, value in params.items():
+            self.module.st.session_state[param] = value
+
+    def one(self, start):
+        timing = Timing(start)
+        text = ""
+        for text in self.module.generate_content_stream(API_KEY, TEMPLATE, use_cache=False):
+            timing.see(text)
+        timing.finish(text)
+        return timing
+
+    def run(self, sessions, per_session):
+        return run_threads(self.one, sessions, per_session)
+
+    def close(self):
+        pass
+
+
+def gradio_inputs(module):
+    """2.py 全部参数组件的输入值：压测参数之外取组件的默认值（数字组件不接受空字符串）"""
+    return [PARAMS.get(name, component.value) for name, component in module.all_params.items()]
+
+
+class GradioFunctionTarget:
+    """2.py：直接调用异步生成函数，所有会话共用一个事件循环"""
+
+    def __init__(self):
+        self.module = load_app("2.py")
+        self.inputs = gradio_inputs(self.module)
+
+    async def one(self, start):
+        timing = Timing(start)
+        text = ""
+        # 跳过缓存（bypass_cache=True）时不检查相似请求，阈值不起作用
+        async for text, *_ in self.module.generate_content_stream(API_KEY, TEMPLATE, list(PARAMS), True, 1.0,
+                                                                  *self.inputs):
+            timing.see(text)
+        timing.finish(text)
+        return timing
+
+    def run(self, sessions, per_session):
+        start = time.perf_counter()
+
+        async def session():
+            return [await self.one(start) for _ in range(per_session)]
+
+        async def all_sessions():
+            return await asyncio.gather(*(session() for _ in range(sessions)))
+
+        return [timing for timings in asyncio.run(all_sessions()) for timing in timings], start
+
+    def close(self):
+        pass
+
+
+class GradioHTTPTarget:
+    """2.py 的 Gradio 服务：本进程启动，经 HTTP 调用 /generate（含 Gradio 排队与推送开销）"""
+
+    def __init__(self):
+        from gradio_client import Client
+
+        self.module = load_app("2.py")
+        port = free_port()
+        self.module.demo.launch(server_name="127.0.0.1", server_port=port, prevent_thread_lock=True,
+                                inbrowser=False, quiet=True, show_error=True)
+        self.client = Client(f"http://127.0.0.1:{port}/", verbose=False)
+        self.inputs = gradio_inputs(self.module)
+
+    def one(self, start):
+        timing = Timing(start)
+        text = ""
+        job = self.client.submit(API_KEY, TEMPLATE, True, 1.0, *self.inputs, api_name="/generate")
+        for text, *_ in job:
+            timing.see(text)
+        outputs = job.outputs()
+        if outputs:
+            text = outputs[-1][0]
+        timing.finish(text)
+        return timing
+
+    def run(self, sessions, per_session):
+        return run_threads(self.one, sessions, per_session)
+
+    def close(self):
+        self.client.close()
+        self.module.demo.close()
+
+
+def run_threads(one, sessions, per_session):
+    """每个会话一个线程，会话内顺序发起 per_session 次生成；延迟从全部会话到达时刻算起"""
+    start = time.perf_counter()
+
+    def session(_):
+        return [one(start) for _ in range(per_session)]
+
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = list(executor.map(session, range(sessions)))
+    return [timing for timings in results for timing in timings], start
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def require_gradio(name):
+    """Gradio 目标的依赖检查：未安装时给出明确提示，不在加载页面脚本时才报 ModuleNotFoundError"""
+    modules = ["gradio", "gradio_client"] if name == "gradio-http" else ["gradio"]
+    missing = [module for module in modules if importlib.util.find_spec(module) is None]
+    if missing:
+        raise RuntimeError(f"未安装 {' / '.join(missing)}，无法压测 {name}（pip install -r requirements.txt）")
+
+
+def create_target(name):
+    if name in ("2.py", "gradio-http"):
+        require_gradio(name)
+    if name in ("1.py", "3.py"):
+        return StreamlitTarget(name)
+    if name == "2.py":
+        return GradioFunctionTarget()
+    if name == "gradio-http":
+        return GradioHTTPTarget()
+    raise ValueError(f"未知目标：{name}")
+
+
+# ===================== 3. 流式刷新节流检查 =====================
+class CountingPlaceholder:
+    """代替 st.empty() 的占位元素：只统计正文（markdown）刷新次数，其余调用忽略"""
+
+    def __init__(self):
+        self.renders = 0
+
+    def markdown(self, *args, **kwargs):
+        self.renders += 1
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def check_render_throttle(name, updates=400, duration=1.0):
+    """把页面的任务跟随循环（follow_job）接到一串快速到达的合成进度上，统计正文实际刷新次数：
+    按 STREAM_RENDER_INTERVAL 节流时应不超过 实际耗时 / 间隔 + 2 次，远少于进度更新次数"""
+    module = load_app(name)
+    params = BACKGROUND_PARAMS if name == "3.py" else PARAMS
+    job = {"id": "bench-render", "owner": "", "priority": 0, "status": "running", "template": TEMPLATE,
+           "template_set": getattr(module, "TEMPLATE_SET", "default"), "params": params, "content": "",
+           "created": time.time(), "started": time.time(), "finished": None, "notice": "", "version": 0,
+           "position": 0}
+
+    def fake_watch(job_id, interval=None):
+        for index in range(1, updates + 1):
+            time.sleep(duration / updates)
+            yield dict(job, content="测" * index, version=index)
+        yield dict(job, status="done", content="测" * updates, version=updates + 1, finished=time.time())
+
+    placeholders = []
+
+    def counting_empty():
+        placeholders.append(CountingPlaceholder())
+        return placeholders[-1]
+
+    # 页面主函数中初始化的状态（结果区正文存储所属的会话）
+    module.st.session_state["content_session"] = "bench-render"
+    original_empty = module.st.empty
+    module.watch_job, module.st.empty = fake_watch, counting_empty
+    start = time.perf_counter()
+    try:
+        if name == "3.py":
+            module.follow_job(counting_empty(), job["id"])
+        else:
+            module.follow_job(job["id"])
+    finally:
+        module.st.empty = original_empty
+    limit = int((time.perf_counter() - start) / module.STREAM_RENDER_INTERVAL) + 2
+    renders = sum(placeholder.renders for placeholder in placeholders)
+    return {"target": name, "updates": updates, "renders": renders, "limit": limit, "ok": 0 < renders <= limit}
+
+
+# ===================== 4. 汇总与对比 =====================
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def summarize(target, sessions, timings, wall, sampler, mock_config):
+    latencies = [t.latency for t in timings]
+    ttfts = [t.ttft for t in timings if t.ttft is not None]
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": target,
+        "users": sessions,
+        "requests": len(timings),
+        "errors": sum(t.error for t in timings),
+        "p50": round(percentile(latencies, 50), 4),
+        "p95": round(percentile(latencies, 95), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "ttft_p50": round(percentile(ttfts, 50), 4),
+        "ttft_p95": round(percentile(ttfts, 95), 4),
+        "ttft_p99": round(percentile(ttfts, 99), 4),
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(timings) / wall, 2) if wall else 0.0,
+        "rss_per_session_kb": round(max(0, sampler.peak - sampler.baseline) / sessions / 1024, 1),
+        "upstream": mock_config.counters()
+    }
+
+
+def compare(base_path, new_path, threshold):
+    """按 (目标, 并发数) 对比两次结果，延迟上升或吞吐下降超过阈值记为退化，返回退化条数"""
+    def load(path):
+        rows = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    rows[(row["target"], row["users"])] = row  # 同一档位多次运行时取最后一次
+        return rows
+
+    base, new = load(base_path), load(new_path)
+    regressions = 0
+    print(f"{'target':>12} {'users':>6} {'metric':>20} {'base':>10} {'new':>10} {'change':>8}")
+    for key in sorted(set(base) & set(new)):
+        for metric, worse in COMPARE_KEYS:
+            old, cur = base[key][metric], new[key][metric]
+            change = (cur - old) / old if old else 0.0
+            regressed = change > threshold if worse == "higher" else change < -threshold
+            regressions += regressed
+            print(f"{key[0]:>12} {key[1]:>6} {metric:>20} {old:>10} {cur:>10} {change:>+7.1%}"
+                  f"{'  ⚠️ 退化' if regressed else ''}")
+    return regressions
+
+
+# ===================== 5. 入口 =====================
+def main():
+    parser = argparse.ArgumentParser(description="三个界面与 Gradio HTTP 接口的生成基准测试")
+    parser.add_argument("--targets", nargs="+", default=TARGETS, choices=TARGETS, help="压测目标")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 50], help="并发会话数档位")
+    parser.add_argument("--requests-per-user", type=int, default=1, help="每个会话顺序发起的生成次数")
+    parser.add_argument("--output", help="结果追加写入 JSONL 文件（默认只打印）")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="对比两个结果文件")
+    parser.add_argument("--threshold", type=float, default=0.1, help="对比时判定退化的相对变化阈值")
+    parser.add_argument("--check-render", action="store_true", help="只检查 1.py / 3.py 的流式刷新节流")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    server, base_url, mock_config = start_mock_server(**mock_config_from_args(args))
+    # 引擎在导入时读取配置：指向模拟接口，放宽连接池，客户端限流不应成为瓶颈（429 由模拟接口注入）
+    os.environ["KIMI_BASE_URL"] = base_url
+    os.environ.pop("KIMI_SERVICE_URL", None)
+    os.environ["KIMI_POOL_MAX_CONNECTIONS"] = str(max(args.users) * 2)
+    os.environ["KIMI_POOL_MAX_KEEPALIVE"] = str(max(args.users) * 2)
+    os.environ.setdefault("KIMI_RATE_LIMIT_RPM", "1000000")
+    os.environ.setdefault("KIMI_RATE_LIMIT_TPM", "1000000000")
+    os.environ.setdefault("KIMI_METRICS", "0")
+    os.environ.setdefault("KIMI_DATA_DIR", tempfile.mkdtemp(prefix="kimi_bench_"))
+    sys.path.insert(0, ROOT)
+
+    if args.check_render:
+        checks = [check_render_throttle(name) for name in args.targets if name in ("1.py", "3.py")]
+        for row in checks:
+            print(json.dumps(row, ensure_ascii=False))
+        server.shutdown()
+        sys.exit(0 if checks and all(row["ok"] for row in checks) else 1)
+
+    results = []
+    skipped = []
+    for name in args.targets:
+        try:
+            target = create_target(name)
+        except Exception as e:
+            # 缺少 gradio 等依赖时跳过该目标，其他目标照常压测，结束时退出码为 1
+            print(f"❌ 跳过 {name}：{type(e).__name__}: {str(e)}", file=sys.stderr)
+            skipped.append(name)
+            continue
+        try:
+            for sessions in args.users:
+                mock_config.reset_counters()
+                with RssSampler() as sampler:
+                    timings, start = target.run(sessions, args.requests_per_user)
+                    wall = time.perf_counter() - start
+                row = summarize(name, sessions, timings, wall, sampler, mock_config)
+                results.append(row)
+                print(json.dumps(row, ensure_ascii=False))
+        finally:
+            target.close()
+
+    print(f"\n{'target':>12} {'users':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'ttft50':>7} {'req/s':>7} "
+          f"{'KB/sess':>8} {'err':>4}", file=sys.stderr)
+    for row in results:
+        print(f"{row['target']:>12} {row['users']:>6} {row['p50']:>7} {row['p95']:>7} {row['p99']:>7} "
+              f"{row['ttft_p50']:>7} {row['requests_per_second']:>7} {row['rss_per_session_kb']:>8} "
+              f"{row['errors']:>4}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    server.shutdown()
+    if skipped:
+        print(f"❌ 未压测的目标：{', '.join(skipped)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""正文存储基准：大量会话各自持有长结果时，对比页面状态直接保存全文与只保存句柄的常驻内存
+
+用法：python -m bench.content_benchmark --sessions 1000 --chars 8000 --results 3 --memory-limit 8388608
+
+每个会话依次得到 --results 篇 --chars 字的结果（各不相同），模拟：
+- inline：页面状态保存全文，且文本框的组件状态再保存一份（改版前的 1.py）；
+- store：页面状态只保存句柄，正文写入 kimi.content，内存中按会话与全进程上限保留最近使用的正文。
+内存为 tracemalloc 统计的 Python 分配量（当前值 / 峰值）；store 额外列出磁盘读写次数。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def make_text(session, result, chars):
+    prefix = f"会话{session}结果{result}："
+    return prefix + "测" * (chars - len(prefix))
+
+
+def run_inline(args):
+    sessions = {}
+    for session in range(args.sessions):
+        for result in range(args.results):
+            text = make_text(session, result, args.chars)
+            sessions[session] = {"generated_content": text, "result_textarea": (text + "\n")[:-1]}
+    return sessions
+
+
+def run_store(args, content):
+    store = content.ContentStore(os.path.join(args.data_dir, "content"), args.session_memory, args.memory_limit)
+    sessions = {}
+    for session in range(args.sessions):
+        for result in range(args.results):
+            sessions[session] = {"result_handle": store.put(make_text(session, result, args.chars), session)}
+        # 每个会话重跑几次页面：按句柄读取当前结果
+        for _ in range(3):
+            store.get(sessions[session]["result_handle"], session)
+    # 早期会话回到页面：内存已被淘汰的从磁盘读取
+    for session in range(min(args.sessions, 20)):
+        store.get(sessions[session]["result_handle"], session)
+    return sessions, store
+
+
+def measure(run):
+    tracemalloc.start()
+    started = time.perf_counter()
+    kept = run()
+    seconds = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, current, peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="页面状态保存全文与正文存储的常驻内存对比")
+    parser.add_argument("--sessions", type=int, default=1000, help="会话数")
+    parser.add_argument("--chars", type=int, default=8000, help="每篇结果的字数")
+    parser.add_argument("--results", type=int, default=3, help="每个会话先后得到的结果数")
+    parser.add_argument("--session-memory", type=int, default=1024 * 1024, help="每个会话的正文内存上限（字节）")
+    parser.add_argument("--memory-limit", type=int, default=8 * 1024 * 1024, help="全进程的正文内存上限（字节）")
+    parser.add_argument("--data-dir", default=tempfile.mkdtemp(prefix="kimi_bench_"), help="正文文件目录")
+    parser.add_argument("--output", help="结果追加写入 JSONL 文件（默认只打印）")
+    args = parser.parse_args()
+    os.environ.setdefault("KIMI_DATA_DIR", args.data_dir)
+    from kimi import content
+
+    results = []
+    _, current, peak, seconds = measure(lambda: run_inline(args))
+    results.append({"mode": "inline", "current_mb": round(current / 2 ** 20, 1), "peak_mb": round(peak / 2 ** 20, 1),
+                    "seconds": round(seconds, 3)})
+    kept, current, peak, seconds = measure(lambda: run_store(args, content))
+    stats = kept[1].stats()
+    results.append({"mode": "store", "current_mb": round(current / 2 ** 20, 1), "peak_mb": round(peak / 2 ** 20, 1),
+                    "seconds": round(seconds, 3), "disk_reads": stats["disk_reads"],
+                    "disk_writes": stats["disk_writes"], "evictions": stats["evictions"]})
+    for row in results:
+        print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+
+    print(f"\n{'mode':>6} {'current_mb':>10} {'peak_mb':>8} {'seconds':>8}")
+    for row in results:
+        print(f"{row['mode']:>6} {row['current_mb']:>10} {row['peak_mb']:>8} {row['seconds']:>8}")
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""对冲请求基准：上游有少量请求异常缓慢时，对比开启/关闭对冲的延迟分位数与额外上游请求数
+
+用法：python -m bench.hedge_benchmark --requests 400 --concurrency 8 --slow-rate 0.03 --slow-latency 5
+
+模拟接口按 --slow-rate 的比例让请求在首个 token 前等待 --slow-latency 秒，其余请求等待 --latency 秒。
+两轮各发起相同数量的请求（先预热积累延迟样本）：
+- off：关闭对冲；
+- on：开启对冲，等待超过最近延迟的 --percentile 分位数仍无响应时发出对冲请求，对冲比例不超过 --max-rate。
+输出两轮的 p50 / p95 / p99（秒）、上游请求数（含对冲）、对冲次数与对冲先响应次数。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.load_test import PARAMS, percentile
+from bench.mock_server import start_mock_server
+
+
+def run_round(engine, hedge, mock_config, enabled, args):
+    hedge.set_hedge_policy(enabled=enabled, percentile=args.percentile, min_delay=args.min_delay,
+                           max_rate=args.max_rate, min_samples=args.warmup)
+
+    async def one(semaphore):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await engine.generate_async("sk-bench", "故事生成", PARAMS, use_cache=False, coalesce=False)
+            return time.perf_counter() - started, result.startswith("❌")
+
+    async def batch(count):
+        semaphore = asyncio.Semaphore(args.concurrency)
+        return await asyncio.gather(*(one(semaphore) for _ in range(count)))
+
+    # 预热：积累延迟样本（不计入结果）
+    asyncio.run(batch(args.warmup))
+    mock_config.reset_counters()
+    before = hedge.hedge_stats()
+    start = time.perf_counter()
+    outcomes = asyncio.run(batch(args.requests))
+    wall = time.perf_counter() - start
+    after = hedge.hedge_stats()
+    latencies = [latency for latency, failed in outcomes if not failed]
+    counters = mock_config.counters()
+    return {
+        "hedge": "on" if enabled else "off",
+        "requests": args.requests,
+        "wall_seconds": round(wall, 3),
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(max(latencies), 3) if latencies else 0.0,
+        "errors": sum(failed for _, failed in outcomes),
+        "upstream_requests": counters["requests"],
+        "slow_injected": counters["slow"],
+        "hedged": after["hedged"] - before["hedged"],
+        "hedge_wins": after["hedge_wins"] - before["hedge_wins"],
+        "denied": after["denied"] - before["denied"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对冲请求长尾延迟基准")
+    parser.add_argument("--requests", type=int, default=400, help="每轮请求数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的请求数")
+    parser.add_argument("--warmup", type=int, default=40, help="每轮预热请求数（同时作为对冲所需的最少样本数）")
+    parser.add_argument("--latency", type=float, default=0.2, help="正常请求的首 token 延迟（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="长尾请求比例")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="长尾请求的首 token 延迟（秒）")
+    parser.add_argument("--tokens", type=int, default=20, help="模拟回复分块数")
+    parser.add_argument("--percentile", type=float, default=0.95, help="对冲等待时间取最近延迟的该分位数")
+    parser.add_argument("--min-delay", type=float, default=0.3, help="对冲前至少等待的秒数")
+    parser.add_argument("--max-rate", type=float, default=0.05, help="对冲请求数不超过请求数的比例")
+    parser.add_argument("--output", help="结果追加写入 JSONL 文件（默认只打印）")
+    args = parser.parse_args()
+
+    server, base_url, mock_config = start_mock_server(latency=args.latency, tokens=args.tokens, token_interval=0.01,
+                                                      slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                                                      seed=7)
+    # 引擎在导入时读取配置：指向模拟接口，放宽客户端令牌桶，避免本地排队影响延迟
+    os.environ["KIMI_BASE_URL"] = base_url
+    os.environ["KIMI_RATE_LIMIT_RPM"] = "1000000"
+    os.environ["KIMI_RATE_LIMIT_TPM"] = "1000000000"
+    os.environ.setdefault("KIMI_DATA_DIR", tempfile.mkdtemp(prefix="kimi_bench_"))
+    from kimi import engine, hedge
+
+    results = []
+    for enabled in (False, True):
+        row = run_round(engine, hedge, mock_config, enabled, args)
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+
+    print(f"\n{'hedge':>5} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} {'upstream':>9} {'hedged':>7} {'wins':>5}")
+    for row in results:
+        print(f"{row['hedge']:>5} {row['p50']:>7} {row['p95']:>7} {row['p99']:>7} {row['max']:>7} "
+              f"{row['upstream_requests']:>9} {row['hedged']:>7} {row['hedge_wins']:>5}")
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""生成历史检索基准：写入大量模拟记录后，测量翻页、关键词检索与读取全文的耗时
+
+用法：python -m bench.history_benchmark --rows 200000 --repeat 20
+
+模拟记录由若干主题、风格与常用字随机组合，正文约 600 字；输出每类查询耗时的中位数（毫秒）
+以及数据库文件大小，便于确认数十万条记录时检索仍在毫秒级。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from kimi.history import HistoryStore
+
+TOPICS = ["星空", "友情", "冒险", "成长", "海洋", "森林", "城市", "故乡", "梦想", "时间"]
+STYLES = ["治愈", "悬疑", "科幻", "古风", "幽默"]
+TEMPLATES = ["故事生成", "营销文案", "论文提纲", "自由创作"]
+COMMON_CHARS = "的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所同日手又行意动"
+
+
+def fake_output(rng, topic, style):
+    body = "".join(rng.choice(COMMON_CHARS) for _ in range(560))
+    return f"{style}风格的{topic}故事。{body[:280]}{topic}{body[280:]}"
+
+
+def populate(store, rows, seed=1):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for _ in range(rows):
+        topic, style, template = rng.choice(TOPICS), rng.choice(STYLES), rng.choice(TEMPLATES)
+        params = {"主题": topic, "风格": style, "字数": 600}
+        prompt = f"请以{topic}为核心，写一个{style}风格的短篇故事，字数控制在600字左右。"
+        store.add(template, "default", params, "moonshot-v1-8k", prompt, fake_output(rng, topic, style), 40, 700,
+                  12.5, 0.8)
+    return time.perf_counter() - started
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成历史检索基准")
+    parser.add_argument("--rows", type=int, default=200000, help="模拟记录条数")
+    parser.add_argument("--repeat", type=int, default=20, help="每类查询重复次数（取中位数）")
+    parser.add_argument("--db", help="数据库路径（默认临时文件）")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="kimi_history_bench_"), "history.db")
+    store = HistoryStore(db_path)
+    insert_seconds = populate(store, args.rows) if store.count() < args.rows else 0.0
+    last_id = store.search(limit=1)[0]["id"]
+    deep_cursor = last_id - args.rows * 9 // 10
+
+    results = {
+        "rows": store.count(),
+        "insert_per_row_ms": round(insert_seconds / args.rows * 1000, 3) if insert_seconds else None,
+        "db_megabytes": round(os.path.getsize(db_path) / 1024 / 1024, 1),
+        "latest_page_ms": timed(lambda: store.search(), args.repeat),
+        "deep_page_ms": timed(lambda: store.search(before_id=deep_cursor), args.repeat),
+        "template_page_ms": timed(lambda: store.search(template_type="营销文案"), args.repeat),
+        "common_term_ms": timed(lambda: store.search("星空"), args.repeat),
+        "common_term_deep_page_ms": timed(lambda: store.search("星空", before_id=deep_cursor), args.repeat),
+        "phrase_ms": timed(lambda: store.search("治愈风格的星空"), args.repeat),
+        "term_and_template_ms": timed(lambda: store.search("科幻 海洋", template_type="故事生成"), args.repeat),
+        "no_match_ms": timed(lambda: store.search("量子纠缠"), args.repeat),
+        "get_entry_ms": timed(lambda: store.get(deep_cursor), args.repeat)
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
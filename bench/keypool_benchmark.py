@@ -0,0 +1,94 @@
+"""共享密钥池压测：上游按密钥限流时，对比不同密钥数量下的总吞吐、延迟与失败数
+
+用法：python -m bench.keypool_benchmark --keys 1 2 4 6 --requests 60 --key-limit 10 --key-window 5
+
+模拟接口对每个密钥限制“每 key-window 秒最多 key-limit 个请求”，超出返回 429 与剩余等待时间；
+--broke-keys 指定的个数的密钥返回余额不足（验证冷却后不再分配）。
+客户端令牌桶放宽到不限流，瓶颈只在上游的按密钥额度，吞吐应随密钥数量近似线性增长。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.load_test import PARAMS, percentile
+from bench.mock_server import start_mock_server
+
+
+def run_round(engine, keypool, mock_config, size, broke, requests):
+    keys = [f"sk-pool{size}-{index}" for index in range(size)]
+    mock_config.broke_keys = set(keys[:broke])
+    keypool.set_key_pool(keys)
+    mock_config.reset_counters()
+    start = time.perf_counter()
+
+    async def one():
+        # 不填写密钥：由共享密钥池分配
+        result = await engine.generate_async("", "故事生成", PARAMS, use_cache=False, coalesce=False)
+        return time.perf_counter() - start, result.startswith("❌")
+
+    async def all_requests():
+        return await asyncio.gather(*(one() for _ in range(requests)))
+
+    outcomes = asyncio.run(all_requests())
+    wall = time.perf_counter() - start
+    latencies = [latency for latency, failed in outcomes if not failed]
+    counters = mock_config.counters()
+    return {
+        "keys": size,
+        "broke_keys": broke,
+        "requests": requests,
+        "wall_seconds": round(wall, 3),
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "requests_per_second": round(len(latencies) / wall, 2) if wall else 0.0,
+        "errors": sum(failed for _, failed in outcomes),
+        "upstream_429": counters["key_rejected"],
+        "per_key": counters["key_served"],
+        "cooling_after": sum(1 for state in keypool.pool_stats() if state["cooldown_reason"])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享密钥池吞吐压测")
+    parser.add_argument("--keys", type=int, nargs="+", default=[1, 2, 4, 6], help="密钥数量档位")
+    parser.add_argument("--requests", type=int, default=60, help="每档同时发起的请求数")
+    parser.add_argument("--key-limit", type=int, default=10, help="每个密钥在窗口内最多处理的请求数")
+    parser.add_argument("--key-window", type=float, default=5.0, help="按密钥限流的窗口（秒）")
+    parser.add_argument("--broke-keys", type=int, default=0, help="其中返回余额不足的密钥个数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟接口首 token 延迟（秒）")
+    parser.add_argument("--tokens", type=int, default=20, help="模拟回复分块数")
+    parser.add_argument("--output", help="结果追加写入 JSONL 文件（默认只打印）")
+    args = parser.parse_args()
+
+    server, base_url, mock_config = start_mock_server(latency=args.latency, tokens=args.tokens, token_interval=0.01,
+                                                      key_limit=args.key_limit, key_window=args.key_window)
+    # 引擎在导入时读取配置：指向模拟接口，放宽客户端令牌桶，让上游的按密钥额度成为唯一瓶颈
+    os.environ["KIMI_BASE_URL"] = base_url
+    os.environ["KIMI_RATE_LIMIT_RPM"] = "1000000"
+    os.environ["KIMI_RATE_LIMIT_TPM"] = "1000000000"
+    os.environ.setdefault("KIMI_DATA_DIR", tempfile.mkdtemp(prefix="kimi_bench_"))
+    from kimi import engine, keypool
+
+    results = []
+    for size in args.keys:
+        row = run_round(engine, keypool, mock_config, size, min(args.broke_keys, size - 1), args.requests)
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+
+    print(f"\n{'keys':>5} {'wall(s)':>8} {'p50':>7} {'p95':>7} {'req/s':>7} {'errors':>7} {'429':>5}")
+    for row in results:
+        print(f"{row['keys']:>5} {row['wall_seconds']:>8} {row['p50']:>7} {row['p95']:>7} "
+              f"{row['requests_per_second']:>7} {row['errors']:>7} {row['upstream_429']:>5}")
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""并发容量压测：对比同步线程池与异步事件循环两种生成路径
+
+用法：python -m bench.load_test --users 10 50 100 200 --threads 40 --latency 2
+
+同步路径模拟改造前的 2.py：每个生成占用一个工作线程（Gradio 默认线程池为 40）；
+异步路径即当前 2.py：所有生成在同一事件循环上等待上游。两者都连接本地模拟接口，
+输出每档并发用户数下的总耗时、延迟分位数、吞吐量和模拟接口观察到的峰值并发。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.mock_server import start_mock_server
+
+API_KEY = "sk-loadtest"
+PARAMS = {"主题": "星空", "风格": "治愈", "字数": 300}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(mode, users, latencies, wall, errors, mock_config):
+    return {
+        "mode": mode,
+        "users": users,
+        "wall_seconds": round(wall, 3),
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "requests_per_second": round(users / wall, 2) if wall else 0.0,
+        "peak_upstream_concurrency": mock_config.peak_active,
+        "errors": errors
+    }
+
+
+def run_sync(engine, users, threads):
+    """同步路径：固定大小线程池，每个请求阻塞一个线程直到生成结束"""
+    # 所有用户同时到达，延迟从到达时刻算起（包含等待空闲线程的排队时间）
+    start = time.perf_counter()
+
+    def one():
+        result = engine.generate(API_KEY, "故事生成", PARAMS, use_cache=False, coalesce=False)
+        return time.perf_counter() - start, result.startswith("❌")
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        outcomes = list(executor.map(lambda _: one(), range(users)))
+    return [o[0] for o in outcomes], time.perf_counter() - start, sum(o[1] for o in outcomes)
+
+
+def run_async(engine, users):
+    """异步路径：全部请求在单个事件循环上并发等待"""
+    start = time.perf_counter()
+
+    async def one():
+        result = await engine.generate_async(API_KEY, "故事生成", PARAMS, use_cache=False, coalesce=False)
+        return time.perf_counter() - start, result.startswith("❌")
+
+    async def all_users():
+        return await asyncio.gather(*(one() for _ in range(users)))
+
+    outcomes = asyncio.run(all_users())
+    return [o[0] for o in outcomes], time.perf_counter() - start, sum(o[1] for o in outcomes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步 vs 异步生成路径的并发容量压测")
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 50, 100, 200], help="并发用户数档位")
+    parser.add_argument("--threads", type=int, default=40, help="同步路径的工作线程数（Gradio 默认 40）")
+    parser.add_argument("--latency", type=float, default=2.0, help="模拟接口首 token 延迟（秒）")
+    parser.add_argument("--tokens", type=int, default=50, help="模拟回复分块数")
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--output", help="结果写入 JSONL 文件（默认只打印）")
+    args = parser.parse_args()
+
+    server, base_url, mock_config = start_mock_server(latency=args.latency, tokens=args.tokens,
+                                                      token_interval=args.token_interval)
+    # 引擎在导入时读取配置，须先指向模拟接口并放宽连接池上限
+    os.environ["KIMI_BASE_URL"] = base_url
+    os.environ["KIMI_POOL_MAX_CONNECTIONS"] = str(max(args.users) * 2)
+    os.environ["KIMI_POOL_MAX_KEEPALIVE"] = str(max(args.users) * 2)
+    os.environ.setdefault("KIMI_DATA_DIR", tempfile.mkdtemp(prefix="kimi_bench_"))
+    from kimi import engine
+
+    results = []
+    for users in args.users:
+        for mode in ("sync", "async"):
+            mock_config.reset_counters()
+            if mode == "sync":
+                latencies, wall, errors = run_sync(engine, users, args.threads)
+            else:
+                latencies, wall, errors = run_async(engine, users)
+            row = summarize(mode, users, latencies, wall, errors, mock_config)
+            results.append(row)
+            print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+
+    print(f"\n{'users':>6} {'mode':>6} {'wall(s)':>8} {'p50':>7} {'p95':>7} {'req/s':>7} {'peak':>5}")
+    for row in results:
+        print(f"{row['users']:>6} {row['mode']:>6} {row['wall_seconds']:>8} {row['p50']:>7} {row['p95']:>7} "
+              f"{row['requests_per_second']:>7} {row['peak_upstream_concurrency']:>5}")
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
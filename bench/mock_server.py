@@ -0,0 +1,371 @@
+"""OpenAI 兼容的本地模拟接口：/v1/chat/completions，支持流式输出、可配置延迟、故障注入与录制回放
+
+单独运行：python -m bench.mock_server --port 8900 --latency 1.0 --tokens 200 --token-interval 0.01
+故障注入：--rate-limit-rate 0.1 --retry-after 1 --error-rate 0.02 --seed 42（按比例返回 429 / 500）
+长尾延迟：--slow-rate 0.05 --slow-latency 5（5% 的请求首个 token 前等待 5 秒），用于验证对冲请求
+按密钥额度：--key-limit 10 --key-window 10 --broke-keys sk-a（每个密钥每 10 秒最多 10 个请求，
+    超出返回 429 与剩余等待时间；sk-a 返回余额不足），用于验证共享密钥池的均衡与冷却
+录制：python -m bench.mock_server --record fixtures.jsonl --upstream https://api.moonshot.cn/v1
+    （请求原样转发到真实接口并边转发边写入夹具，密钥由调用方的 Authorization 请求头带入）
+回放：python -m bench.mock_server --replay fixtures.jsonl
+    （按模型与消息匹配夹具，按录制时的首字延迟与分块间隔回放；未匹配的请求使用合成回复）
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+def fixture_key(body):
+    """夹具匹配键：模型 + 消息内容（与温度等采样参数无关）"""
+    payload = json.dumps({"model": body.get("model"), "messages": body.get("messages")}, ensure_ascii=False,
+                         sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def load_fixtures(path):
+    """读取录制的夹具文件（JSONL），返回 键 -> 夹具"""
+    fixtures = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                fixture = json.loads(line)
+                fixtures[fixture["key"]] = fixture
+    return fixtures
+
+
+class MockConfig:
+    def __init__(self, latency=0.5, tokens=100, token_interval=0.01, token_text="测", rate_limit_rate=0.0,
+                 error_rate=0.0, retry_after=1.0, seed=None, replay_path=None, record_path=None, upstream=None,
+                 key_limit=0, key_window=60.0, broke_keys=(), slow_rate=0.0, slow_latency=5.0):
+        self.latency = latency  # 首个 token 前的等待（秒）
+        self.tokens = tokens  # 每次回复的分块数
+        self.token_interval = token_interval  # 分块间隔（秒）
+        self.token_text = token_text
+        self.rate_limit_rate = rate_limit_rate  # 返回 429 的请求比例
+        self.error_rate = error_rate  # 返回 500 的请求比例
+        self.retry_after = retry_after  # 429 响应的 Retry-After（秒）
+        self.slow_rate = slow_rate  # 首个 token 前改为等待 slow_latency 秒的请求比例（模拟长尾延迟）
+        self.slow_latency = slow_latency
+        self.key_limit = key_limit  # 每个密钥在 key_window 秒内最多处理的请求数（0 表示不限）
+        self.key_window = key_window
+        self.broke_keys = set(broke_keys)  # 返回余额不足的密钥
+        self._key_windows = {}  # 密钥 -> 最近请求时间
+        self.fixtures = load_fixtures(replay_path) if replay_path else {}
+        self.record_path = record_path
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak_active = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.replayed = 0
+        self.key_rejected = 0
+        self.slow = 0
+        self.key_served = {}  # 密钥末 6 位 -> 正常处理的请求数
+
+    def enter(self):
+        with self._lock:
+            self.requests += 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def pick_fault(self):
+        """按配置比例决定本次请求是否注入故障：返回 "rate_limit" / "error" / None"""
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return "rate_limit"
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return "error"
+            return None
+
+    def pick_latency(self):
+        """本次合成回复首个 token 前的等待：按 slow_rate 的比例注入长尾延迟"""
+        with self._lock:
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                self.slow += 1
+                return self.slow_latency
+            return self.latency
+
+    def key_fault(self, api_key):
+        """按密钥模拟上游额度：返回 ("insufficient_funds", None) / ("rate_limit", 需等待秒数) / (None, None)"""
+        with self._lock:
+            if api_key in self.broke_keys:
+                self.key_rejected += 1
+                return "insufficient_funds", None
+            if self.key_limit:
+                now = time.monotonic()
+                window = self._key_windows.setdefault(api_key, deque())
+                while window and window[0] <= now - self.key_window:
+                    window.popleft()
+                if len(window) >= self.key_limit:
+                    self.key_rejected += 1
+                    return "rate_limit", window[0] + self.key_window - now
+                window.append(now)
+            self.key_served[api_key[-6:]] = self.key_served.get(api_key[-6:], 0) + 1
+            return None, None
+
+    def find_fixture(self, body):
+        fixture = self.fixtures.get(fixture_key(body))
+        if fixture is not None:
+            with self._lock:
+                self.replayed += 1
+        return fixture
+
+    def record(self, fixture):
+        with self._lock:
+            with open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(fixture, ensure_ascii=False) + "\n")
+
+    def counters(self):
+        with self._lock:
+            return {"requests": self.requests, "peak_active": self.peak_active, "rate_limited": self.rate_limited,
+                    "errors": self.errors, "replayed": self.replayed, "key_rejected": self.key_rejected,
+                    "slow": self.slow, "key_served": dict(self.key_served)}
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.peak_active = self.active
+            self.rate_limited = 0
+            self.errors = 0
+            self.replayed = 0
+            self.key_rejected = 0
+            self.slow = 0
+            self.key_served = {}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持长连接，便于验证连接池复用
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.config
+        config.enter()
+        try:
+            fault = config.pick_fault()
+            auth = self.headers.get("Authorization", "")
+            key_fault, wait = config.key_fault(auth[len("Bearer "):]) if fault is None else (None, None)
+            if key_fault == "insufficient_funds":
+                self._send_json(429, {"error": {"message": "Your account has insufficient funds (mock)",
+                                                "type": "exceeded_current_quota_error"}})
+            elif key_fault == "rate_limit":
+                self._send_json(429, {"error": {"message": "Rate limit reached for requests per key (mock)",
+                                                "type": "rate_limit_reached_error"}},
+                                {"Retry-After": f"{wait:.2f}"})
+            elif fault == "rate_limit":
+                self._send_json(429, {"error": {"message": "Rate limit reached for requests (mock)",
+                                                "type": "rate_limit_reached_error"}},
+                                {"Retry-After": f"{config.retry_after:g}"})
+            elif fault == "error":
+                self._send_json(500, {"error": {"message": "mock upstream error", "type": "server_error"}})
+            elif config.upstream:
+                self._proxy(body, config)
+            else:
+                self._reply(body, config, config.find_fixture(body))
+        finally:
+            config.leave()
+
+    # ---------- 合成回复 / 夹具回放 ----------
+    def _reply(self, body, config, fixture):
+        if fixture is None:
+            # 合成回复不超过请求的 max_tokens；提示词令牌数按消息字符数近似（每个分块、每个汉字记 1 个令牌）
+            tokens = min(config.tokens, body.get("max_tokens") or config.tokens)
+            prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", []))
+            pieces = [config.token_text] * tokens
+            intervals = [config.token_interval] * max(0, tokens - 1)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                     "total_tokens": prompt_tokens + tokens}
+            latency = config.pick_latency()
+        else:
+            pieces, intervals, usage, latency = (fixture["chunks"], fixture["intervals"], fixture.get("usage"),
+                                                 fixture["latency"])
+        time.sleep(latency)
+        if body.get("stream"):
+            self._start_stream()
+            chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(intervals[i - 1])
+                self._write_delta(chunk_id, body, piece)
+            self._finish_stream(chunk_id, body, usage)
+        else:
+            self._send_json(200, self._completion(body, "".join(pieces), usage))
+
+    def _completion(self, body, content, usage):
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    # ---------- 录制：转发到真实接口 ----------
+    def _proxy(self, body, config):
+        """把请求以流式方式转发到真实接口，边转发边记录分块与时间，结束后写入夹具"""
+        headers = {"Authorization": self.headers.get("Authorization", ""), "Content-Type": "application/json"}
+        started = time.perf_counter()
+        pieces, intervals, usage = [], [], None
+        latency, last = None, None
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        with httpx.Client(timeout=httpx.Timeout(10.0, read=300.0)) as client:
+            with client.stream("POST", f"{config.upstream}/chat/completions", headers=headers,
+                               json=dict(body, stream=True)) as response:
+                if response.status_code != 200:
+                    self._send_raw(response.status_code, response.read(), response.headers.get("Retry-After"))
+                    return
+                if body.get("stream"):
+                    self._start_stream()
+                for line in response.iter_lines():
+                    if not line.startswith("data:") or line[5:].strip() == "[DONE]":
+                        continue
+                    chunk = json.loads(line[5:])
+                    choice = (chunk.get("choices") or [{}])[0]
+                    usage = chunk.get("usage") or choice.get("usage") or usage
+                    piece = (choice.get("delta") or {}).get("content")
+                    if not piece:
+                        continue
+                    now = time.perf_counter()
+                    if latency is None:
+                        latency = now - started
+                    else:
+                        intervals.append(now - last)
+                    last = now
+                    pieces.append(piece)
+                    if body.get("stream"):
+                        self._write_delta(chunk_id, body, piece)
+        if body.get("stream"):
+            self._finish_stream(chunk_id, body, usage)
+        else:
+            self._send_json(200, self._completion(body, "".join(pieces), usage))
+        config.record({"key": fixture_key(body), "model": body.get("model"), "messages": body.get("messages"),
+                       "latency": round(latency or 0.0, 4), "chunks": pieces,
+                       "intervals": [round(i, 4) for i in intervals], "usage": usage})
+
+    # ---------- 输出 ----------
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_delta(self, chunk_id, body, piece):
+        self._write_event({
+            "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+        })
+
+    def _finish_stream(self, chunk_id, body, usage):
+        self._write_event({
+            "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop", "usage": usage}]
+        })
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_event(self, payload):
+        self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        self._send_raw(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                       (headers or {}).get("Retry-After"))
+
+    def _send_raw(self, status, data, retry_after=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if retry_after:
+            self.send_header("Retry-After", retry_after)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # 高并发压测时避免握手被拒
+
+
+def start_mock_server(port=0, **config):
+    """在后台线程启动模拟接口，返回 (server, base_url, config)"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": MockConfig(**config)})
+    server = MockHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1", handler.config
+
+
+def add_mock_arguments(parser):
+    """模拟接口的命令行参数（压测脚本共用）"""
+    parser.add_argument("--latency", type=float, default=0.5, help="首个 token 前的等待（秒）")
+    parser.add_argument("--tokens", type=int, default=100, help="每次回复的分块数")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="分块间隔（秒）")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的请求比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的请求比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--seed", type=int, help="故障注入的随机种子（固定后每次运行注入位置一致）")
+    parser.add_argument("--replay", help="回放录制的夹具文件（JSONL）")
+    parser.add_argument("--key-limit", type=int, default=0, help="每个密钥在 --key-window 秒内最多处理的请求数")
+    parser.add_argument("--key-window", type=float, default=60.0, help="按密钥限流的统计窗口（秒）")
+    parser.add_argument("--broke-keys", nargs="*", default=[], help="返回余额不足的密钥")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="注入长尾延迟的请求比例")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="长尾请求首个 token 前的等待（秒）")
+
+
+def mock_config_from_args(args):
+    return dict(latency=args.latency, tokens=args.tokens, token_interval=args.token_interval,
+                rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate, retry_after=args.retry_after,
+                seed=args.seed, replay_path=args.replay, key_limit=args.key_limit, key_window=args.key_window,
+                broke_keys=args.broke_keys, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模拟接口")
+    parser.add_argument("--port", type=int, default=8900)
+    add_mock_arguments(parser)
+    parser.add_argument("--record", help="录制模式：把转发得到的回复写入该夹具文件（JSONL）")
+    parser.add_argument("--upstream", default="https://api.moonshot.cn/v1", help="录制模式转发的真实接口地址")
+    args = parser.parse_args()
+    config = mock_config_from_args(args)
+    if args.record:
+        config.update(record_path=args.record, upstream=args.upstream)
+    server, base_url, _ = start_mock_server(args.port, **config)
+    mode = f"录制到 {args.record}" if args.record else (f"回放 {args.replay}" if args.replay else "合成回复")
+    print(f"模拟接口已启动：{base_url}（{mode}，Ctrl+C 退出）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
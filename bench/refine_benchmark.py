@@ -0,0 +1,98 @@
+"""局部修改基准：对比整篇重新生成与只改写一个段落的令牌数和耗时
+
+用法：python -m bench.refine_benchmark --rounds 3 --chars 1000 --paragraphs 10
+
+模拟接口的合成回复每个分块 1 个令牌，长度按各自要求的字数设置（模型大致按要求字数输出）：
+- full：按 字数=--chars 整篇重新生成，回复 --chars 个令牌；
+- refine：把 --chars 字的文本分成 --paragraphs 段，按修改要求只改写中间一段，回复该段字数个令牌。
+令牌数为生成历史中记录的上游用量（模拟接口按提示词字符数计输入令牌），每轮都跳过缓存。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.mock_server import start_mock_server
+
+
+def last_usage(history):
+    entry = history.get_history_entry(history.search_history(limit=1)[0]["id"])
+    return (entry["prompt_tokens"] or 0) + (entry["completion_tokens"] or 0)
+
+
+def run_round(engine, refine, history, mock_config, args, document):
+    params = {"主题": "星空", "风格": "治愈", "字数": args.chars}
+    mock_config.tokens = args.chars
+    started = time.perf_counter()
+    full = engine.generate("sk-bench", "故事生成", params, use_cache=False, coalesce=False)
+    full_seconds = time.perf_counter() - started
+    full_tokens = last_usage(history)
+
+    session = refine.RefineSession(engine.render_prompt("故事生成", params)[0])
+    paragraphs = refine.split_paragraphs(document)
+    index = len(paragraphs) // 2
+    mock_config.tokens = len(paragraphs[index].text)
+    started = time.perf_counter()
+    revision = ""
+    for revision in session.stream("sk-bench", document, index, "这一段改得更有感染力", use_cache=False):
+        pass
+    refine_seconds = time.perf_counter() - started
+    refine_tokens = last_usage(history)
+    refined = session.accept(document, index, "这一段改得更有感染力", revision)
+    return {
+        "full_seconds": round(full_seconds, 3),
+        "full_tokens": full_tokens,
+        "refine_seconds": round(refine_seconds, 3),
+        "refine_tokens": refine_tokens,
+        "errors": sum(text.startswith("❌") for text in (full, revision)),
+        "document_chars": len(refined)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="局部修改与整篇重新生成的令牌数、耗时对比")
+    parser.add_argument("--rounds", type=int, default=3, help="对比轮数")
+    parser.add_argument("--chars", type=int, default=1000, help="全文字数")
+    parser.add_argument("--paragraphs", type=int, default=10, help="全文段落数")
+    parser.add_argument("--latency", type=float, default=0.5, help="首个 token 前的等待（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.005, help="分块间隔（秒）")
+    parser.add_argument("--output", help="结果追加写入 JSONL 文件（默认只打印）")
+    args = parser.parse_args()
+
+    server, base_url, mock_config = start_mock_server(latency=args.latency, tokens=args.chars,
+                                                      token_interval=args.token_interval)
+    # 引擎在导入时读取配置：指向模拟接口，放宽客户端令牌桶，避免本地排队影响耗时
+    os.environ["KIMI_BASE_URL"] = base_url
+    os.environ["KIMI_RATE_LIMIT_RPM"] = "1000000"
+    os.environ["KIMI_RATE_LIMIT_TPM"] = "1000000000"
+    os.environ["KIMI_LENGTH_GUARD"] = "0"
+    os.environ.setdefault("KIMI_DATA_DIR", tempfile.mkdtemp(prefix="kimi_bench_"))
+    from kimi import engine, history, refine
+
+    paragraph_chars = max(1, args.chars // args.paragraphs)
+    document = "\n\n".join("测" * paragraph_chars for _ in range(args.paragraphs))
+    results = []
+    for _ in range(args.rounds):
+        row = run_round(engine, refine, history, mock_config, args, document)
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+
+    def mean(key):
+        return sum(row[key] for row in results) / len(results)
+
+    print(f"\n{'mode':>6} {'seconds':>8} {'tokens':>7}")
+    print(f"{'full':>6} {mean('full_seconds'):>8.2f} {mean('full_tokens'):>7.0f}")
+    print(f"{'refine':>6} {mean('refine_seconds'):>8.2f} {mean('refine_tokens'):>7.0f}")
+    print(f"局部修改耗时为整篇重新生成的 {mean('refine_seconds') / mean('full_seconds'):.0%}，"
+          f"令牌数为 {mean('refine_tokens') / mean('full_tokens'):.0%}")
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""页面重跑耗时基准：对比 1.py 整页重跑与结果面板片段重跑随生成结果长度的变化
+
+用法：python -m bench.rerun_benchmark --lengths 500 2000 8000 32000 --repeat 5
+
+借助 streamlit.testing.v1.AppTest 在无浏览器环境下执行脚本：
+- full：整页重跑（改模板、点击生成等仍会触发），包含 CSS、表单、结果面板与批量面板；
+- fragment：只执行结果面板片段（编辑、复制、下载结果时实际重跑的部分）。
+每档长度先预热一次，再取多次重跑的中位数，以 JSON 行输出。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from kimi.content import store_content
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 片段场景：按文件路径加载页面模块（文件名 1.py 无法直接 import），只调用结果面板
+FRAGMENT_SCRIPT = """
+import importlib.util
+import sys
+
+module = sys.modules.get("kimi_app_page")
+if module is None:
+    spec = importlib.util.spec_from_file_location("kimi_app_page", {app_path!r})
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules["kimi_app_page"] = module
+module.render_result_panel("故事生成")
+"""
+
+
+def sample_content(length):
+    """构造指定字数的生成结果（中文段落，带换行）"""
+    paragraph = "夜空中最亮的星照亮了少年回家的路，他在风里默默许下一个愿望。\n"
+    return (paragraph * (length // len(paragraph) + 1))[:length]
+
+
+def seed_state(at, content):
+    at.session_state["content_session"] = "bench"
+    at.session_state["result_handle"] = store_content(content, "bench")
+    at.session_state["generate_time"] = "2026-01-01 00:00:00"
+    at.session_state["generate_route"] = ""
+
+
+def time_reruns(at, repeat):
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        at.run()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def bench_length(app_path, length, repeat):
+    content = sample_content(length)
+
+    full = AppTest.from_file(app_path, default_timeout=60)
+    seed_state(full, content)
+    full_seconds = time_reruns(full, repeat)
+
+    fragment = AppTest.from_string(FRAGMENT_SCRIPT.format(app_path=app_path), default_timeout=60)
+    seed_state(fragment, content)
+    fragment_seconds = time_reruns(fragment, repeat)
+
+    return {
+        "length": length,
+        "full_rerun_ms": round(full_seconds * 1000, 2),
+        "fragment_rerun_ms": round(fragment_seconds * 1000, 2),
+        "speedup": round(full_seconds / fragment_seconds, 2) if fragment_seconds else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="1.py 整页重跑与结果面板片段重跑耗时对比")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[500, 2000, 8000, 32000], help="生成结果字数档位")
+    parser.add_argument("--repeat", type=int, default=5, help="每档重跑次数（取中位数）")
+    parser.add_argument("--app", default=os.path.join(ROOT, "1.py"), help="页面脚本路径")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    for length in args.lengths:
+        print(json.dumps(bench_length(os.path.abspath(args.app), length, args.repeat), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
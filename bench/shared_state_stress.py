@@ -0,0 +1,158 @@
+"""跨进程共享状态压测：多个工作进程同时使用限流器与相同请求合并，对比进程内状态与 KIMI_SHARED_STATE=1
+
+用法：python -m bench.shared_state_stress --processes 4 --reserves 200 --rpm 60 --prompts 3 --threads 4
+
+限流阶段：每个进程对同一个密钥连续预约 --reserves 次（只记录应等待到的时刻，不真正等待），
+    汇总所有进程的放行时刻后按令牌桶上限检查：任意时刻 t 之前放行的请求数不得超过 容量 + 速率 × (t - t0)。
+    进程内状态下每个进程各有一份完整额度，合计放行速率约为上限的 进程数 倍；共享状态下超额次数应为 0。
+    吞吐为所有进程每秒完成的预约次数（共享状态下每次预约是一个 SQLite 写事务）。
+合并阶段：每个进程开 --threads 个线程，同时请求相同的 --prompts 组参数（开启缓存与合并），
+    统计模拟接口实际收到的请求数：进程内状态下最多为 进程数 × 参数组数，共享状态下应等于参数组数；
+    同时检查没有错误、同一组参数在所有进程中得到的结果一致。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench.mock_server import start_mock_server
+
+API_KEY = "sk-stress"
+
+
+def prompt_params(index):
+    return {"主题": f"压测{index}", "风格": "治愈", "字数": 300}
+
+
+def _wait_until(start_at):
+    time.sleep(max(0.0, start_at - time.time()))
+
+
+def reserve_worker(env, start_at, reserves, queue):
+    """限流阶段的工作进程：返回 (每次预约应放行的时刻, 耗时)"""
+    os.environ.update(env)
+    from kimi.limiter import get_rate_limiter
+    limiter = get_rate_limiter()
+    _wait_until(start_at)
+    start = time.time()
+    slots = []
+    for _ in range(reserves):
+        now = time.time()
+        slots.append(now + limiter.reserve(API_KEY, 1))
+    queue.put((slots, time.time() - start))
+
+
+def generate_worker(env, start_at, prompts, threads, queue):
+    """合并阶段的工作进程：返回 [(参数组序号, 结果)]"""
+    os.environ.update(env)
+    from concurrent.futures import ThreadPoolExecutor
+
+    from kimi import engine
+    jobs = [index for index in range(prompts) for _ in range(threads)]
+    random.shuffle(jobs)
+    _wait_until(start_at)
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        results = list(executor.map(lambda index: (index, engine.generate(API_KEY, "故事生成", prompt_params(index))),
+                                    jobs))
+    queue.put(results)
+
+
+def run_processes(target, processes, env, extra_args, warmup):
+    """以 spawn 方式启动工作进程（每个进程按 env 重新导入 kimi），统一在 start_at 时刻开始"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    start_at = time.time() + warmup
+    workers = [context.Process(target=target, args=(env, start_at) + extra_args + (queue,))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    outputs = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return outputs, time.time() - start_at
+
+
+def count_violations(slots, capacity, per_second):
+    """按放行时刻排序后，统计超出令牌桶上限（容量 + 速率 × 经过时间，允许 1 个误差）的请求数"""
+    ordered = sorted(slots)
+    return sum(1 for index, slot in enumerate(ordered, 1) if index > capacity + per_second * (slot - ordered[0]) + 1)
+
+
+def limiter_phase(args, shared):
+    env = {"KIMI_SHARED_STATE": shared, "KIMI_DATA_DIR": tempfile.mkdtemp(prefix="kimi_stress_"),
+           "KIMI_RATE_LIMIT_RPM": str(args.rpm), "KIMI_METRICS": "0"}
+    outputs, _ = run_processes(reserve_worker, args.processes, env, (args.reserves,), args.warmup)
+    slots = [slot for worker_slots, _ in outputs for slot in worker_slots]
+    busiest = max(elapsed for _, elapsed in outputs)
+    return {
+        "phase": "limiter",
+        "shared": shared == "1",
+        "processes": args.processes,
+        "reserves": len(slots),
+        "violations": count_violations(slots, args.rpm, args.rpm / 60),
+        "reserves_per_second": round(len(slots) / busiest, 1) if busiest else 0.0
+    }
+
+
+def coalesce_phase(args, shared, base_url, mock_config):
+    env = {"KIMI_SHARED_STATE": shared, "KIMI_DATA_DIR": tempfile.mkdtemp(prefix="kimi_stress_"),
+           "KIMI_BASE_URL": base_url, "KIMI_RATE_LIMIT_RPM": "1000000", "KIMI_RATE_LIMIT_TPM": "1000000000",
+           "KIMI_METRICS": "0"}
+    mock_config.reset_counters()
+    outputs, wall = run_processes(generate_worker, args.processes, env, (args.prompts, args.threads), args.warmup)
+    results = [pair for output in outputs for pair in output]
+    by_prompt = {}
+    for index, result in results:
+        by_prompt.setdefault(index, set()).add(result)
+    return {
+        "phase": "coalesce",
+        "shared": shared == "1",
+        "processes": args.processes,
+        "generations": len(results),
+        "upstream_requests": mock_config.counters()["requests"],
+        "errors": sum(1 for _, result in results if not result or result.startswith("❌")),
+        "inconsistent": sum(1 for texts in by_prompt.values() if len(texts) > 1),
+        "wall_seconds": round(wall, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="跨进程共享状态压测")
+    parser.add_argument("--processes", type=int, default=4, help="工作进程数")
+    parser.add_argument("--reserves", type=int, default=200, help="限流阶段每个进程的预约次数")
+    parser.add_argument("--rpm", type=int, default=60, help="限流阶段每个密钥每分钟请求数（同时也是桶容量）")
+    parser.add_argument("--prompts", type=int, default=3, help="合并阶段的参数组数")
+    parser.add_argument("--threads", type=int, default=4, help="合并阶段每个进程中每组参数的并发请求数")
+    parser.add_argument("--latency", type=float, default=1.0, help="模拟接口首 token 延迟（秒）")
+    parser.add_argument("--tokens", type=int, default=50, help="模拟回复分块数")
+    parser.add_argument("--warmup", type=float, default=5.0, help="等待各进程完成导入的秒数")
+    parser.add_argument("--output", help="结果追加写入 JSONL 文件（默认只打印）")
+    args = parser.parse_args()
+
+    server, base_url, mock_config = start_mock_server(latency=args.latency, tokens=args.tokens, token_interval=0.02)
+    results = []
+    for shared in ("0", "1"):
+        for row in (limiter_phase(args, shared), coalesce_phase(args, shared, base_url, mock_config)):
+            results.append(row)
+            print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+
+    print(f"\n{'shared':>6} {'reserves':>9} {'violations':>11} {'reserves/s':>11}")
+    for row in results[0::2]:
+        print(f"{row['shared']!s:>6} {row['reserves']:>9} {row['violations']:>11} {row['reserves_per_second']:>11}")
+    print(f"\n{'shared':>6} {'generations':>12} {'upstream':>9} {'errors':>7} {'inconsistent':>13} {'wall(s)':>8}")
+    for row in results[1::2]:
+        print(f"{row['shared']!s:>6} {row['generations']:>12} {row['upstream_requests']:>9} {row['errors']:>7} "
+              f"{row['inconsistent']:>13} {row['wall_seconds']:>8}")
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""相似请求缓存基准：写入大量模拟请求后，测量改写过的请求的命中率、误命中率与查询耗时
+
+用法：python -m bench.similar_benchmark --entries 20000 --queries 500 --threshold 0.8
+
+模拟营销文案请求（产品名称、平台、核心卖点、风格、字数）写入索引；查询分两类：
+- 改写请求：对已写入的请求加空格、换全角标点、调换卖点顺序或改动一两个字，应当命中原请求；
+- 新请求：随机组合出的不在索引中的请求，命中即为误命中。
+输出两类请求的命中率、查询耗时中位数与 p95（毫秒）。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from kimi.similar import SimilarIndex, make_scope, normalize_params
+
+PRODUCTS = ["无线蓝牙耳机", "智能保温杯", "代餐奶昔", "扫地机器人", "电动牙刷", "空气炸锅", "机械键盘", "瑜伽垫",
+            "咖啡机", "降噪耳机", "运动手环", "投影仪", "电煮锅", "加湿器", "护眼台灯", "折叠自行车"]
+BRANDS = ["小米", "华为", "飞利浦", "美的", "戴森", "罗技", "九阳", "倍思", "漫步者", "苏泊尔", "膳魔师", "科沃斯"]
+PLATFORMS = ["小红书", "抖音", "微信朋友圈", "知乎", "B站", "微博"]
+SELLING_POINTS = ["超长续航", "便携小巧", "0糖0卡", "性价比高", "主动降噪", "一键清洁", "静音设计", "大容量",
+                  "快充", "防水防汗", "智能温控", "高颜值", "安全材质", "三年质保"]
+STYLES = ["活泼", "专业", "温馨", "幽默", "简洁", "高级感"]
+
+
+def fake_params(rng):
+    return {
+        "产品名称": f"{rng.choice(BRANDS)}{rng.choice(PRODUCTS)}",
+        "平台": rng.choice(PLATFORMS),
+        "核心卖点": "，".join(rng.sample(SELLING_POINTS, rng.randint(2, 4))),
+        "风格": rng.choice(STYLES),
+        "字数": "300"
+    }
+
+
+def perturb(rng, params):
+    """常见的改写：多余空格、全角/半角标点、卖点换序、产品名称改动一个字"""
+    params = dict(params)
+    points = params["核心卖点"].split("，")
+    rng.shuffle(points)
+    params["核心卖点"] = rng.choice(["，", ",", "、", " , "]).join(points)
+    edit = rng.choice(["space", "punct", "char", "none"])
+    if edit == "space":
+        params["产品名称"] = f" {params['产品名称']} "
+    elif edit == "punct":
+        params["风格"] += "！"
+    elif edit == "char":
+        params["产品名称"] += rng.choice(["Pro", "2代", "新款"])
+    return params
+
+
+def scope_and_fields(params):
+    exact, fields = normalize_params(params)
+    return make_scope("default", "营销文案", "moonshot-v1-8k", 1024, exact), fields
+
+
+def timed_queries(index, queries, threshold):
+    hits, samples = 0, []
+    for params in queries:
+        scope, fields = scope_and_fields(params)
+        started = time.perf_counter()
+        matches = index.query(scope, fields, threshold)
+        samples.append(time.perf_counter() - started)
+        hits += bool(matches)
+    samples.sort()
+    return {
+        "hit_rate": round(hits / len(queries), 3),
+        "p50_ms": round(statistics.median(samples) * 1000, 2),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="相似请求缓存基准")
+    parser.add_argument("--entries", type=int, default=20000, help="索引中的模拟请求数")
+    parser.add_argument("--queries", type=int, default=500, help="每类查询的请求数")
+    parser.add_argument("--threshold", type=float, default=0.8, help="相似度下限")
+    parser.add_argument("--db", help="索引数据库路径（默认临时文件）")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="kimi_similar_bench_"), "similar_index.db")
+    index = SimilarIndex(db_path, max_entries=args.entries)
+    stored, seen = [], set()
+    started = time.perf_counter()
+    while len(stored) < args.entries:
+        params = fake_params(rng)
+        scope, fields = scope_and_fields(params)
+        key = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+        if key in seen:
+            continue
+        seen.add(key)
+        index.add(scope, fields, params, f"key-{len(stored)}")
+        stored.append(params)
+    insert_seconds = time.perf_counter() - started
+
+    rewritten = [perturb(rng, rng.choice(stored)) for _ in range(args.queries)]
+    fresh = []
+    while len(fresh) < args.queries:
+        params = fake_params(rng)
+        params["产品名称"] = f"{rng.choice(PLATFORMS)}同款{params['产品名称']}{rng.randint(100, 999)}"
+        fresh.append(params)
+
+    results = {
+        "entries": index.count(),
+        "threshold": args.threshold,
+        "insert_per_entry_ms": round(insert_seconds / args.entries * 1000, 3),
+        "db_megabytes": round(os.path.getsize(db_path) / 1024 / 1024, 1),
+        "rewritten": timed_queries(index, rewritten, args.threshold),
+        "fresh": timed_queries(index, fresh, args.threshold)
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
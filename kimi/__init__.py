@@ -0,0 +1,5 @@
+"""Kimi 文字生成工具的共享组件（供 1.py / 2.py / 3.py 共同使用）"""
+import os
+
+# 本地数据目录（响应缓存等 SQLite 文件存放位置）
+DATA_DIR = os.environ.get("KIMI_DATA_DIR", ".kimi_data")
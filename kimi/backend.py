@@ -0,0 +1,16 @@
+"""界面的统一生成入口：设置 KIMI_SERVICE_URL 时作为 kimi.server 的瘦客户端，否则在本进程内调用引擎"""
+import os
+
+if os.environ.get("KIMI_SERVICE_URL"):
+    from kimi.service_client import (  # noqa: F401
+        cache_stats, estimate_caption, find_similar, generate, generate_async, generate_stream,
+        generate_stream_async, generate_variants, generate_variants_stream, generate_variants_stream_async,
+        get_history_entry, route_caption, search_history
+    )
+else:
+    from kimi.engine import (  # noqa: F401
+        cache_stats, estimate_caption, find_similar, generate, generate_async, generate_stream,
+        generate_stream_async, generate_variants, generate_variants_stream, generate_variants_stream_async,
+        route_caption
+    )
+    from kimi.history import get_history_entry, search_history  # noqa: F401
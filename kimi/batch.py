@@ -0,0 +1,221 @@
+"""批量生成：从 CSV/JSONL 读取参数行，限制并发调用模型，结果边完成边写出，支持断点续跑
+
+命令行用法：
+    python -m kimi.batch products.csv -o results.jsonl --template 营销文案 --concurrency 4
+
+输入每行对应一次生成：CSV 的列名即模板参数名；JSONL 每行可以是参数对象，
+也可以是 {"id": ..., "template": ..., "params": {...}}。可选的 id / template 列
+分别指定行标识和模板，缺省时使用行号和 --template。
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from kimi.backend import generate
+from kimi.engine import DEFAULT_TEMPLATE_SET, PROMPT_TEMPLATES, TEMPLATE_SETS, estimate_template, validate_params
+
+BATCH_CONCURRENCY = int(os.environ.get("KIMI_BATCH_CONCURRENCY", "4"))
+OUTPUT_FIELDS = ["id", "template", "status", "content", "params"]
+
+
+# ===================== 1. 读取输入 =====================
+def load_rows(path, default_template=None):
+    """读取 CSV/JSONL，返回 [{"id", "template", "params"}]"""
+    rows = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+
+    for index, record in enumerate(records, start=1):
+        params = record["params"] if isinstance(record.get("params"), dict) else record
+        params = {k: v for k, v in params.items() if k and k not in ("id", "template") and v is not None}
+        rows.append({
+            "id": str(record.get("id") or index),
+            "template": record.get("template") or default_template,
+            "params": params
+        })
+    return rows
+
+
+def check_row(row, template_set=DEFAULT_TEMPLATE_SET):
+    """使用与界面相同的规则校验一行，返回错误提示或 None"""
+    templates = TEMPLATE_SETS[template_set]
+    if row["template"] not in templates:
+        return f"❌ 模板类型错误，无此生成模板！（{row['template']}）"
+    invalid_or_missing = validate_params(templates[row["template"]]["params"], row["params"])
+    if invalid_or_missing:
+        return f"❌ 缺少或无效参数：{', '.join(invalid_or_missing)}（请填写有效且非空的内容）"
+    return None
+
+
+# ===================== 2. 输出与断点续跑 =====================
+def load_finished_ids(output_path):
+    """读取已写出的成功行 id，用于崩溃后续跑（失败行会重新生成）"""
+    if not os.path.exists(output_path):
+        return set()
+    finished = set()
+    with open(output_path, encoding="utf-8-sig", newline="") as f:
+        if output_path.lower().endswith(".csv"):
+            records = csv.DictReader(f)
+        else:
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # 崩溃时留下的半行：跳过，其后的行照常读取
+        for record in records:
+            if record.get("status") == "ok":
+                finished.add(str(record.get("id")))
+    return finished
+
+
+def _complete_length(data, is_csv):
+    """输出文件中完整记录部分的字节数：崩溃时最后一条记录可能只写了一半（CSV 的内容字段中可能含换行）"""
+    if not is_csv:
+        return data.rfind(b"\n") + 1
+    text = data.decode("utf-8", "surrogateescape")  # 截断的多字节字符也能按原字节还原
+    consumed, complete = 0, 0
+
+    def lines():
+        nonlocal consumed
+        for line in text.splitlines(keepends=True):
+            consumed += len(line)
+            yield line
+
+    try:
+        for _ in csv.reader(lines(), strict=True):
+            if text[consumed - 1:consumed] == "\n":
+                complete = consumed
+    except csv.Error:
+        pass  # 引号未闭合：最后一条记录不完整
+    return len(text[:complete].encode("utf-8", "surrogateescape"))
+
+
+def drop_partial_record(output_path):
+    """续跑前截掉上次崩溃时写了一半的最后一条记录，避免新结果接在半行后面"""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        complete = _complete_length(data, output_path.lower().endswith(".csv"))
+        if complete < len(data):
+            f.truncate(complete)
+
+
+class ResultWriter:
+    """追加写出结果，每行写完立即落盘；续跑时先截掉上次写了一半的记录"""
+
+    def __init__(self, output_path):
+        self.is_csv = output_path.lower().endswith(".csv")
+        drop_partial_record(output_path)
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        if os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        self._file = open(output_path, "a", encoding="utf-8", newline="")
+        if self.is_csv:
+            self._csv = csv.DictWriter(self._file, fieldnames=OUTPUT_FIELDS)
+            if is_new:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self.is_csv:
+            self._csv.writerow(dict(record, params=json.dumps(record["params"], ensure_ascii=False)))
+        else:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+# ===================== 3. 并发执行 =====================
+def _run_row(kimi_api_key, row, use_cache, template_set):
+    error = check_row(row, template_set)
+    content = error or generate(kimi_api_key, row["template"], row["params"], use_cache, template_set)
+    return {
+        "id": row["id"],
+        "template": row["template"],
+        "status": "error" if content.startswith("❌") else "ok",
+        "content": content,
+        "params": row["params"]
+    }
+
+
+def run_batch(kimi_api_key, rows, output_path, concurrency=BATCH_CONCURRENCY, use_cache=True,
+              template_set=DEFAULT_TEMPLATE_SET, on_result=None):
+    """并发生成全部未完成的行，结果按完成顺序写出；on_result(record, done, total) 在调用线程中回调"""
+    finished = load_finished_ids(output_path)
+    pending = [row for row in rows if row["id"] not in finished]
+    summary = {"total": len(rows), "skipped": len(rows) - len(pending), "ok": 0, "error": 0}
+
+    writer = ResultWriter(output_path)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [executor.submit(_run_row, kimi_api_key, row, use_cache, template_set) for row in pending]
+            for done, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                writer.write(record)
+                summary[record["status"]] += 1
+                if on_result:
+                    on_result(record, done, len(pending))
+    finally:
+        writer.close()
+    return summary
+
+
+def plan_batch(rows, concurrency=BATCH_CONCURRENCY, template_set=DEFAULT_TEMPLATE_SET):
+    """批量预估：有效行数、总令牌数、总费用与按并发数折算的预计耗时"""
+    plan = {"rows": len(rows), "valid": 0, "input_tokens": 0, "output_tokens": 0, "cost_yuan": 0.0,
+            "serial_seconds": 0.0}
+    for row in rows:
+        if check_row(row, template_set):
+            continue
+        estimate = estimate_template(row["template"], row["params"], template_set)
+        if estimate is None:
+            continue
+        plan["valid"] += 1
+        plan["input_tokens"] += estimate.input_tokens
+        plan["output_tokens"] += estimate.output_tokens
+        plan["cost_yuan"] += estimate.cost_yuan
+        plan["serial_seconds"] += estimate.latency_seconds
+    plan["cost_yuan"] = round(plan["cost_yuan"], 4)
+    plan["estimated_seconds"] = round(plan["serial_seconds"] / max(1, concurrency), 1)
+    plan["serial_seconds"] = round(plan["serial_seconds"], 1)
+    return plan
+
+
+# ===================== 4. 命令行入口 =====================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kimi 批量生成（CSV/JSONL → JSONL/CSV）")
+    parser.add_argument("input", help="输入文件（.csv 或 .jsonl）")
+    parser.add_argument("-o", "--output", required=True, help="输出文件（.jsonl 或 .csv），已存在时自动续跑")
+    parser.add_argument("-t", "--template", default="营销文案", choices=list(PROMPT_TEMPLATES),
+                        help="输入行未指定 template 时使用的模板")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_CONCURRENCY, help="最大并发请求数")
+    parser.add_argument("--api-key", default=os.environ.get("KIMI_API_KEY", ""), help="默认读取环境变量 KIMI_API_KEY")
+    parser.add_argument("--no-cache", action="store_true", help="跳过响应缓存，全部重新生成")
+    parser.add_argument("--dry-run", action="store_true", help="只输出令牌数、费用与耗时预估，不调用模型")
+    args = parser.parse_args(argv)
+
+    rows = load_rows(args.input, args.template)
+    if args.dry_run:
+        print(json.dumps(plan_batch(rows, args.concurrency), ensure_ascii=False))
+        return 0
+
+    def report(record, done, total):
+        print(f"[{done}/{total}] {record['id']} {record['status']}", file=sys.stderr)
+
+    summary = run_batch(args.api_key, rows, args.output, args.concurrency, not args.no_cache, on_result=report)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
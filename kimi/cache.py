@@ -0,0 +1,167 @@
+"""响应缓存：内存 LRU + SQLite 磁盘两级，按 (模型, 提示词, 采样参数) 命中
+磁盘层为 WAL 模式，同一主机上共用 DATA_DIR 的各进程可相互命中；内存层仍为进程内"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from kimi import DATA_DIR
+from kimi.length import TrimmedText, is_trimmed
+from kimi.shared import SHARED_BUSY_TIMEOUT
+
+# ===================== 1. 缓存配置（可通过环境变量覆盖） =====================
+CACHE_DB_PATH = os.environ.get("KIMI_CACHE_PATH", os.path.join(DATA_DIR, "response_cache.db"))
+CACHE_MEMORY_SIZE = int(os.environ.get("KIMI_CACHE_MEMORY_SIZE", "256"))  # 内存层最多条目数
+CACHE_MAX_ENTRIES = int(os.environ.get("KIMI_CACHE_MAX_ENTRIES", "20000"))  # 磁盘层最多条目数
+CACHE_TTL = float(os.environ.get("KIMI_CACHE_TTL", str(7 * 24 * 3600)))  # 条目有效期（秒）
+
+
+def make_cache_key(model, prompt, temperature, max_tokens, variant=0):
+    """缓存键：模型、渲染后的提示词与采样参数共同决定；多候选生成时每个候选序号单独缓存"""
+    key_parts = [model, prompt, temperature, max_tokens] + ([variant] if variant else [])
+    raw = json.dumps(key_parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _restore(row):
+    """磁盘层的一行 (content, created, trimmed) 还原为缓存内容"""
+    return TrimmedText(row[0]) if row[2] else row[0]
+
+
+# ===================== 2. 两级响应缓存 =====================
+class ResponseCache:
+    """线程安全的两级缓存：先查内存 LRU，未命中再查 SQLite，过期或超量时淘汰"""
+
+    def __init__(self, db_path=CACHE_DB_PATH, memory_size=CACHE_MEMORY_SIZE,
+                 max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (content, created)
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # 多个进程同时写入时等待对方释放写锁，而不是立即报 database is locked
+        self._db = sqlite3.connect(db_path, timeout=SHARED_BUSY_TIMEOUT, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                trimmed INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # 旧版本创建的数据库没有 trimmed 列（按字数预算截断的结果，读取时恢复为 TrimmedText）
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(responses)")]
+        if "trimmed" not in columns:
+            self._db.execute("ALTER TABLE responses ADD COLUMN trimmed INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._db.commit()
+
+    def get(self, key):
+        """读取缓存内容，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+            row = self._db.execute("SELECT content, created, trimmed FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            content = _restore(row)
+            self._remember(key, content, row[1])
+            self.hits += 1
+            return content
+
+    def peek(self, key):
+        """读取缓存内容但不计入命中统计、不刷新访问时间（相似请求预览用），未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                return entry[0]
+            row = self._db.execute("SELECT content, created, trimmed FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None
+        return _restore(row)
+
+    def put(self, key, content):
+        """写入缓存，并按条目上限淘汰最久未访问的记录"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, content, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, content, created, last_access, trimmed) VALUES (?, ?, ?, ?, ?)",
+                (key, content, now, now, int(is_trimmed(content)))
+            )
+            self._db.execute(
+                "DELETE FROM responses WHERE created < ? OR key IN "
+                "(SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (now - self.ttl, self.max_entries)
+            )
+            self._db.commit()
+
+    def _remember(self, key, content, created):
+        """写入内存层（调用方需持有锁）"""
+        self._memory[key] = (content, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def stats(self):
+        """命中/未命中计数与当前条目数"""
+        with self._lock:
+            disk_entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """进程级共享缓存实例（首次使用时才创建数据库文件）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
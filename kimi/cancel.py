@@ -0,0 +1,108 @@
+"""生成取消：界面的“停止生成”、页面关闭或客户端断开时立即断开上游连接，释放工作线程
+
+- CancelToken：一次生成的取消令牌。引擎在拿到上游响应后注册“关闭响应”回调，
+  取消时回调在调用方线程中执行，正在阻塞读取上游的线程随即返回；排队与重试的等待也会被打断；
+- ticking：在后台线程读取流式生成，当前线程至少每隔 interval 秒醒来一次（产出 None）。
+  Streamlit 只在输出元素时检查“停止/重跑”请求，服务端只在写出时发现客户端已断开，
+  等待首个 token 或排队期间也需要定期醒来，才能及时发现并取消。
+"""
+import asyncio
+import queue
+import threading
+
+HEARTBEAT_SECONDS = 0.5  # 等待上游期间界面/服务端醒来检查是否已取消的间隔
+
+
+class GenerationCancelled(Exception):
+    """生成在排队或重试等待期间被取消"""
+
+
+class CancelToken:
+    """线程安全的取消令牌：cancel() 可在任意线程调用，多次调用只生效一次"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass  # 关闭已断开的连接等失败不影响取消
+
+    def on_cancel(self, callback):
+        """注册取消回调（已取消时立即调用），返回注销函数"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def sleep(self, seconds):
+        """可被取消的等待：被取消时抛出 GenerationCancelled"""
+        if self._event.wait(seconds):
+            raise GenerationCancelled()
+
+    async def sleep_async(self, seconds):
+        """sleep 的异步版本：等待期间不占用线程"""
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        remove = self.on_cancel(lambda: loop.call_soon_threadsafe(woken.set))
+        try:
+            await asyncio.wait_for(woken.wait(), seconds)
+        except asyncio.TimeoutError:
+            return
+        finally:
+            remove()
+        raise GenerationCancelled()
+
+
+def ticking(stream, cancel, interval=HEARTBEAT_SECONDS):
+    """在后台线程读取 stream 并转发；超过 interval 秒没有新内容时产出 None
+    调用方提前关闭（或被中断）时取消 cancel，后台线程随即结束并关闭 stream"""
+    updates = queue.Queue()
+    done = object()
+
+    def pump():
+        try:
+            for item in stream:
+                updates.put(item)
+                if cancel.cancelled:
+                    break
+        finally:
+            stream.close()
+            updates.put(done)
+
+    threading.Thread(target=pump, daemon=True).start()
+    finished = False
+    try:
+        while True:
+            try:
+                item = updates.get(timeout=interval)
+            except queue.Empty:
+                yield None
+                continue
+            if item is done:
+                finished = True
+                return
+            yield item
+    finally:
+        if not finished:
+            cancel.cancel()
@@ -0,0 +1,129 @@
+"""进程级 Kimi 客户端注册表：按 (密钥哈希, 接口地址) 复用客户端和 HTTP 连接池"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+# ===================== 1. 连接池配置（可通过环境变量覆盖） =====================
+POOL_MAX_CONNECTIONS = int(os.environ.get("KIMI_POOL_MAX_CONNECTIONS", "20"))
+POOL_MAX_KEEPALIVE = int(os.environ.get("KIMI_POOL_MAX_KEEPALIVE", "10"))
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get("KIMI_POOL_KEEPALIVE_EXPIRY", "60"))  # 空闲长连接保留秒数
+CLIENT_IDLE_TTL = float(os.environ.get("KIMI_CLIENT_IDLE_TTL", "1800"))  # 客户端闲置多久后被回收（秒）
+CONNECT_TIMEOUT = float(os.environ.get("KIMI_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("KIMI_READ_TIMEOUT", "600"))
+
+
+def key_fingerprint(api_key):
+    """密钥指纹：仅用于注册表键和日志，不保留明文密钥"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+# ===================== 2. 客户端注册表 =====================
+class ClientRegistry:
+    """线程安全的客户端注册表，Streamlit 各会话与 Gradio 各工作线程共享同一实例"""
+
+    def __init__(self, max_connections=POOL_MAX_CONNECTIONS, max_keepalive=POOL_MAX_KEEPALIVE,
+                 keepalive_expiry=POOL_KEEPALIVE_EXPIRY, idle_ttl=CLIENT_IDLE_TTL):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._clients = {}  # (密钥指纹, base_url, 事件循环id) -> [client, 最近使用时间, 事件循环]
+
+    def get(self, api_key, base_url):
+        """获取（或创建）该密钥与接口地址对应的共享客户端"""
+        return self._get_or_create(api_key, base_url, None)
+
+    def get_async(self, api_key, base_url):
+        """获取当前事件循环上的共享异步客户端（httpx.AsyncClient 不能跨事件循环复用）"""
+        return self._get_or_create(api_key, base_url, asyncio.get_running_loop())
+
+    def _get_or_create(self, api_key, base_url, loop):
+        fingerprint = key_fingerprint(api_key)
+        registry_key = (fingerprint, base_url, id(loop) if loop else None)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(registry_key)
+            if entry is None:
+                if loop is None:
+                    client = OpenAI(
+                        api_key=api_key,
+                        base_url=base_url,
+                        max_retries=0,  # 429 重试由 kimi.limiter 统一处理
+                        http_client=httpx.Client(limits=self.limits, timeout=self.timeout)
+                    )
+                else:
+                    client = AsyncOpenAI(
+                        api_key=api_key,
+                        base_url=base_url,
+                        max_retries=0,
+                        http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+                    )
+                entry = self._clients[registry_key] = [client, now, loop]
+                logger.info("创建 Kimi %s客户端 key=%s base_url=%s", "异步" if loop else "", fingerprint, base_url)
+            entry[1] = now
+            return entry[0]
+
+    def _evict_idle(self, now):
+        """回收闲置超过 idle_ttl 的客户端并关闭其连接池（调用方需持有锁）"""
+        expired = [k for k, (_, last_used, _) in self._clients.items() if now - last_used > self.idle_ttl]
+        for registry_key in expired:
+            self._close(*self._clients.pop(registry_key))
+            logger.info("回收闲置 Kimi 客户端 key=%s", registry_key[0])
+
+    @staticmethod
+    def _close(client, _last_used, loop):
+        if loop is None:
+            client.close()
+        elif not loop.is_closed():
+            # 异步客户端需在其所属事件循环中关闭
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+
+    def close_all(self):
+        """关闭全部客户端（进程退出时调用）"""
+        with self._lock:
+            for entry in self._clients.values():
+                self._close(*entry)
+            self._clients.clear()
+
+    def stats(self):
+        """返回各客户端的指纹与闲置时长，不包含明文密钥"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {"key": fingerprint, "base_url": base_url, "async": loop is not None,
+                 "idle_seconds": round(now - last_used, 1)}
+                for (fingerprint, base_url, _), (_, last_used, loop) in self._clients.items()
+            ]
+
+    def __repr__(self):
+        return f"ClientRegistry(clients={[k[:2] for k in self._clients]})"
+
+
+_registry = ClientRegistry()
+
+
+def get_client(api_key, base_url):
+    """从进程级注册表获取共享客户端"""
+    return _registry.get(api_key, base_url)
+
+
+def get_async_client(api_key, base_url):
+    """从进程级注册表获取当前事件循环上的共享异步客户端"""
+    return _registry.get_async(api_key, base_url)
+
+
+def get_registry():
+    return _registry
@@ -0,0 +1,254 @@
+"""正文存储：生成结果写入磁盘文件，页面状态只保存句柄，内存中只按会话与全进程上限保留最近使用的正文
+
+每个会话把完整结果放在页面状态里时，常驻内存随会话数线性增长，直到会话过期才释放；
+改为存储后：
+
+- 正文按内容的 SHA-256 命名写入 CONTENT_DIR（相同结果只存一份），句柄就是这个十六进制摘要；
+- 读取时用 mmap 映射文件后直接解码，不额外复制一份字节串；
+- 最近读写的正文留在内存 LRU 中，按 sys.getsizeof 记账：每个会话不超过 CONTENT_SESSION_MEMORY，
+  全进程不超过 CONTENT_MEMORY_LIMIT，超出时先淘汰该会话（或全进程）最久未使用的正文，
+  被淘汰的正文下次读取时从磁盘加载；
+- 超过 CONTENT_TTL 未被读写的文件定期清理，句柄对应的文件不存在时读取结果为 None。
+"""
+import hashlib
+import mmap
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from kimi import DATA_DIR
+
+# ===================== 1. 正文存储配置（可通过环境变量覆盖） =====================
+CONTENT_DIR = os.environ.get("KIMI_CONTENT_DIR", os.path.join(DATA_DIR, "content"))
+CONTENT_SESSION_MEMORY = int(os.environ.get("KIMI_CONTENT_SESSION_MEMORY", str(1024 * 1024)))  # 每个会话（字节）
+CONTENT_MEMORY_LIMIT = int(os.environ.get("KIMI_CONTENT_MEMORY_LIMIT", str(64 * 1024 * 1024)))  # 全进程（字节）
+CONTENT_TTL = float(os.environ.get("KIMI_CONTENT_TTL", str(7 * 24 * 3600)))  # 文件未被读写超过该秒数后清理
+CONTENT_SWEEP_INTERVAL = 3600  # 两次清理之间至少间隔的秒数
+
+
+def content_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def format_bytes(size):
+    """界面展示用的字节数"""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+# ===================== 2. 磁盘 + 内存 LRU 存储 =====================
+class ContentStore:
+    """线程安全的正文存储：磁盘文件为准，内存 LRU 按会话与全进程两级字节上限淘汰"""
+
+    def __init__(self, directory=CONTENT_DIR, session_limit=CONTENT_SESSION_MEMORY,
+                 memory_limit=CONTENT_MEMORY_LIMIT, ttl=CONTENT_TTL):
+        self.directory = directory
+        self.session_limit = session_limit
+        self.memory_limit = memory_limit
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # 句柄 -> (正文, 字节数)，全进程 LRU
+        self._memory_bytes = 0
+        self._sessions = {}  # 会话 id -> OrderedDict(句柄 -> 字节数)，会话内 LRU
+        self._owners = {}  # 句柄 -> 在内存中引用它的会话 id 集合
+        self._last_sweep = 0.0
+        self.disk_reads = 0
+        self.disk_writes = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".txt")
+
+    def put(self, text, session_id=None):
+        """保存正文并返回句柄；空文本的句柄为空字符串"""
+        if not text:
+            return ""
+        key = content_key(text)
+        path = self._path(key)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，其他线程或进程不会读到写了一半的文件
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8", newline="") as f:
+                f.write(text)
+            os.replace(temp_path, path)
+            self.disk_writes += 1
+        with self._lock:
+            self._remember(key, text, session_id)
+        self._maybe_sweep()
+        return key
+
+    def get(self, key, session_id=None):
+        """按句柄读取正文（内存未命中时从磁盘加载）；句柄为空返回空字符串，文件已清理返回 None"""
+        if not key:
+            return ""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._remember(key, entry[0], session_id)
+                return entry[0]
+        text = self._read(key)
+        if text is not None:
+            with self._lock:
+                self._remember(key, text, session_id)
+        return text
+
+    def read_bytes(self, key):
+        """正文的 UTF-8 字节（下载用，不进入内存 LRU）；文件已清理返回 None"""
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                if not os.fstat(f.fileno()).st_size:
+                    return ""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    text = str(mapped, "utf-8")
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self.disk_reads += 1
+        return text
+
+    def _remember(self, key, text, session_id):
+        """写入内存 LRU 并记到会话名下，超出会话或全进程上限时淘汰（调用方需持有锁）"""
+        size = sys.getsizeof(text)
+        if size > self.session_limit or size > self.memory_limit:
+            return  # 单篇就超过上限的正文每次从磁盘读取
+        if key not in self._memory:
+            self._memory[key] = (text, size)
+            self._memory_bytes += size
+        self._memory.move_to_end(key)
+        if session_id is not None:
+            charges = self._sessions.setdefault(session_id, OrderedDict())
+            charges[key] = size
+            charges.move_to_end(key)
+            self._owners.setdefault(key, set()).add(session_id)
+            while sum(charges.values()) > self.session_limit:
+                oldest, _ = charges.popitem(last=False)
+                self._release(oldest, session_id)
+        while self._memory_bytes > self.memory_limit:
+            oldest = next(iter(self._memory))
+            for owner in self._owners.pop(oldest, ()):
+                self._sessions[owner].pop(oldest, None)
+                if not self._sessions[owner]:
+                    del self._sessions[owner]
+            self._drop(oldest)
+
+    def _release(self, key, session_id):
+        """会话不再引用该正文；没有其他会话引用时移出内存（调用方需持有锁）"""
+        owners = self._owners.get(key)
+        if owners is not None:
+            owners.discard(session_id)
+            if owners:
+                return
+            del self._owners[key]
+        self._drop(key)
+
+    def _drop(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[1]
+            self.evictions += 1
+
+    def release_session(self, session_id):
+        """释放会话在内存中引用的全部正文（磁盘文件保留，句柄仍可读取）"""
+        with self._lock:
+            for key in self._sessions.pop(session_id, {}):
+                self._release(key, session_id)
+
+    def _maybe_sweep(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < CONTENT_SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        self.sweep(now - self.ttl)
+
+    def sweep(self, before):
+        """删除最后读写时间早于 before 的文件，返回删除的文件数"""
+        removed = 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    if entry.stat().st_mtime < before:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def session_usage(self, session_id):
+        """会话在内存中保留的正文篇数与字节数"""
+        with self._lock:
+            charges = self._sessions.get(session_id, {})
+            return {"entries": len(charges), "memory_bytes": sum(charges.values()), "limit": self.session_limit}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_limit": self.memory_limit,
+                "sessions": sum(1 for charges in self._sessions.values() if charges),
+                "disk_reads": self.disk_reads,
+                "disk_writes": self.disk_writes,
+                "evictions": self.evictions
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_content_store():
+    """进程级共享的正文存储"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ContentStore()
+    return _store
+
+
+# ===================== 3. 界面使用的函数 =====================
+def store_content(text, session_id=None):
+    """保存正文，返回页面状态中保存的句柄"""
+    return get_content_store().put(text, session_id)
+
+
+def load_content(key, session_id=None):
+    """按句柄读取正文；文件已过期清理时返回 None"""
+    return get_content_store().get(key, session_id)
+
+
+def load_content_bytes(key):
+    return get_content_store().read_bytes(key)
+
+
+def release_content(session_id):
+    """会话清空结果时释放其内存预算"""
+    get_content_store().release_session(session_id)
+
+
+def content_usage(session_id):
+    return get_content_store().session_usage(session_id)
+
+
+def content_stats():
+    return get_content_store().stats()
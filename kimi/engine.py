@@ -0,0 +1,802 @@
+"""生成引擎：模板、参数校验、上游流式调用与错误分类（与具体界面无关）"""
+import asyncio
+import os
+import queue
+import threading
+
+from kimi.cache import get_response_cache, make_cache_key
+from kimi.cancel import CancelToken
+from kimi.client import get_async_client, get_client
+from kimi.hedge import hedge_stats, hedged_stream, hedged_stream_async
+from kimi.history import record_generation
+from kimi.inflight import get_inflight_registry
+from kimi.length import is_trimmed, make_length_guard
+from kimi.keypool import KeyPoolExhausted, get_key_pool, uses_key_pool
+from kimi.limiter import get_rate_limiter, get_retry_policy, is_rate_limit_error, retry_after_seconds
+from kimi.metrics import GenerationTrace
+from kimi.routing import describe_route, route_request
+from kimi.similar import SIMILAR_THRESHOLD, get_similar_index, index_similar, similar_matches
+from kimi.tokens import describe_estimate, estimate_generation, estimate_tokens
+
+# ===================== 1. 模型与模板配置 =====================
+KIMI_BASE_URL = os.environ.get("KIMI_BASE_URL", "https://api.moonshot.cn/v1")
+KIMI_MODEL = "moonshot-v1-8k"  # 默认模型；提示词较长时由 kimi.routing 自动升级到 32k/128k
+KIMI_TEMPERATURE = 0.7
+KIMI_MAX_TOKENS = 8192  # 无法从字数/章节数推导输出规模时的上限
+
+PROMPT_TEMPLATES = {
+    "故事生成": {
+        "template": "请以{主题}为核心，写一个{风格}风格的短篇故事，字数控制在{字数}字左右。要求情节完整，角色鲜明，语言流畅。",
+        "params": ["主题", "风格", "字数"]
+    },
+    "营销文案": {
+        "template": "为{产品名称}撰写{平台}平台的营销文案，突出{核心卖点}，语言风格{风格}，字数控制在{字数}字内。需吸引目标用户，激发购买欲。",
+        "params": ["产品名称", "平台", "核心卖点", "风格", "字数"]
+    },
+    "论文提纲": {
+        "template": "为《{论文题目}》（{学科}领域）设计详细提纲，逻辑清晰，结构完整，至少包含{章节数}个章节。需列出每个章节的核心研究内容和逻辑关联。",
+        "params": ["论文题目", "学科", "章节数"]
+    },
+    "自由创作": {
+        "template": "{用户输入}",
+        "params": ["用户输入"]
+    }
+}
+
+# 3.py 使用的带“背景/场景”参数的模板
+BACKGROUND_PROMPT_TEMPLATES = {
+    "故事生成": {
+        "template": "请以{主题}为核心，在{背景}背景下，写一个{风格}风格的短篇故事，字数控制在{字数}字左右。要求情节完整，角色鲜明，语言流畅。",
+        "params": ["主题", "背景", "风格", "字数"]
+    },
+    "营销文案": {
+        "template": "为{产品名称}撰写{平台}平台的营销文案，突出{核心卖点}，结合{背景}场景，语言风格{风格}，字数控制在{字数}字内。需吸引目标用户，激发购买欲。",
+        "params": ["产品名称", "平台", "核心卖点", "背景", "风格", "字数"]
+    },
+    "论文提纲": {
+        "template": "为《{论文题目}》（{学科}领域）设计详细提纲，结合{背景}研究背景，逻辑清晰，结构完整，至少包含{章节数}个章节。需列出每个章节的核心研究内容和逻辑关联。",
+        "params": ["论文题目", "学科", "背景", "章节数"]
+    },
+    "自由创作": {
+        "template": "{用户输入}",
+        "params": ["用户输入"]
+    }
+}
+
+# 长文分章节生成（kimi.longform）使用的模板：先出大纲，再按大纲并发撰写各章节
+# 章节模板把文档说明与完整大纲放在最前面，各章节请求共享相同的前缀
+LONGFORM_PROMPT_TEMPLATES = {
+    "故事大纲": {
+        "template": "请以{主题}为核心，为一篇{风格}风格的长篇故事设计{章节数}个章节的大纲。每个章节单独一行，格式为“第N章 章节标题：本章主要情节”，主要情节用一两句话概括，只输出大纲，不要写正文。",
+        "params": ["主题", "风格", "章节数"]
+    },
+    "章节撰写": {
+        "template": "你正在撰写{文档}，全文大纲如下：\n{大纲}\n\n现在请撰写以下部分的正文，字数控制在{字数}字左右：\n{章节}\n\n要求：只输出该部分的正文（可以使用小标题），与大纲保持一致，和前后章节衔接自然，不要重复其他章节的内容，不要写全文总结。",
+        "params": ["文档", "大纲", "章节", "字数"]
+    }
+}
+
+# 局部修改（kimi.refine）使用的模板：只发送原始要求、目标段落及其前后文，模型只输出改写后的这一段
+REFINE_PROMPT_TEMPLATES = {
+    "局部修改": {
+        "template": "按要求“{原始要求}”写成的文本中，有一段需要按修改要求改写。\n前文：{前文}\n原段落：{段落}\n后文：{后文}\n已采纳的修改：{修改记录}\n修改要求：{修改要求}\n只输出改写后的这一段，约{字数}字（修改要求另有说明时以其为准），与前后文衔接自然，不要输出其他内容。",
+        "params": ["原始要求", "前文", "段落", "后文", "修改记录", "修改要求", "字数"]
+    }
+}
+
+DEFAULT_TEMPLATE_SET = "default"
+LONGFORM_TEMPLATE_SET = "longform"
+REFINE_TEMPLATE_SET = "refine"
+TEMPLATE_SETS = {
+    DEFAULT_TEMPLATE_SET: PROMPT_TEMPLATES,
+    "background": BACKGROUND_PROMPT_TEMPLATES,
+    LONGFORM_TEMPLATE_SET: LONGFORM_PROMPT_TEMPLATES,
+    REFINE_TEMPLATE_SET: REFINE_PROMPT_TEMPLATES,
+}
+
+NUMERIC_PARAMS = ["字数", "章节数"]
+MAX_VARIANTS = 5  # 多候选生成一次最多并发的候选数
+WAIT_NOTICE_SECONDS = 1.0  # 限流排队超过该秒数时向界面提示预计等待时间
+
+
+# ===================== 2. 校验与错误分类 =====================
+def validate_params(required_params, param_dict):
+    """返回缺失或无效的参数名（数值参数须为正整数，其余参数须非空）"""
+    invalid_or_missing = []
+    for param in required_params:
+        value = param_dict.get(param, "")
+        if param in NUMERIC_PARAMS:
+            try:
+                num_value = int(value) if value else 0
+                if num_value <= 0:
+                    invalid_or_missing.append(param)
+            except (ValueError, TypeError):
+                invalid_or_missing.append(param)
+        else:
+            if not str(value).strip():
+                invalid_or_missing.append(param)
+    return invalid_or_missing
+
+
+def error_class(error):
+    """上游异常的类型标签（用于指标）：invalid_api_key / insufficient_funds / rate_limit / key_pool_exhausted / other"""
+    error_info = str(error).lower()
+    if isinstance(error, KeyPoolExhausted):
+        return "key_pool_exhausted"
+    elif "invalid api key" in error_info:
+        return "invalid_api_key"
+    elif "insufficient funds" in error_info:
+        return "insufficient_funds"
+    elif "rate limit" in error_info:
+        return "rate_limit"
+    else:
+        return "other"
+
+
+def classify_error(error):
+    """把上游异常转换为界面提示"""
+    kind = error_class(error)
+    if kind == "invalid_api_key":
+        return "❌ Kimi API密钥无效或已过期！"
+    elif kind == "insufficient_funds":
+        return "❌ Kimi账户余额不足，请充值！"
+    elif kind == "rate_limit":
+        return "❌ 请求频率过高，请稍后再试！"
+    elif kind == "key_pool_exhausted":
+        return str(error)
+    else:
+        return f"❌ 生成失败：{str(error)}"
+
+
+# ===================== 3. 流式生成 =====================
+def check_api_key(kimi_api_key):
+    """返回密钥格式错误提示，格式正确（或未填写但已配置共享密钥池）时返回 None"""
+    if uses_key_pool(kimi_api_key):
+        return None
+    if not kimi_api_key or not str(kimi_api_key).strip().startswith("sk-"):
+        return "❌ 请输入有效的 Kimi API 密钥（以 sk- 开头）！"
+    return None
+
+
+def render_prompt(template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET):
+    """校验参数并渲染提示词，返回 (prompt, 错误提示)"""
+    try:
+        template_info = TEMPLATE_SETS[template_set][template_type]
+        template = template_info["template"]
+        required_params = template_info["params"]
+    except KeyError:
+        return None, "❌ 模板类型错误，无此生成模板！"
+
+    invalid_or_missing = validate_params(required_params, param_dict)
+    if invalid_or_missing:
+        return None, f"❌ 缺少或无效参数：{', '.join(invalid_or_missing)}（请填写有效且非空的内容）"
+    return template.format(**{param: param_dict[param] for param in required_params}), None
+
+
+def plan_route(template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET):
+    """返回本次生成将使用的路由（模型与输出上限），参数无效时返回 None"""
+    prompt, error = render_prompt(template_type, param_dict, template_set)
+    if error:
+        return None
+    return route_request(prompt, param_dict, KIMI_MODEL, KIMI_MAX_TOKENS)
+
+
+def route_caption(template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET):
+    """界面展示用的路由说明，参数无效时返回空字符串"""
+    route = plan_route(template_type, param_dict, template_set)
+    return describe_route(route) if route else ""
+
+
+def estimate_template(template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET):
+    """生成前预估：输入/输出令牌数、耗时与费用，参数无效时返回 None"""
+    prompt, error = render_prompt(template_type, param_dict, template_set)
+    if error:
+        return None
+    route = route_request(prompt, param_dict, KIMI_MODEL, KIMI_MAX_TOKENS)
+    if route is None:
+        return None
+    return estimate_generation(route.model, prompt, param_dict, route.max_tokens)
+
+
+def estimate_caption(template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET):
+    """界面展示用的生成前预估，参数无效时返回空字符串"""
+    estimate = estimate_template(template_type, param_dict, template_set)
+    return describe_estimate(estimate) if estimate else ""
+
+
+def _request_kwargs(prompt, route):
+    return dict(
+        model=route.model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=KIMI_TEMPERATURE,
+        max_tokens=route.max_tokens,
+        stream=True
+    )
+
+
+def _usage_tokens(chunk):
+    """读取流式分块中的用量 (prompt_tokens, completion_tokens)，没有用量时返回 None
+    （OpenAI 放在 chunk.usage，Moonshot 放在 choices[0].usage）"""
+    usage = getattr(chunk, "usage", None)
+    if usage is None and chunk.choices:
+        usage = getattr(chunk.choices[0], "usage", None)
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+
+
+def _record_cache_lookup(trace, use_cache, cached):
+    if not use_cache:
+        trace.cache_lookup("bypass")
+    elif cached is None:
+        trace.cache_lookup("miss")
+    else:
+        trace.cache_lookup("hit")
+        trace.finish("cache")
+
+
+def _record_usage(trace, usage):
+    """记录上游返回的令牌用量，返回输出令牌数（没有用量时返回 None）"""
+    if usage is None:
+        return None
+    prompt_tokens, completion_tokens = usage
+    trace.usage(prompt_tokens, completion_tokens)
+    return completion_tokens
+
+
+def _queue_notice(wait):
+    return f"⏳ 请求排队中，预计等待 {wait:.0f} 秒..."
+
+
+def _retry_notice(delay, attempt):
+    return f"⏳ 请求频率过高，{delay:.0f} 秒后自动重试（第 {attempt} 次）..."
+
+
+def _reserve(pool, kimi_api_key, tokens):
+    """预约一次请求，返回 (实际使用的密钥, 需等待秒数)
+    用户密钥在自己的令牌桶中排队；共享密钥池选择预计等待最短的密钥（全部不可用时抛出 KeyPoolExhausted）"""
+    if pool is None:
+        return kimi_api_key, get_rate_limiter().reserve(kimi_api_key, tokens)
+    return pool.acquire(tokens)
+
+
+def _cool_down(pool, api_key, error):
+    """共享密钥池：密钥因限流、余额不足或失效进入冷却时返回 True（可换用其他密钥立即重试）"""
+    kind = "rate_limit" if is_rate_limit_error(error) else error_class(error)
+    return pool.report_error(api_key, kind, retry_after_seconds(error))
+
+
+def _charge(api_key, tokens):
+    """请求结束后补扣实际消耗的令牌；共享密钥池中的密钥同时记入该密钥的用量统计"""
+    get_rate_limiter().charge(api_key, tokens)
+    pool = get_key_pool()
+    if pool is not None:
+        pool.record_tokens(api_key, tokens)
+
+
+def _release_key(kimi_api_key, api_key):
+    """一次上游请求结束：使用共享密钥池时归还该密钥的进行中名额"""
+    if api_key and uses_key_pool(kimi_api_key):
+        get_key_pool().release(api_key)
+
+
+class _UpstreamAttempts:
+    """一次上游调用的排队与重试状态，同步与异步版本共用：当前密钥、需等待秒数、是否占用密钥池名额
+    两个版本的循环只负责等待与产出提示，失败后换用哪个密钥、等待多久或放弃都由 retry_delay 决定"""
+
+    def __init__(self, kimi_api_key, route, trace):
+        self.route = route
+        self.trace = trace
+        self.limiter = get_rate_limiter()
+        self.retry_policy = get_retry_policy()
+        self.retry_policy.record_request()
+        self.pool = get_key_pool() if uses_key_pool(kimi_api_key) else None
+        self.api_key, self.wait = _reserve(self.pool, kimi_api_key, route.prompt_tokens)
+        self.leased = self.pool is not None  # 当前密钥占用着密钥池的进行中名额
+        self.attempt, self.waited = 0, 0.0
+
+    def retry_delay(self, error):
+        """一次调用失败：返回重试前需等待的秒数（换用密钥池中其他密钥时为 0），不应重试时返回 None
+        等待结束后调用 resume 选择下一次使用的密钥"""
+        self.attempt += 1
+        if self.pool is not None:
+            self.release()
+            if _cool_down(self.pool, self.api_key, error) and self.attempt < self.pool.size:
+                self.trace.retry()
+                return 0.0
+        delay = self.retry_policy.next_delay(error, self.attempt, self.waited)
+        if delay is None:
+            return None
+        self.limiter.penalize(self.api_key, delay)
+        self.trace.retry()
+        return delay
+
+    def resume(self, delay):
+        """重试等待结束：累计已等待的时间，使用密钥池时重新选择密钥（self.wait 为新密钥的排队时间）"""
+        self.waited += delay
+        self.wait = 0.0
+        if self.pool is not None:
+            self.api_key, self.wait = self.pool.acquire(self.route.prompt_tokens)
+            self.leased = True
+
+    def release(self):
+        """归还当前密钥占用的密钥池名额（未占用时不做任何事）"""
+        if self.leased:
+            self.pool.release(self.api_key)
+            self.leased = False
+
+
+def _create_with_retry(kimi_api_key, prompt, route, trace, cancel):
+    """限流排队后发起请求，遇到 429 按退避策略重试；等待期间产出提示，最终返回 (响应流, 实际使用的密钥)
+    使用共享密钥池时，密钥被限流或余额不足即进入冷却并换用其他密钥；排队与重试的等待可被 cancel 打断"""
+    attempts = _UpstreamAttempts(kimi_api_key, route, trace)
+    try:
+        while True:
+            if attempts.wait >= WAIT_NOTICE_SECONDS:
+                yield _queue_notice(attempts.wait)
+            cancel.sleep(attempts.wait)
+            try:
+                client = get_client(attempts.api_key, KIMI_BASE_URL)
+                return client.chat.completions.create(**_request_kwargs(prompt, route)), attempts.api_key
+            except Exception as e:
+                delay = attempts.retry_delay(e)
+                if delay is None:
+                    raise
+                if delay:
+                    yield _retry_notice(delay, attempts.attempt)
+                    cancel.sleep(delay)
+                attempts.resume(delay)
+    except BaseException:
+        # 排队、重试等待中被取消或最终失败：归还占用的密钥池名额
+        attempts.release()
+        raise
+
+
+def _finish_partial(api_key, content, trace, save, cancel):
+    """生成中途结束（取消、断开或出错）：按已生成的部分补扣令牌并保存到生成历史（不写入响应缓存）"""
+    if not content:
+        return
+    _charge(api_key, estimate_tokens(content))
+    save(content, "cancelled" if cancel.cancelled or not trace.finished else "error")
+
+
+def _stream_upstream(kimi_api_key, prompt, route, trace, save, cancel, guard=None):
+    """调用上游并逐块产出累计文本，结束后补扣令牌并保存结果（save）；出错时产出以 ❌ 开头的提示
+    cancel 被取消或调用方关闭生成器时立即关闭响应（断开上游连接），已生成的部分保存到生成历史；
+    guard（kimi.length.LengthGuard）判断超出字数预算时在句末截断并断开上游，按完整结果保存"""
+    content = ""
+    streamed = ""  # 截断前实际收到的文本（按此补扣令牌）
+    completed = False
+    response = None
+    api_key = None
+    unregister = None
+    try:
+        response, api_key = yield from _create_with_retry(kimi_api_key, prompt, route, trace, cancel)
+        # 取消时在调用取消的线程中关闭响应，正在阻塞读取的本线程随即返回
+        unregister = cancel.on_cancel(response.close)
+        # 逐块累积增量文本，每收到一段就产出当前完整内容
+        usage = None
+        for chunk in response:
+            usage = _usage_tokens(chunk) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                trace.first_token()
+                content += delta
+                cut = guard.feed(content) if guard is not None else None
+                if cut is not None:
+                    # 超出字数预算：截断到句末并断开上游，不再等待多余的输出
+                    streamed, content = content, guard.trim(content, cut)
+                    response.close()
+                    break
+                yield content
+        if cancel.cancelled:
+            return
+        completed = True
+        completion_tokens = _record_usage(trace, usage)
+        _charge(api_key, completion_tokens or estimate_tokens(streamed or content))
+        if is_trimmed(content):
+            save(content, "trimmed")
+            trace.finish("trimmed")
+            yield content
+        elif content:
+            save(content)
+            trace.finish("ok")
+        else:
+            trace.finish("empty")
+            yield content  # 覆盖排队提示
+    except Exception as e:
+        # 取消导致的连接中断不是错误
+        if not cancel.cancelled:
+            trace.error(error_class(e))
+            yield classify_error(e)
+    finally:
+        if unregister:
+            unregister()
+        if response is not None and not completed:
+            response.close()
+        if not completed:
+            _finish_partial(api_key, content, trace, save, cancel)
+        _release_key(kimi_api_key, api_key)
+
+
+async def _stream_upstream_async(kimi_api_key, prompt, route, trace, save, cancel, guard=None):
+    """_stream_upstream 的异步版本，等待上游、排队与重试时不占用线程
+    任务被取消（asyncio.CancelledError）或调用方关闭生成器时关闭响应；cancel 在每个分块之间检查"""
+    content = ""
+    streamed = ""
+    completed = False
+    response = None
+    api_key = None
+    attempts = None
+    try:
+        attempts = _UpstreamAttempts(kimi_api_key, route, trace)
+        while True:
+            if attempts.wait >= WAIT_NOTICE_SECONDS:
+                yield _queue_notice(attempts.wait)
+            await cancel.sleep_async(attempts.wait)
+            try:
+                client = get_async_client(attempts.api_key, KIMI_BASE_URL)
+                response = await client.chat.completions.create(**_request_kwargs(prompt, route))
+                break
+            except Exception as e:
+                delay = attempts.retry_delay(e)
+                if delay is None:
+                    raise
+                if delay:
+                    yield _retry_notice(delay, attempts.attempt)
+                    await cancel.sleep_async(delay)
+                attempts.resume(delay)
+        api_key = attempts.api_key
+
+        usage = None
+        async for chunk in response:
+            if cancel.cancelled:
+                return
+            usage = _usage_tokens(chunk) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                trace.first_token()
+                content += delta
+                cut = guard.feed(content) if guard is not None else None
+                if cut is not None:
+                    streamed, content = content, guard.trim(content, cut)
+                    await response.close()
+                    break
+                yield content
+        completed = True
+        completion_tokens = _record_usage(trace, usage)
+        _charge(api_key, completion_tokens or estimate_tokens(streamed or content))
+        if is_trimmed(content):
+            save(content, "trimmed")
+            trace.finish("trimmed")
+            yield content
+        elif content:
+            save(content)
+            trace.finish("ok")
+        else:
+            trace.finish("empty")
+            yield content
+    except Exception as e:
+        if not cancel.cancelled:
+            trace.error(error_class(e))
+            yield classify_error(e)
+    finally:
+        if response is not None and not completed:
+            await response.close()
+        if not completed:
+            _finish_partial(api_key, content, trace, save, cancel)
+        if attempts is not None:
+            attempts.release()
+
+
+def _result_saver(cache, cache_key, trace, template_type, template_set, param_dict, route, prompt, variant=0):
+    """上游生成结束后的保存：完整结果（含按字数预算截断的 trimmed）写入响应缓存与生成历史，
+    中途结束的部分结果只写入生成历史；单个结果（非多候选）的完整结果同时加入相似请求索引"""
+    def save(content, status="ok"):
+        if status in ("ok", "trimmed"):
+            cache.put(cache_key, content)
+            if not variant:
+                index_similar(template_set, template_type, route, param_dict, cache_key)
+        record_generation(template_type, template_set, param_dict, route.model, prompt, content, trace, status)
+    return save
+
+
+def _prepare_request(template_type, param_dict, template_set):
+    """渲染提示词并选择路由，返回 (提示词, 路由, 错误提示)"""
+    prompt, error = render_prompt(template_type, param_dict, template_set)
+    if error:
+        return None, None, error
+    route = route_request(prompt, param_dict, KIMI_MODEL, KIMI_MAX_TOKENS)
+    if route is None:
+        return None, None, "❌ 输入内容过长，超出所有可用模型的上下文长度！"
+    return prompt, route, None
+
+
+def generate_stream(kimi_api_key, template_type, param_dict, use_cache=True, template_set=DEFAULT_TEMPLATE_SET,
+                    coalesce=True, variant=0, cancel=None):
+    """流式生成：逐块产出累计文本，出错时产出以 ❌ 开头的提示
+    coalesce=True 时与进行中的相同请求合并，共享同一次上游调用的结果；
+    variant 为多候选生成中的候选序号，不同序号各自缓存与合并，互不复用；
+    cancel（kimi.cancel.CancelToken）被取消时立即断开上游并结束，已生成的部分记入生成历史"""
+    cancel = cancel or CancelToken()
+    error = check_api_key(kimi_api_key)
+    if error:
+        yield error
+        return
+    kimi_api_key = str(kimi_api_key or "").strip()
+
+    # 提前创建用户密钥的客户端，初始化失败时给出明确提示（密钥池中的密钥在发起请求时才选定）
+    try:
+        if kimi_api_key:
+            get_client(kimi_api_key, KIMI_BASE_URL)
+    except Exception as e:
+        yield f"❌ 客户端初始化失败：{str(e)}"
+        return
+
+    prompt, route, error = _prepare_request(template_type, param_dict, template_set)
+    if error:
+        yield error
+        return
+
+    trace = GenerationTrace(template_type, route.model)
+    try:
+        # 响应缓存：相同模型、提示词和采样参数直接返回历史结果
+        cache = get_response_cache()
+        cache_key = make_cache_key(route.model, prompt, KIMI_TEMPERATURE, route.max_tokens, variant)
+        cached = cache.get(cache_key) if use_cache else None
+        _record_cache_lookup(trace, use_cache, cached)
+        if cached is not None:
+            yield cached
+            return
+
+        save = _result_saver(cache, cache_key, trace, template_type, template_set, param_dict, route, prompt,
+                             variant)
+        partials = hedged_stream(
+            lambda attempt: _stream_upstream(kimi_api_key, prompt, route, attempt.wrap_trace(trace),
+                                             attempt.wrap_save(save), attempt.cancel,
+                                             make_length_guard(template_type, param_dict)),
+            trace.labels, cancel)
+        if not coalesce:
+            yield from partials
+            return
+        # 相同请求正在生成时直接挂上去；领头请求被取消则重新加入（可能由本请求领头）
+        while not cancel.cancelled:
+            flight, leader = get_inflight_registry().join(cache_key)
+            if leader:
+                yield from flight.lead(partials, cancel)
+                return
+            if (yield from flight.follow(cancel)):
+                trace.finish("coalesced")
+                return
+    except Exception as e:
+        trace.error(error_class(e))
+        yield classify_error(e)
+    finally:
+        trace.close()
+
+
+async def generate_stream_async(kimi_api_key, template_type, param_dict, use_cache=True,
+                                template_set=DEFAULT_TEMPLATE_SET, coalesce=True, variant=0, cancel=None):
+    """异步流式生成：与 generate_stream 行为一致，等待上游时不占用线程；任务被取消时同样断开上游"""
+    cancel = cancel or CancelToken()
+    error = check_api_key(kimi_api_key)
+    if error:
+        yield error
+        return
+    kimi_api_key = str(kimi_api_key or "").strip()
+
+    try:
+        if kimi_api_key:
+            get_async_client(kimi_api_key, KIMI_BASE_URL)
+    except Exception as e:
+        yield f"❌ 客户端初始化失败：{str(e)}"
+        return
+
+    prompt, route, error = _prepare_request(template_type, param_dict, template_set)
+    if error:
+        yield error
+        return
+
+    trace = GenerationTrace(template_type, route.model)
+    try:
+        cache = get_response_cache()
+        cache_key = make_cache_key(route.model, prompt, KIMI_TEMPERATURE, route.max_tokens, variant)
+        cached = cache.get(cache_key) if use_cache else None
+        _record_cache_lookup(trace, use_cache, cached)
+        if cached is not None:
+            yield cached
+            return
+
+        save = _result_saver(cache, cache_key, trace, template_type, template_set, param_dict, route, prompt,
+                             variant)
+        partials = hedged_stream_async(
+            lambda attempt: _stream_upstream_async(kimi_api_key, prompt, route, attempt.wrap_trace(trace),
+                                                   attempt.wrap_save(save), attempt.cancel,
+                                                   make_length_guard(template_type, param_dict)),
+            trace.labels, cancel)
+        if not coalesce:
+            async for partial in partials:
+                yield partial
+            return
+        while not cancel.cancelled:
+            flight, leader = get_inflight_registry().join(cache_key)
+            if leader:
+                # 显式关闭，保证本请求被取消时等待者立即得知
+                leading = flight.lead_async(partials, cancel)
+                try:
+                    async for partial in leading:
+                        yield partial
+                finally:
+                    await leading.aclose()
+                return
+            async for partial in flight.follow_async():
+                if cancel.cancelled:
+                    return
+                yield partial
+            if flight.completed:
+                trace.finish("coalesced")
+                return
+    except Exception as e:
+        trace.error(error_class(e))
+        yield classify_error(e)
+    finally:
+        trace.close()
+
+
+def find_similar(template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET, threshold=SIMILAR_THRESHOLD):
+    """生成前查找相似请求已生成的结果：返回 {"content", "similarity", "params"}，没有时返回 None
+    当前请求本身已在响应缓存中时返回 None（照常生成即可直接命中缓存）"""
+    prompt, route, error = _prepare_request(template_type, param_dict, template_set)
+    if error:
+        return None
+    cache = get_response_cache()
+    cache_key = make_cache_key(route.model, prompt, KIMI_TEMPERATURE, route.max_tokens)
+    if cache.peek(cache_key) is not None:
+        return None
+    for similarity, key, params in similar_matches(template_set, template_type, route, param_dict, threshold,
+                                                   cache_key):
+        content = cache.peek(key)
+        if content is None:
+            # 结果已从响应缓存中淘汰
+            get_similar_index().discard(key)
+            continue
+        return {"content": content, "similarity": round(similarity, 3), "params": params}
+    return None
+
+
+def cache_stats():
+    """响应缓存命中统计（含合并到进行中请求的次数 coalesced、对冲请求次数 hedged 与其中先响应的次数 hedge_wins）"""
+    hedge = hedge_stats()
+    return dict(get_response_cache().stats(), coalesced=get_inflight_registry().stats()["coalesced"],
+                hedged=hedge["hedged"], hedge_wins=hedge["hedge_wins"])
+
+
+def generate(kimi_api_key, template_type, param_dict, use_cache=True, template_set=DEFAULT_TEMPLATE_SET,
+             coalesce=True, variant=0):
+    """非流式生成：返回最终完整文本"""
+    result = ""
+    for result in generate_stream(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce,
+                                  variant):
+        pass
+    return result
+
+
+async def generate_async(kimi_api_key, template_type, param_dict, use_cache=True, template_set=DEFAULT_TEMPLATE_SET,
+                         coalesce=True, variant=0):
+    """异步非流式生成：返回最终完整文本"""
+    result = ""
+    async for result in generate_stream_async(kimi_api_key, template_type, param_dict, use_cache, template_set,
+                                              coalesce, variant):
+        pass
+    return result
+
+
+# ===================== 4. 多路并发生成（多候选、长文章节） =====================
+def clamp_variants(variants):
+    """候选数限制在 1 ~ MAX_VARIANTS"""
+    return max(1, min(int(variants or 1), MAX_VARIANTS))
+
+
+def merge_streams(streams):
+    """并发消费多路流式生成（多候选、长文各章节）：任一路有新内容时产出 (各路当前文本, 各路是否结束)
+    每路在独立线程中读取，总耗时接近最慢的一路；调用方提前关闭时各线程随即关闭对应的生成器"""
+    updates = queue.Queue()
+    stop = threading.Event()
+
+    def pump(index, stream):
+        try:
+            for partial in stream:
+                updates.put((index, partial))
+                if stop.is_set():
+                    break
+        finally:
+            stream.close()
+            updates.put((index, None))
+
+    contents = [""] * len(streams)
+    finished = [False] * len(streams)
+    for index, stream in enumerate(streams):
+        threading.Thread(target=pump, args=(index, stream), daemon=True).start()
+    try:
+        while not all(finished):
+            # 取出当前已到达的全部更新后再产出，多路同时输出时减少刷新次数
+            pending = [updates.get()]
+            while True:
+                try:
+                    pending.append(updates.get_nowait())
+                except queue.Empty:
+                    break
+            for index, partial in pending:
+                if partial is None:
+                    finished[index] = True
+                else:
+                    contents[index] = partial
+            yield list(contents), list(finished)
+    finally:
+        stop.set()
+
+
+async def merge_streams_async(streams):
+    """merge_streams 的异步版本：各路作为同一事件循环中的任务并发读取"""
+    updates = asyncio.Queue()
+
+    async def pump(index, stream):
+        try:
+            async for partial in stream:
+                updates.put_nowait((index, partial))
+        finally:
+            await stream.aclose()
+            updates.put_nowait((index, None))
+
+    contents = [""] * len(streams)
+    finished = [False] * len(streams)
+    tasks = [asyncio.ensure_future(pump(index, stream)) for index, stream in enumerate(streams)]
+    try:
+        while not all(finished):
+            pending = [await updates.get()]
+            while not updates.empty():
+                pending.append(updates.get_nowait())
+            for index, partial in pending:
+                if partial is None:
+                    finished[index] = True
+                else:
+                    contents[index] = partial
+            yield list(contents), list(finished)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def generate_variants_stream(kimi_api_key, template_type, param_dict, variants=3, use_cache=True,
+                             template_set=DEFAULT_TEMPLATE_SET, coalesce=True, cancel=None):
+    """多候选流式生成：并发发起 variants 个候选，产出 (各候选当前文本, 各候选是否结束)；cancel 同时取消全部候选"""
+    streams = [generate_stream(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce, variant,
+                               cancel)
+               for variant in range(clamp_variants(variants))]
+    yield from merge_streams(streams)
+
+
+async def generate_variants_stream_async(kimi_api_key, template_type, param_dict, variants=3, use_cache=True,
+                                         template_set=DEFAULT_TEMPLATE_SET, coalesce=True, cancel=None):
+    """异步多候选流式生成：与 generate_variants_stream 行为一致"""
+    streams = [generate_stream_async(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce,
+                                     variant, cancel)
+               for variant in range(clamp_variants(variants))]
+    async for update in merge_streams_async(streams):
+        yield update
+
+
+def generate_variants(kimi_api_key, template_type, param_dict, variants=3, use_cache=True,
+                      template_set=DEFAULT_TEMPLATE_SET, coalesce=True):
+    """多候选非流式生成：返回各候选最终文本的列表"""
+    contents = []
+    for contents, _ in generate_variants_stream(kimi_api_key, template_type, param_dict, variants, use_cache,
+                                                template_set, coalesce):
+        pass
+    return contents
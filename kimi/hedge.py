@@ -0,0 +1,378 @@
+"""对冲请求：上游迟迟没有响应时再发一个相同的请求，采用先响应的一路并取消另一路，削减长尾延迟
+
+- 按 (模板, 模型) 记录最近的响应延迟（从请求发出到首段文本、出错或结束），
+  等待超过其 HEDGE_PERCENTILE 分位数（至少 HEDGE_MIN_DELAY 秒）仍无响应时发出对冲请求；
+  样本不足 HEDGE_MIN_SAMPLES 个时不对冲；
+- 先给出响应的一路胜出，另一路立即取消（断开上游连接），落败一路的指标与结果不记录；
+- 全局对冲预算：每个请求存入 HEDGE_MAX_RATE，每次对冲取出 1，长期对冲比例不超过 HEDGE_MAX_RATE；
+- 排队等待限流（产出“⏳”提示）期间重新计时，本地排队不会触发对冲。
+默认关闭，设置 KIMI_HEDGE=1 后启用。
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from kimi.cancel import CancelToken
+from kimi.metrics import HEDGES_TOTAL
+
+# ===================== 1. 对冲配置（可通过环境变量覆盖） =====================
+HEDGE_ENABLED = os.environ.get("KIMI_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("KIMI_HEDGE_PERCENTILE", "0.95"))  # 以最近延迟的该分位数作为等待上限
+HEDGE_MIN_DELAY = float(os.environ.get("KIMI_HEDGE_MIN_DELAY", "1"))  # 至少等待该秒数才对冲
+HEDGE_MAX_RATE = float(os.environ.get("KIMI_HEDGE_MAX_RATE", "0.05"))  # 对冲请求数不超过请求数的比例
+HEDGE_MIN_SAMPLES = int(os.environ.get("KIMI_HEDGE_MIN_SAMPLES", "20"))  # 每个模板/模型至少积累的延迟样本数
+HEDGE_SAMPLES = 200  # 每个模板/模型保留的最近延迟样本数
+HEDGE_BUDGET_MAX = 5.0  # 对冲预算上限（允许短时间内连续对冲的次数）
+
+NOTICE_PREFIX = "⏳"  # 排队与重试提示，不算作上游响应
+_DONE = object()
+
+
+# ===================== 2. 延迟统计与对冲预算 =====================
+class HedgePolicy:
+    """进程级对冲策略：各模板/模型的最近延迟、全局对冲预算与统计"""
+
+    def __init__(self, enabled=HEDGE_ENABLED, percentile=HEDGE_PERCENTILE, min_delay=HEDGE_MIN_DELAY,
+                 max_rate=HEDGE_MAX_RATE, min_samples=HEDGE_MIN_SAMPLES):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._latencies = {}  # (模板, 模型) -> 最近的响应延迟
+        self._counts = {}  # (模板, 模型) -> [请求数, 对冲数, 对冲胜出数, 预算不足未对冲数]
+        self._budget = HEDGE_BUDGET_MAX
+
+    def _count(self, labels, index):
+        # 调用方已持有锁
+        counts = self._counts.setdefault(labels, [0, 0, 0, 0])
+        counts[index] += 1
+
+    def _delay(self, labels):
+        # 调用方已持有锁
+        samples = sorted(self._latencies.get(labels, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, samples[min(len(samples) - 1, int(len(samples) * self.percentile))])
+
+    def delay(self, labels):
+        """开始一次请求：存入对冲预算，返回等待多久仍无响应时对冲；样本不足时返回 None（不对冲）"""
+        with self._lock:
+            self._count(labels, 0)
+            self._budget = min(HEDGE_BUDGET_MAX, self._budget + self.max_rate)
+            return self._delay(labels)
+
+    def try_hedge(self, labels):
+        """从预算中取出一次对冲，预算不足时返回 False"""
+        with self._lock:
+            if self._budget < 1:
+                self._count(labels, 3)
+                HEDGES_TOTAL.inc(labels + ("denied",))
+                return False
+            self._budget -= 1
+            self._count(labels, 1)
+        HEDGES_TOTAL.inc(labels + ("fired",))
+        return True
+
+    def observe(self, labels, latency, hedge_won):
+        """记录一次请求的响应延迟，以及对冲请求是否先于原请求响应"""
+        with self._lock:
+            self._latencies.setdefault(labels, deque(maxlen=HEDGE_SAMPLES)).append(latency)
+            if hedge_won:
+                self._count(labels, 2)
+        if hedge_won:
+            HEDGES_TOTAL.inc(labels + ("won",))
+
+    def stats(self):
+        """对冲次数、胜出次数与各模板/模型当前的对冲等待时间"""
+        with self._lock:
+            items = sorted((labels, list(counts), self._delay(labels)) for labels, counts in self._counts.items())
+            samples = {labels: len(latencies) for labels, latencies in self._latencies.items()}
+        by_template = []
+        for labels, (requests, hedged, won, denied), delay in items:
+            by_template.append({
+                "template": labels[0],
+                "model": labels[1],
+                "requests": requests,
+                "hedged": hedged,
+                "hedge_wins": won,
+                "denied": denied,
+                "samples": samples.get(labels, 0),
+                "hedge_delay": round(delay, 3) if delay is not None else None
+            })
+        requests = sum(row["requests"] for row in by_template)
+        hedged = sum(row["hedged"] for row in by_template)
+        return {
+            "enabled": self.enabled,
+            "requests": requests,
+            "hedged": hedged,
+            "hedge_wins": sum(row["hedge_wins"] for row in by_template),
+            "denied": sum(row["denied"] for row in by_template),
+            "hedge_rate": round(hedged / requests, 3) if requests else 0.0,
+            "by_template": by_template
+        }
+
+
+_policy = HedgePolicy()
+_policy_lock = threading.Lock()
+
+
+def get_hedge_policy():
+    return _policy
+
+
+def set_hedge_policy(**options):
+    """替换进程级对冲策略（调整参数或压测对比开关时使用），参数同 HedgePolicy"""
+    global _policy
+    with _policy_lock:
+        _policy = HedgePolicy(**options)
+    return _policy
+
+
+def hedge_stats():
+    return get_hedge_policy().stats()
+
+
+# ===================== 3. 一次对冲竞争 =====================
+class Attempt:
+    """一路上游请求：独立的取消令牌；只有胜出的一路写入生成指标与保存结果"""
+
+    def __init__(self, cancel, race=None, index=0):
+        self.cancel = cancel
+        self.race = race
+        self.index = index
+
+    def claim(self):
+        return self.race is None or self.race.claim(self.index)
+
+    def wrap_trace(self, trace):
+        return trace if self.race is None else AttemptTrace(trace, self)
+
+    def wrap_save(self, save):
+        if self.race is None:
+            return save
+
+        def attempt_save(content, status="ok"):
+            if self.claim():
+                save(content, status)
+        return attempt_save
+
+
+class AttemptTrace:
+    """一路请求看到的 GenerationTrace：首字、用量、出错与结束视为响应，先响应的一路胜出，
+    落败一路的这些记录被丢弃；重试次数照常累计"""
+
+    def __init__(self, trace, attempt):
+        self._trace = trace
+        self._attempt = attempt
+
+    @property
+    def finished(self):
+        return self._trace.finished
+
+    def retry(self):
+        self._trace.retry()
+
+    def first_token(self):
+        if self._attempt.claim():
+            self._trace.first_token()
+
+    def usage(self, prompt_tokens, completion_tokens):
+        if self._attempt.claim():
+            self._trace.usage(prompt_tokens, completion_tokens)
+
+    def error(self, error_class):
+        if self._attempt.claim():
+            self._trace.error(error_class)
+
+    def finish(self, outcome):
+        if self._attempt.claim():
+            self._trace.finish(outcome)
+
+
+class HedgeRace:
+    """记录胜出的一路：第一个声明的请求胜出，之后只有它能继续声明成功"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.winner = None
+
+    def claim(self, index):
+        with self._lock:
+            if self.winner is None:
+                self.winner = index
+            return self.winner == index
+
+
+def _is_response(item):
+    return not item.startswith(NOTICE_PREFIX)
+
+
+class _HedgeState:
+    """hedged_stream / hedged_stream_async 共用的状态：何时对冲、转发哪一路的产出、何时结束"""
+
+    def __init__(self, policy, labels):
+        self.policy = policy
+        self.labels = labels
+        self.race = HedgeRace()
+        self.attempts = []
+        self.done = 0
+        self.responded = False
+        self.delay = policy.delay(labels)
+        self.waiting_since = time.monotonic()
+
+    def new_attempt(self):
+        attempt = Attempt(CancelToken(), self.race, len(self.attempts))
+        self.attempts.append(attempt)
+        return attempt
+
+    def timeout(self):
+        """距离发出对冲还要等待的秒数；不再对冲时返回 None"""
+        if self.delay is None or self.responded or len(self.attempts) > 1:
+            return None
+        return max(0.0, self.waiting_since + self.delay - time.monotonic())
+
+    def should_hedge(self, cancel):
+        """等待超时：预算允许时返回 True（由调用方发出对冲请求），否则本次请求不再对冲"""
+        if not cancel.cancelled and self.policy.try_hedge(self.labels):
+            return True
+        self.delay = None
+        return False
+
+    def accept(self, attempt, item):
+        """收到一路的产出（item 为 _DONE 表示该路结束），返回 (是否转发给调用方, 是否全部结束)"""
+        if item is _DONE:
+            self.done += 1
+            return False, attempt.index == self.race.winner or self.done == len(self.attempts)
+        # 尚未分出胜负时只转发原请求的排队与重试提示，之后只转发胜出的一路
+        owner = 0 if self.race.winner is None else self.race.winner
+        if attempt.index != owner:
+            return False, False
+        if not _is_response(item):
+            if not self.responded and len(self.attempts) == 1:
+                self.waiting_since = time.monotonic()  # 本地排队或重试等待，重新计时
+        elif not self.responded:
+            self.responded = True
+            self.policy.observe(self.labels, time.monotonic() - self.waiting_since, attempt.index > 0)
+            self.cancel_all(keep=attempt.index)
+        return True, False
+
+    def cancel_all(self, keep=None):
+        for attempt in list(self.attempts):
+            if attempt.index != keep:
+                attempt.cancel.cancel()
+
+
+def hedged_stream(start, labels, cancel):
+    """对冲地执行 start(attempt)（返回逐块产出累计文本的生成器），产出胜出一路的内容
+    labels 为 (模板, 模型)；cancel 被取消或调用方提前关闭时取消全部请求"""
+    policy = get_hedge_policy()
+    if not policy.enabled:
+        yield from start(Attempt(cancel))
+        return
+
+    state = _HedgeState(policy, labels)
+    updates = queue.Queue()
+
+    def pump(attempt, stream):
+        try:
+            for item in stream:
+                # 落败的一路不再读取，关闭生成器即断开上游
+                if _is_response(item) and not attempt.claim():
+                    break
+                updates.put((attempt, item))
+        finally:
+            stream.close()
+            updates.put((attempt, _DONE))
+
+    def launch():
+        attempt = state.new_attempt()
+        threading.Thread(target=pump, args=(attempt, start(attempt)), daemon=True).start()
+
+    launch()
+    unregister = cancel.on_cancel(state.cancel_all)
+    finished = False
+    try:
+        while True:
+            try:
+                attempt, item = updates.get(timeout=state.timeout())
+            except queue.Empty:
+                if state.should_hedge(cancel):
+                    launch()
+                continue
+            forward, finished = state.accept(attempt, item)
+            if finished:
+                return
+            if forward:
+                yield item
+    finally:
+        unregister()
+        if not finished:
+            state.cancel_all()
+
+
+async def hedged_stream_async(start, labels, cancel):
+    """hedged_stream 的异步版本：start(attempt) 返回异步生成器，各路在同一事件循环中并发，
+    落败的一路除取消令牌外同时取消其任务（等待上游响应期间也能立即断开）"""
+    policy = get_hedge_policy()
+    if not policy.enabled:
+        partials = start(Attempt(cancel))
+        try:
+            async for partial in partials:
+                yield partial
+        finally:
+            await partials.aclose()
+        return
+
+    state = _HedgeState(policy, labels)
+    updates = asyncio.Queue()
+    tasks = {}
+
+    async def pump(attempt, stream):
+        try:
+            async for item in stream:
+                if _is_response(item) and not attempt.claim():
+                    break
+                updates.put_nowait((attempt, item))
+        finally:
+            try:
+                await stream.aclose()
+            finally:
+                updates.put_nowait((attempt, _DONE))
+
+    def launch():
+        attempt = state.new_attempt()
+        tasks[attempt.index] = asyncio.ensure_future(pump(attempt, start(attempt)))
+
+    def cancel_tasks(keep=None):
+        for index, task in tasks.items():
+            if index != keep:
+                task.cancel()
+
+    launch()
+    unregister = cancel.on_cancel(state.cancel_all)
+    finished = False
+    try:
+        while True:
+            try:
+                attempt, item = await asyncio.wait_for(updates.get(), state.timeout())
+            except asyncio.TimeoutError:
+                if state.should_hedge(cancel):
+                    launch()
+                continue
+            forward, finished = state.accept(attempt, item)
+            if finished:
+                return
+            if forward:
+                if state.responded:
+                    cancel_tasks(keep=state.race.winner)
+                yield item
+    finally:
+        unregister()
+        if not finished:
+            state.cancel_all()
+            cancel_tasks()
@@ -0,0 +1,251 @@
+"""生成历史：SQLite 保存每次生成的模板、参数、模型、用量与耗时，正文压缩存储，FTS5 全文检索
+
+- 正文以 zlib 压缩后存入 generations.output，列表只读取预览，点开某条时才解压全文；
+- 全文索引为无内容（content=''）的 FTS5 表，不重复保存正文；
+  中文没有空格分词，入库与查询时都把连续汉字切成重叠的二元组，2 个字及以上的关键词即可命中；
+- 分页按 id 倒序的游标翻页（before_id），不使用 OFFSET，数十万条记录时翻页与检索仍是索引查询；
+- status 区分完整结果（ok，按字数预算在句末提前结束的为 trimmed）与中途停止/出错时保存的部分内容
+  （cancelled / error）。
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from kimi import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+# ===================== 1. 历史记录配置（可通过环境变量覆盖） =====================
+HISTORY_DB_PATH = os.environ.get("KIMI_HISTORY_PATH", os.path.join(DATA_DIR, "history.db"))
+HISTORY_ENABLED = os.environ.get("KIMI_HISTORY", "1") != "0"
+HISTORY_PAGE_SIZE = 10
+PREVIEW_CHARS = 80
+STATUS_LABELS = {"cancelled": " · ⏹ 已停止（部分内容）", "error": " · ❌ 出错中断（部分内容）",
+                 "trimmed": " · ✂️ 按字数提前结束"}
+
+_CJK_RUN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+
+# ===================== 2. 中文分词（二元组） =====================
+def segment(text):
+    """把连续汉字切成空格分隔的重叠二元组，其余文本保持原样（交给 FTS5 默认分词器）"""
+    def bigrams(match):
+        run = match.group(0)
+        if len(run) == 1:
+            return f" {run} "
+        return " " + " ".join(run[i:i + 2] for i in range(len(run) - 1)) + " "
+
+    return _CJK_RUN_RE.sub(bigrams, text)
+
+
+def build_match_query(query):
+    """把用户输入的关键词转换为 FTS5 查询：空格分隔的多个关键词同时命中，每个关键词按短语匹配"""
+    phrases = []
+    for term in query.split():
+        tokens = segment(term).split()
+        if not tokens:
+            continue
+        phrase = " ".join(tokens).replace('"', '""')
+        # 单个汉字或较短的英文词按前缀匹配
+        phrases.append(f'"{phrase}"*' if len(tokens) == 1 else f'"{phrase}"')
+    return " AND ".join(phrases)
+
+
+# ===================== 3. 历史记录存储 =====================
+class HistoryStore:
+    """线程安全的历史记录表 + 全文索引"""
+
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS generations (
+                id INTEGER PRIMARY KEY,
+                created REAL NOT NULL,
+                template TEXT NOT NULL,
+                template_set TEXT NOT NULL,
+                params TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                output BLOB NOT NULL,
+                output_chars INTEGER NOT NULL,
+                preview TEXT NOT NULL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                latency REAL,
+                ttft REAL,
+                status TEXT NOT NULL DEFAULT 'ok'
+            )
+        """)
+        # 旧版本创建的数据库没有 status 列
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(generations)")]
+        if "status" not in columns:
+            self._db.execute("ALTER TABLE generations ADD COLUMN status TEXT NOT NULL DEFAULT 'ok'")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_generations_template ON generations(template, id)")
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(prompt, output, content='')")
+        self._db.commit()
+
+    def add(self, template_type, template_set, param_dict, model, prompt, output, prompt_tokens=None,
+            completion_tokens=None, latency=None, ttft=None, status="ok"):
+        """写入一条生成记录，返回记录 id"""
+        preview = " ".join(output.split())[:PREVIEW_CHARS]
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO generations (created, template, template_set, params, model, prompt, output, "
+                "output_chars, preview, prompt_tokens, completion_tokens, latency, ttft, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), template_type, template_set, json.dumps(param_dict, ensure_ascii=False), model,
+                 prompt, zlib.compress(output.encode("utf-8")), len(output), preview, prompt_tokens,
+                 completion_tokens, latency, ttft, status)
+            )
+            entry_id = cursor.lastrowid
+            self._db.execute("INSERT INTO generations_fts (rowid, prompt, output) VALUES (?, ?, ?)",
+                             (entry_id, segment(prompt), segment(output)))
+            self._db.commit()
+            return entry_id
+
+    def search(self, query="", template_type=None, before_id=None, limit=HISTORY_PAGE_SIZE):
+        """按关键词与模板筛选，返回 id 小于 before_id 的最新 limit 条摘要（不含正文）"""
+        match = build_match_query(query or "")
+        conditions, args = [], []
+        if before_id:
+            conditions.append("g.id < ?")
+            args.append(before_id)
+        if match:
+            # 游标下推到全文索引；不按模板筛选时索引内直接取最新 limit 条，不必取出全部匹配记录
+            subquery = "SELECT rowid FROM generations_fts WHERE generations_fts MATCH ? AND rowid < ?"
+            args.extend([match, before_id or 2 ** 63 - 1])
+            if not template_type:
+                subquery += " ORDER BY rowid DESC LIMIT ?"
+                args.append(limit)
+            conditions.append(f"g.id IN ({subquery})")
+        if template_type:
+            conditions.append("g.template = ?")
+            args.append(template_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT g.id, g.created, g.template, g.model, g.preview, g.output_chars, g.prompt_tokens, "
+                f"g.completion_tokens, g.latency, g.status FROM generations g {where} ORDER BY g.id DESC LIMIT ?",
+                args + [limit]
+            ).fetchall()
+        return [{
+            "id": row[0],
+            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row[1])),
+            "template": row[2],
+            "model": row[3],
+            "preview": row[4],
+            "output_chars": row[5],
+            "prompt_tokens": row[6],
+            "completion_tokens": row[7],
+            "latency": row[8],
+            "status": row[9]
+        } for row in rows]
+
+    def get(self, entry_id):
+        """读取一条完整记录（解压正文），不存在时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, created, template, template_set, params, model, prompt, output, prompt_tokens, "
+                "completion_tokens, latency, ttft, status FROM generations WHERE id = ?", (entry_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row[1])),
+            "template": row[2],
+            "template_set": row[3],
+            "params": json.loads(row[4]),
+            "model": row[5],
+            "prompt": row[6],
+            "output": zlib.decompress(row[7]).decode("utf-8"),
+            "prompt_tokens": row[8],
+            "completion_tokens": row[9],
+            "latency": row[10],
+            "ttft": row[11],
+            "status": row[12]
+        }
+
+    def delete(self, entry_id):
+        """删除一条记录及其索引（无内容索引须用原文执行 delete 命令）"""
+        with self._lock:
+            row = self._db.execute("SELECT prompt, output FROM generations WHERE id = ?", (entry_id,)).fetchone()
+            if row is None:
+                return False
+            output = zlib.decompress(row[1]).decode("utf-8")
+            self._db.execute(
+                "INSERT INTO generations_fts (generations_fts, rowid, prompt, output) VALUES ('delete', ?, ?, ?)",
+                (entry_id, segment(row[0]), segment(output))
+            )
+            self._db.execute("DELETE FROM generations WHERE id = ?", (entry_id,))
+            self._db.commit()
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("INSERT INTO generations_fts (generations_fts) VALUES ('delete-all')")
+            self._db.execute("DELETE FROM generations")
+            self._db.commit()
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """进程级共享的历史记录（首次使用时才创建数据库文件）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HistoryStore()
+    return _store
+
+
+# ===================== 4. 引擎与界面使用的函数 =====================
+def record_generation(template_type, template_set, param_dict, model, prompt, output, trace, status="ok"):
+    """引擎在上游生成结束后调用（status 见模块说明）；历史写入失败不影响生成结果"""
+    if not HISTORY_ENABLED:
+        return None
+    try:
+        return get_history_store().add(template_type, template_set, param_dict, model, prompt, output,
+                                       trace.prompt_tokens, trace.completion_tokens, trace.elapsed(), trace.ttft,
+                                       status)
+    except sqlite3.Error as e:
+        logger.warning("历史记录写入失败：%s", e)
+        return None
+
+
+def search_history(query="", template_type=None, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """历史记录摘要列表（按时间倒序，游标翻页）"""
+    return get_history_store().search(query, template_type, before_id, limit)
+
+
+def get_history_entry(entry_id):
+    """单条历史记录全文"""
+    return get_history_store().get(entry_id)
+
+
+def describe_entry(entry):
+    """列表中一条记录的说明文字"""
+    tokens = ""
+    if entry.get("completion_tokens"):
+        tokens = f" · {(entry.get('prompt_tokens') or 0) + entry['completion_tokens']} tokens"
+    latency = f" · {entry['latency']:.1f}s" if entry.get("latency") else ""
+    status = STATUS_LABELS.get(entry.get("status"), "")
+    return (f"#{entry['id']} {entry['created']} · {entry['template']} · {entry['model']} · "
+            f"{entry['output_chars']} 字{tokens}{latency}{status}")
@@ -0,0 +1,332 @@
+"""进行中请求合并（single-flight）：相同模型、提示词与采样参数的并发请求只调用一次上游
+
+第一个请求成为领头请求，照常调用上游并把每次产出的累计文本发布到 Flight；
+之后到达的相同请求挂到该 Flight 上，等待并接收同样的流式结果（线程与事件循环中均可等待）。
+领头请求被中途取消时，等待者改为重新加入或自行发起请求，不会一直挂起。
+KIMI_SHARED_STATE=1 时改用 SharedInflightRegistry，同一主机上其他进程中的相同请求也合并（见 kimi.shared）。
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from kimi.shared import SHARED_STATE_ENABLED, get_shared_state, process_alive
+
+logger = logging.getLogger(__name__)
+
+FOLLOW_POLL_SECONDS = 0.5  # 等待者检查自身是否已取消的间隔
+SHARED_PUBLISH_INTERVAL = 0.1  # 领头进程把最新文本写入共享状态库的最小间隔（秒）
+SHARED_HEARTBEAT_INTERVAL = 5  # 领头进程刷新 updated（存活心跳）的最小间隔（秒），须远小于 SHARED_FLIGHT_TTL
+SHARED_POLL_SECONDS = 0.05  # 其他进程中的等待者读取共享状态库的间隔（秒）
+SHARED_FLIGHT_TTL = float(os.environ.get("KIMI_SHARED_FLIGHT_TTL", "600"))  # 领头进程超过该秒数没有进展视为失效
+SHARED_DONE_KEEP = 30  # 已结束的记录保留的秒数（供仍在轮询的等待者读取最终结果）
+
+
+def is_error(partial):
+    """以 ❌ 开头的产出为错误提示：只属于领头请求本身，不转发给等待者"""
+    return partial.startswith("❌")
+
+
+class Flight:
+    """一次进行中的上游调用：只保存最新的累计文本，等待者按版本号获取更新"""
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+        self.version = 0
+        self.latest = ""
+        self.done = False
+        self.completed = False  # 领头请求正常结束（False 表示被中途取消或以错误结束）
+        self._cond = threading.Condition()
+        self._async_waiters = []  # [(事件循环, asyncio.Event)]
+
+    # ---------- 领头请求 ----------
+    def publish(self, partial):
+        with self._cond:
+            self.latest = partial
+            self.version += 1
+            self._wake()
+
+    def finish(self, completed):
+        self.registry.release(self)
+        with self._cond:
+            self.done = True
+            self.completed = completed
+            self._wake()
+
+    def _wake(self):
+        # 调用方已持有锁
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 等待者所在的事件循环已关闭
+
+    def lead(self, partials, cancel=None):
+        """转发领头请求的产出并发布给等待者；领头请求被取消或以错误结束时按未完成处理，
+        等待者会用自己的密钥重新发起（余额不足、密钥失效等错误不应传给其他请求）"""
+        completed = False
+        partial = ""
+        try:
+            for partial in partials:
+                self.publish(partial)
+                yield partial
+            completed = not (cancel and cancel.cancelled) and not is_error(partial)
+        finally:
+            partials.close()
+            self.finish(completed)
+
+    async def lead_async(self, partials, cancel=None):
+        completed = False
+        partial = ""
+        try:
+            async for partial in partials:
+                self.publish(partial)
+                yield partial
+            completed = not (cancel and cancel.cancelled) and not is_error(partial)
+        finally:
+            await partials.aclose()
+            self.finish(completed)
+
+    # ---------- 等待者 ----------
+    def _snapshot(self, seen):
+        """返回 (版本号, 最新文本, 是否结束)；没有新内容且未结束时返回 None"""
+        if self.version == seen and not self.done:
+            return None
+        return self.version, self.latest, self.done
+
+    def follow(self, cancel=None):
+        """同步等待：产出领头请求的最新累计文本，返回领头请求是否正常结束
+        cancel 被取消时停止等待并返回 False"""
+        seen = 0
+        while True:
+            with self._cond:
+                snapshot = self._snapshot(seen)
+                while snapshot is None:
+                    if cancel is not None and cancel.cancelled:
+                        return False
+                    self._cond.wait(FOLLOW_POLL_SECONDS if cancel is not None else None)
+                    snapshot = self._snapshot(seen)
+            version, latest, done = snapshot
+            if version != seen:
+                seen = version
+                if not is_error(latest):
+                    yield latest
+            if done:
+                return self.completed
+
+    async def follow_async(self):
+        """异步等待：与 follow 相同，等待时不阻塞事件循环；结束后读取 completed 判断是否正常结束"""
+        loop = asyncio.get_running_loop()
+        seen = 0
+        while True:
+            event = asyncio.Event()
+            with self._cond:
+                snapshot = self._snapshot(seen)
+                if snapshot is None:
+                    self._async_waiters.append((loop, event))
+            if snapshot is None:
+                await event.wait()
+                continue
+            version, latest, done = snapshot
+            if version != seen:
+                seen = version
+                if not is_error(latest):
+                    yield latest
+            if done:
+                return
+
+
+class InflightRegistry:
+    """进程级进行中请求表：请求键 -> Flight"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.led = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        """加入相同请求的 Flight，返回 (flight, 是否为领头请求)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight(self, key)
+            self.led += 1
+            return flight, True
+
+    def release(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stats(self):
+        with self._lock:
+            return {"inflight": len(self._flights), "led": self.led, "coalesced": self.coalesced}
+
+
+# ===================== 跨进程合并 =====================
+def _shared_write(sql, args):
+    """写入共享状态库；失败时只影响其他进程中的等待者（它们会在领头请求失效后自行发起）"""
+    try:
+        get_shared_state().execute(sql, args)
+    except sqlite3.Error as e:
+        logger.warning("共享状态写入失败：%s", e)
+
+
+def _leader_alive(pid, updated, now):
+    return process_alive(pid) and now - updated <= SHARED_FLIGHT_TTL
+
+
+class SharedFlight(Flight):
+    """本进程领头的跨进程 Flight：照常通知本进程的等待者，同时把最新文本写入共享状态库
+    存活心跳（updated）总是定期刷新，其他进程据此判断领头请求仍在进行；
+    正文只在有其他进程等待时（followers > 0）写入"""
+
+    def __init__(self, registry, key, owner):
+        super().__init__(registry, key)
+        self.owner = owner
+        self._written = 0.0
+        self._beat = time.time()  # _claim 登记时已写入 updated
+
+    def publish(self, partial):
+        super().publish(partial)
+        now = time.time()
+        if now - self._beat >= SHARED_HEARTBEAT_INTERVAL:
+            self._beat = now
+            _shared_write("UPDATE flights SET updated = ? WHERE key = ? AND owner = ?", (now, self.key, self.owner))
+        if now - self._written >= SHARED_PUBLISH_INTERVAL:
+            self._written = now
+            _shared_write("UPDATE flights SET version = ?, latest = ?, updated = ? "
+                          "WHERE key = ? AND owner = ? AND followers > 0",
+                          (self.version, partial, now, self.key, self.owner))
+
+    def finish(self, completed):
+        try:
+            _shared_write("UPDATE flights SET version = ?, latest = ?, done = 1, completed = ?, updated = ? "
+                          "WHERE key = ? AND owner = ?",
+                          (self.version, self.latest, int(completed), time.time(), self.key, self.owner))
+        finally:
+            super().finish(completed)
+
+
+class RemoteFlight:
+    """其他进程领头的相同请求：轮询共享状态库，接口与 Flight 的等待者部分相同"""
+
+    def __init__(self, key):
+        self.key = key
+        self.completed = False
+
+    def _attach(self, delta):
+        _shared_write("UPDATE flights SET followers = MAX(0, followers + ?) WHERE key = ?", (delta, self.key))
+
+    def _poll(self):
+        """返回 (版本号, 最新文本, 是否结束)；领头进程已退出或长时间没有进展时返回 None"""
+        row = get_shared_state().query(
+            "SELECT version, latest, done, completed, pid, updated FROM flights WHERE key = ?", (self.key,))
+        if row is None or (not row[2] and not _leader_alive(row[4], row[5], time.time())):
+            return None
+        self.completed = bool(row[3])
+        return row[0], row[1], bool(row[2])
+
+    def follow(self, cancel=None):
+        """同步等待：与 Flight.follow 相同；领头进程失效或 cancel 被取消时返回 False"""
+        self._attach(1)
+        try:
+            seen = 0
+            while True:
+                snapshot = self._poll()
+                if snapshot is None:
+                    return False
+                version, latest, done = snapshot
+                if version != seen:
+                    seen = version
+                    if not is_error(latest):
+                        yield latest
+                if done:
+                    return self.completed
+                if cancel is not None and cancel.cancelled:
+                    return False
+                time.sleep(SHARED_POLL_SECONDS)
+        finally:
+            self._attach(-1)
+
+    async def follow_async(self):
+        """异步等待：与 Flight.follow_async 相同；领头进程失效时 completed 为 False"""
+        self._attach(1)
+        try:
+            seen = 0
+            while True:
+                snapshot = self._poll()
+                if snapshot is None:
+                    self.completed = False
+                    return
+                version, latest, done = snapshot
+                if version != seen:
+                    seen = version
+                    if not is_error(latest):
+                        yield latest
+                if done:
+                    return
+                await asyncio.sleep(SHARED_POLL_SECONDS)
+        finally:
+            self._attach(-1)
+
+
+class SharedInflightRegistry(InflightRegistry):
+    """跨进程进行中请求表：本进程内的相同请求仍挂到同一个 Flight；
+    本进程还没有时到共享状态库中登记，其他进程已在领头则返回 RemoteFlight"""
+
+    def __init__(self):
+        super().__init__()
+        self.remote = 0  # 合并到其他进程领头请求的次数
+
+    def join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+            if not self._claim(key, owner):
+                self.coalesced += 1
+                self.remote += 1
+                return RemoteFlight(key), False
+            flight = self._flights[key] = SharedFlight(self, key, owner)
+            self.led += 1
+            return flight, True
+
+    def _claim(self, key, owner):
+        """在共享状态库中登记为该请求的领头者；其他进程正在领头时返回 False"""
+        now = time.time()
+        with get_shared_state().transaction() as db:
+            db.execute("DELETE FROM flights WHERE done = 1 AND updated < ?", (now - SHARED_DONE_KEEP,))
+            row = db.execute("SELECT pid, done, updated FROM flights WHERE key = ?", (key,)).fetchone()
+            if row is not None and not row[1] and _leader_alive(row[0], row[2], now):
+                return False
+            db.execute("INSERT OR REPLACE INTO flights (key, owner, pid, updated) VALUES (?, ?, ?, ?)",
+                       (key, owner, os.getpid(), now))
+        return True
+
+    def stats(self):
+        return dict(super().stats(), remote=self.remote)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_inflight_registry():
+    """进程内共享的进行中请求表；KIMI_SHARED_STATE=1 时为跨进程的 SharedInflightRegistry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SharedInflightRegistry() if SHARED_STATE_ENABLED else InflightRegistry()
+        return _registry
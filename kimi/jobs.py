@@ -0,0 +1,325 @@
+"""后台生成任务队列：生成在进程级工作线程池中运行，页面重跑、刷新或断线重连后仍可取回结果
+
+- 任务表保存在本地 SQLite（jobs.db）：模板、参数、优先级、状态与当前已生成的内容；
+  界面只持有任务 id（同时写入页面地址的 ?job= 参数），重跑或刷新页面后按 id 继续跟随进度或取回结果；
+- 工作线程按 优先级从高到低、同优先级先提交先执行 的顺序领取任务，
+  同一用户（密钥指纹，未填密钥时为页面会话）同时运行的任务不超过 JOB_USER_CONCURRENCY 个，超出的继续排队；
+- 运行中的内容保存在内存中供界面实时跟随，每隔 JOB_PROGRESS_INTERVAL 秒写回任务表；
+- 只有明确取消（「⏹ 停止生成」）才会中止任务，页面重跑、刷新与关闭都不影响任务继续运行；
+- 密钥只保存在内存中，不写入任务表；进程重启后未完成的任务标记为已中断（已生成的部分保留）；
+- 多个进程共用同一个 DATA_DIR 时，每个进程只领取、只在启动时回收自己（或已退出的进程）提交的任务。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from kimi import DATA_DIR
+from kimi.backend import generate_stream
+from kimi.cancel import HEARTBEAT_SECONDS, CancelToken
+from kimi.client import key_fingerprint
+from kimi.engine import DEFAULT_TEMPLATE_SET
+from kimi.length import is_trimmed
+from kimi.shared import SHARED_BUSY_TIMEOUT, process_alive
+
+# ===================== 1. 任务队列配置（可通过环境变量覆盖） =====================
+JOB_DB_PATH = os.environ.get("KIMI_JOB_PATH", os.path.join(DATA_DIR, "jobs.db"))
+JOB_WORKERS = int(os.environ.get("KIMI_JOB_WORKERS", "8"))  # 工作线程数（同时进行的生成数）
+JOB_USER_CONCURRENCY = int(os.environ.get("KIMI_JOB_USER_CONCURRENCY", "2"))  # 每个用户同时运行的任务数
+JOB_PROGRESS_INTERVAL = 1.0  # 运行中内容写回任务表的最小间隔（秒）
+JOB_RETENTION = float(os.environ.get("KIMI_JOB_RETENTION", str(7 * 24 * 3600)))  # 已结束任务的保留时间（秒）
+JOB_PRIORITY_INTERACTIVE = 10  # 界面上点击生成的任务
+JOB_PRIORITY_BACKGROUND = 0  # 脚本等后台提交的任务
+
+FINISHED_STATUSES = ("done", "trimmed", "error", "cancelled")
+STATUS_LABELS = {
+    "queued": "⏳ 排队中",
+    "running": "✍️ 生成中",
+    "done": "✅ 已完成",
+    "trimmed": "✅ 已完成（超出要求字数，已在句末提前结束）",
+    "error": "❌ 出错",
+    "cancelled": "⏹ 已停止"
+}
+INTERRUPTED_TEXT = "❌ 生成服务已重启，该任务未完成，请重新生成"
+
+
+def job_owner(kimi_api_key, session_id=""):
+    """任务所属用户：填写了密钥时为密钥指纹（同一密钥的多个页面共享并发上限），否则为页面会话"""
+    kimi_api_key = str(kimi_api_key or "").strip()
+    return f"key:{key_fingerprint(kimi_api_key)}" if kimi_api_key else f"session:{session_id}"
+
+
+def new_job_session():
+    """新页面会话的 id（job_owner 的 session_id），各界面统一用它生成"""
+    return uuid.uuid4().hex
+
+
+# ===================== 2. 任务队列 =====================
+_instances = set()  # 本进程中仍在运行的任务队列实例
+
+
+class JobQueue:
+    """SQLite 任务表 + 工作线程池；所有方法线程安全，Streamlit 各会话共享同一实例"""
+
+    def __init__(self, db_path=JOB_DB_PATH, workers=JOB_WORKERS, user_concurrency=JOB_USER_CONCURRENCY,
+                 generate=generate_stream):
+        self.user_concurrency = max(1, user_concurrency)
+        self._generate = generate
+        self._cond = threading.Condition()
+        self._keys = {}  # 任务 id -> 密钥（只在内存中）
+        self._live = {}  # 运行中任务 id -> {"content", "notice", "version"}
+        self._cancels = {}  # 运行中任务 id -> CancelToken
+        self._running = {}  # 用户 -> 运行中任务数
+        self.instance = f"{os.getpid()}-{uuid.uuid4().hex}"  # 任务表中标记由哪个实例提交（也只由它领取）
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=SHARED_BUSY_TIMEOUT, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                template TEXT NOT NULL,
+                template_set TEXT NOT NULL,
+                params TEXT NOT NULL,
+                use_cache INTEGER NOT NULL,
+                content TEXT NOT NULL DEFAULT '',
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                instance TEXT NOT NULL DEFAULT '',
+                pid INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # 旧版本创建的数据库没有 instance / pid 列
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        if "instance" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN instance TEXT NOT NULL DEFAULT ''")
+            self._db.execute("ALTER TABLE jobs ADD COLUMN pid INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority DESC, created)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, created)")
+        self._recover_orphans()
+        self._db.execute("DELETE FROM jobs WHERE finished < ?", (time.time() - JOB_RETENTION,))
+        self._db.commit()
+        _instances.add(self.instance)
+
+        for index in range(max(1, workers)):
+            threading.Thread(target=self._work, name=f"kimi-job-{index}", daemon=True).start()
+
+    def _recover_orphans(self):
+        """提交它们的进程已退出的未完成任务：密钥已随进程丢失，无法继续，标记为已中断
+        其他仍在运行的进程（或本进程中的其他实例）的任务不受影响"""
+        rows = self._db.execute("SELECT id, instance, pid FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        orphans = [(job_id,) for job_id, instance, pid in rows if instance not in _instances
+                   and (not pid or pid == os.getpid() or not process_alive(pid))]
+        self._db.executemany(
+            "UPDATE jobs SET status = 'error', finished = ?, "
+            "content = CASE WHEN content = '' THEN ? ELSE content END WHERE id = ? AND status IN ('queued', 'running')",
+            [(time.time(), INTERRUPTED_TEXT) + orphan for orphan in orphans]
+        )
+
+    # ---------- 提交与查询 ----------
+    def submit(self, kimi_api_key, template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET, use_cache=True,
+               owner="", priority=JOB_PRIORITY_INTERACTIVE):
+        """提交一个生成任务，返回任务 id"""
+        job_id = uuid.uuid4().hex
+        with self._cond:
+            self._db.execute(
+                "INSERT INTO jobs (id, owner, priority, status, template, template_set, params, use_cache, created, "
+                "instance, pid) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, owner or job_owner(kimi_api_key), priority, template_type, template_set,
+                 json.dumps(param_dict, ensure_ascii=False), int(bool(use_cache)), time.time(), self.instance,
+                 os.getpid())
+            )
+            self._db.commit()
+            self._keys[job_id] = kimi_api_key
+            self._cond.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        """任务快照（运行中的内容取内存中的最新值），不存在时返回 None；
+        排队中的任务附带 position（本实例中排在前面的任务数，与 _claim 的领取顺序一致）"""
+        with self._cond:
+            row = self._db.execute(
+                "SELECT id, owner, priority, status, template, template_set, params, content, created, started, "
+                "finished FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            job = {
+                "id": row[0], "owner": row[1], "priority": row[2], "status": row[3], "template": row[4],
+                "template_set": row[5], "params": json.loads(row[6]), "content": row[7], "created": row[8],
+                "started": row[9], "finished": row[10], "notice": "", "version": 0, "position": 0
+            }
+            live = self._live.get(job_id)
+            if live is not None:
+                job.update(live)
+            if job["status"] == "queued":
+                job["position"] = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND instance = ? AND "
+                    "(priority > ? OR (priority = ? AND created < ?))", (self.instance, row[2], row[2], row[8])
+                ).fetchone()[0]
+        return job
+
+    def watch(self, job_id, interval=HEARTBEAT_SECONDS):
+        """跟随任务进度：内容或状态变化时产出任务快照，超过 interval 秒没有变化时产出 None，任务结束后返回
+        （调用方随时可以停止跟随，任务不受影响）"""
+        last, last_yield = None, time.monotonic()
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            state = (job["status"], job["version"], job["position"], len(job["content"]))
+            now = time.monotonic()
+            if state != last:
+                last, last_yield = state, now
+                yield job
+            elif now - last_yield >= interval:
+                last_yield = now
+                yield None
+            if job["status"] in FINISHED_STATUSES:
+                return
+            with self._cond:
+                live = self._live.get(job_id)
+                if live is None or live["version"] == job["version"]:
+                    self._cond.wait(interval)
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接结束，运行中的立即断开上游（已生成的部分保留）"""
+        with self._cond:
+            cancel = self._cancels.get(job_id)
+            if cancel is None:
+                self._db.execute("UPDATE jobs SET status = 'cancelled', finished = ? "
+                                 "WHERE id = ? AND status = 'queued'", (time.time(), job_id))
+                self._db.commit()
+                self._keys.pop(job_id, None)
+                self._cond.notify_all()
+        if cancel is not None:
+            cancel.cancel()
+
+    def stats(self):
+        with self._cond:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            return {status: counts.get(status, 0) for status in STATUS_LABELS}
+
+    # ---------- 工作线程 ----------
+    def _claim(self):
+        """领取下一个可运行的任务（调用方需持有锁）：优先级高的先领，跳过已达并发上限的用户
+        只领取本实例提交的任务（密钥只在提交它的进程内存中）"""
+        rows = self._db.execute(
+            "SELECT id, owner, template, template_set, params, use_cache FROM jobs "
+            "WHERE status = 'queued' AND instance = ? ORDER BY priority DESC, created LIMIT 200", (self.instance,)
+        ).fetchall()
+        for job_id, owner, template_type, template_set, params, use_cache in rows:
+            if self._running.get(owner, 0) >= self.user_concurrency:
+                continue
+            claimed = self._db.execute("UPDATE jobs SET status = 'running', started = ? "
+                                       "WHERE id = ? AND status = 'queued'", (time.time(), job_id)).rowcount
+            self._db.commit()
+            if not claimed:
+                continue
+            self._running[owner] = self._running.get(owner, 0) + 1
+            self._live[job_id] = {"content": "", "notice": "", "version": 0}
+            self._cancels[job_id] = CancelToken()
+            return job_id, owner, template_type, template_set, json.loads(params), bool(use_cache)
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                claimed = self._claim()
+                while claimed is None:
+                    self._cond.wait()
+                    claimed = self._claim()
+            self._run(*claimed)
+
+    def _run(self, job_id, owner, template_type, template_set, param_dict, use_cache):
+        with self._cond:
+            kimi_api_key = self._keys.pop(job_id, "")
+            cancel = self._cancels[job_id]
+            live = self._live[job_id]
+        content, status, last_write = "", "done", time.monotonic()
+        try:
+            for partial in self._generate(kimi_api_key, template_type, param_dict, use_cache, template_set,
+                                          coalesce=use_cache, cancel=cancel):
+                with self._cond:
+                    if partial.startswith("⏳"):
+                        live["notice"] = partial
+                    else:
+                        content = partial
+                        live["content"], live["notice"] = partial, ""
+                    live["version"] += 1
+                    self._cond.notify_all()
+                    if time.monotonic() - last_write >= JOB_PROGRESS_INTERVAL:
+                        self._db.execute("UPDATE jobs SET content = ? WHERE id = ?", (content, job_id))
+                        self._db.commit()
+                        last_write = time.monotonic()
+            if cancel.cancelled:
+                status = "cancelled"
+            elif content.startswith("❌"):
+                status = "error"
+            elif is_trimmed(content):
+                status = "trimmed"
+        except Exception as e:
+            status, content = "error", content or f"❌ 生成任务异常：{str(e)}"
+        finally:
+            with self._cond:
+                self._db.execute("UPDATE jobs SET status = ?, content = ?, finished = ? WHERE id = ?",
+                                 (status, content, time.time(), job_id))
+                self._db.commit()
+                self._running[owner] -= 1
+                if not self._running[owner]:
+                    del self._running[owner]
+                self._live.pop(job_id, None)
+                self._cancels.pop(job_id, None)
+                self._cond.notify_all()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """进程级共享的任务队列（首次使用时才创建数据库文件并启动工作线程）"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
+
+
+# ===================== 3. 界面使用的函数 =====================
+def submit_job(kimi_api_key, template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET, use_cache=True,
+               owner="", priority=JOB_PRIORITY_INTERACTIVE):
+    return get_job_queue().submit(kimi_api_key, template_type, param_dict, template_set, use_cache, owner, priority)
+
+
+def get_job(job_id):
+    return get_job_queue().get(job_id) if job_id else None
+
+
+def watch_job(job_id, interval=HEARTBEAT_SECONDS):
+    return get_job_queue().watch(job_id, interval)
+
+
+def cancel_job(job_id):
+    if job_id:
+        get_job_queue().cancel(job_id)
+
+
+def describe_job(job):
+    """界面展示用的任务状态说明"""
+    label = STATUS_LABELS.get(job["status"], job["status"])
+    if job["status"] == "queued":
+        ahead = f"，前面还有 {job['position']} 个任务" if job["position"] else ""
+        return f"{label}{ahead}（任务 {job['id'][:8]}，刷新页面或重新连接后仍可取回结果）"
+    if job["status"] == "running":
+        return job["notice"] or f"{label}（任务 {job['id'][:8]}，刷新页面或重新连接后仍可取回结果）"
+    return f"{label}（任务 {job['id'][:8]}）"
@@ -0,0 +1,188 @@
+"""服务端共享密钥池：多个 Kimi 密钥轮流承接请求，总吞吐随密钥数量增长
+
+- 配置 KIMI_KEY_POOL（逗号或空白分隔的多个 sk- 密钥）或 KIMI_KEY_POOL_FILE（每行一个密钥）后启用；
+  用户未填写密钥时由密钥池代为选择，用户填写了自己的密钥时仍只使用该密钥；
+- 选择密钥：跳过冷却中的密钥，在其余密钥中选预计排队时间最短的（各密钥的令牌桶见 kimi.limiter），
+  相同时选进行中请求最少的，因此请求均匀分摊到所有密钥上；
+- 统计每个密钥最近一分钟的请求数、令牌数，以及最近的限流与余额不足失败次数；
+- 密钥被限流时冷却 Retry-After（至少 KEY_RATE_LIMIT_COOLDOWN 秒），余额不足或密钥失效时冷却
+  KEY_EXHAUSTED_COOLDOWN 秒，冷却期间不再分配请求，冷却结束后自动恢复。
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from kimi.client import key_fingerprint
+from kimi.limiter import get_rate_limiter
+
+# ===================== 1. 密钥池配置（可通过环境变量覆盖） =====================
+KEY_POOL_KEYS = os.environ.get("KIMI_KEY_POOL", "")
+KEY_POOL_FILE = os.environ.get("KIMI_KEY_POOL_FILE", "")
+KEY_RATE_LIMIT_COOLDOWN = float(os.environ.get("KIMI_KEY_RATE_LIMIT_COOLDOWN", "5"))  # 被限流后的最短冷却（秒）
+KEY_EXHAUSTED_COOLDOWN = float(os.environ.get("KIMI_KEY_EXHAUSTED_COOLDOWN", "600"))  # 余额不足/失效后的冷却（秒）
+KEY_STATS_WINDOW = 60.0  # 请求数、令牌数与失败次数的统计窗口（秒）
+
+# 需要让密钥进入冷却的上游错误（kimi.engine.error_class 的取值）
+COOLDOWN_ERRORS = ("rate_limit", "insufficient_funds", "invalid_api_key")
+
+
+class KeyPoolExhausted(Exception):
+    """密钥池中的密钥全部因余额不足或失效而冷却中"""
+
+
+def load_pool_keys(keys=KEY_POOL_KEYS, path=KEY_POOL_FILE):
+    """读取密钥池配置，去重并保持顺序；只保留 sk- 开头的密钥"""
+    text = keys
+    if path:
+        with open(path, encoding="utf-8") as f:
+            text += "\n" + f.read()
+    found = [item.strip() for item in text.replace(",", " ").split()]
+    return list(dict.fromkeys(key for key in found if key.startswith("sk-")))
+
+
+# ===================== 2. 单个密钥的状态 =====================
+class KeyState:
+    """一个密钥的滑动窗口统计与冷却状态（由 KeyPool 加锁访问）"""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.fingerprint = key_fingerprint(api_key)
+        self.requests = deque()  # (时间, 1)
+        self.tokens = deque()  # (时间, 令牌数)
+        self.failures = deque()  # (时间, 错误类型)
+        self.inflight = 0
+        self.cooldown_until = 0.0
+        self.cooldown_reason = ""
+
+    def trim(self, now):
+        start = now - KEY_STATS_WINDOW
+        for window in (self.requests, self.tokens, self.failures):
+            while window and window[0][0] < start:
+                window.popleft()
+
+    def cooling(self, now):
+        return now < self.cooldown_until
+
+    def stats(self, now):
+        self.trim(now)
+        failures = [kind for _, kind in self.failures]
+        return {
+            "key": self.fingerprint,
+            "requests_per_min": len(self.requests),
+            "tokens_per_min": sum(tokens for _, tokens in self.tokens),
+            "inflight": self.inflight,
+            "recent_rate_limits": failures.count("rate_limit"),
+            "recent_insufficient_funds": failures.count("insufficient_funds") + failures.count("invalid_api_key"),
+            "cooldown_seconds": round(max(0.0, self.cooldown_until - now), 1),
+            "cooldown_reason": self.cooldown_reason if self.cooling(now) else ""
+        }
+
+
+# ===================== 3. 密钥池 =====================
+class KeyPool:
+    """线程安全的密钥池：分配密钥、记录用量与失败、管理冷却"""
+
+    def __init__(self, keys, limiter=None):
+        self.limiter = limiter or get_rate_limiter()
+        self._lock = threading.Lock()
+        self._states = {key: KeyState(key) for key in keys}
+
+    @property
+    def size(self):
+        return len(self._states)
+
+    def acquire(self, tokens):
+        """选择预计等待最短的可用密钥并在其令牌桶中预约一次请求，返回 (密钥, 需等待秒数)
+        全部密钥冷却中时：有被限流的密钥则等到最早恢复的一个，全部余额不足或失效时抛出 KeyPoolExhausted"""
+        now = time.monotonic()
+        with self._lock:
+            available = [state for state in self._states.values() if not state.cooling(now)]
+            if available:
+                state = min(available, key=lambda s: (self.limiter.estimate_wait(s.api_key, tokens), s.inflight))
+                cooldown = 0.0
+            else:
+                limited = [state for state in self._states.values() if state.cooldown_reason == "rate_limit"]
+                if not limited:
+                    raise KeyPoolExhausted("❌ 共享密钥池中的密钥均余额不足或已失效，请稍后再试或填写自己的 Kimi 密钥！")
+                state = min(limited, key=lambda s: s.cooldown_until)
+                cooldown = state.cooldown_until - now
+            state.trim(now)
+            state.requests.append((now, 1))
+            state.inflight += 1
+        wait = self.limiter.reserve(state.api_key, tokens)
+        return state.api_key, max(wait, cooldown)
+
+    def release(self, api_key):
+        """一次上游请求结束（成功、失败或取消），归还进行中名额；不属于密钥池的密钥忽略"""
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is not None:
+                state.inflight = max(0, state.inflight - 1)
+
+    def record_tokens(self, api_key, tokens):
+        """记录一次请求实际消耗的令牌数"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is not None and tokens:
+                state.tokens.append((now, tokens))
+
+    def report_error(self, api_key, kind, retry_after=None):
+        """记录一次上游失败（kind 为错误类型）；限流、余额不足或密钥失效时让该密钥进入冷却，
+        返回 True 表示可以换用其他密钥重试"""
+        if kind not in COOLDOWN_ERRORS:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is None:
+                return False
+            state.failures.append((now, kind))
+            if kind == "rate_limit":
+                cooldown = max(KEY_RATE_LIMIT_COOLDOWN, retry_after or 0.0)
+            else:
+                cooldown = KEY_EXHAUSTED_COOLDOWN
+                kind = "insufficient_funds"
+            state.cooldown_until = max(state.cooldown_until, now + cooldown)
+            state.cooldown_reason = kind
+        return True
+
+    def stats(self):
+        """各密钥（指纹）的用量、失败与冷却情况，不包含明文密钥"""
+        now = time.monotonic()
+        with self._lock:
+            return [state.stats(now) for state in self._states.values()]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool():
+    """进程级共享密钥池；未配置密钥池时返回 None"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                keys = load_pool_keys()
+                _pool = KeyPool(keys) if keys else False
+    return _pool or None
+
+
+def uses_key_pool(kimi_api_key):
+    """用户未填写密钥且已配置密钥池时使用密钥池"""
+    return not str(kimi_api_key or "").strip() and get_key_pool() is not None
+
+
+def set_key_pool(keys):
+    """替换进程级密钥池（更换密钥或压测时使用），keys 为空时停用密钥池"""
+    global _pool
+    with _pool_lock:
+        _pool = KeyPool(keys) if keys else False
+
+
+def pool_stats():
+    """共享密钥池各密钥的统计，未配置密钥池时返回空列表"""
+    pool = get_key_pool()
+    return pool.stats() if pool is not None else []
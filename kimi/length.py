@@ -0,0 +1,81 @@
+"""字数预算：故事、营销文案的流式输出明显超过要求字数时在句末提前结束，不再等待和支付多余的令牌
+
+- 字数按中文字符统计（与界面的“字数统计”同一规则），随流式输出增量累计，每个字符只统计一次；
+  全角区（U+FF00–U+FFEF）的 ，！？：；（） 等标点也计入字数，。、「」 等（U+3000 区）不计，
+  因此标点较多的文本会略早达到预算；
+- 超过 字数 ×（1 + LENGTH_TOLERANCE）后，截断到不少于要求字数的最后一个句末
+  （连续的句末标点如 ……、？！ 与紧随的引号、括号一并保留）；
+  要求字数之后还没有出现句末时，在下一个句末截断；
+- 截断后引擎立即断开上游连接，结果以 TrimmedText 产出（is_trimmed 判断），
+  写入响应缓存，生成历史中的状态为 trimmed。
+"""
+import os
+import re
+
+# ===================== 1. 字数预算配置（可通过环境变量覆盖） =====================
+LENGTH_GUARD_ENABLED = os.environ.get("KIMI_LENGTH_GUARD", "1") != "0"
+LENGTH_TOLERANCE = float(os.environ.get("KIMI_LENGTH_TOLERANCE", "0.2"))  # 允许超出要求字数的比例
+LENGTH_GUARD_TEMPLATES = ("故事生成", "营销文案")
+
+SENTENCE_ENDINGS = "。！？!?…\n"
+CLOSING_MARKS = "”’」』）)》\"'"  # 紧跟在句末标点之后的引号、括号，截断时一并保留
+TRIMMED_NOTE = "✂️ 已超出要求字数，在句末提前结束生成"
+
+_CJK_RE = re.compile(r'[\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff\uff00-\uffef]')
+
+
+def count_cjk_chars(text):
+    """字数：汉字、假名与全角字符（含 ，！？： 等全角标点）的个数，与界面的字数统计同一规则；
+    。、「」 等 U+3000 区的标点、空格、半角英文与数字不计"""
+    return len(_CJK_RE.findall(text))
+
+
+class TrimmedText(str):
+    """按字数预算在句末截断的生成结果"""
+
+
+def is_trimmed(text):
+    return isinstance(text, TrimmedText)
+
+
+# ===================== 2. 增量字数统计与截断 =====================
+class LengthGuard:
+    """一次流式生成的字数预算：feed 传入累计文本，超出预算且找到句末时返回截断位置"""
+
+    def __init__(self, target, tolerance=LENGTH_TOLERANCE):
+        self.target = target
+        self.limit = int(target * (1 + tolerance))
+        self.count = 0
+        self.scanned = 0  # 已统计到的位置
+        self.boundary = None  # 达到要求字数后最后一个句末的位置
+
+    def feed(self, content):
+        """统计新增的文本；应当截断时返回截断位置，否则返回 None"""
+        for index in range(self.scanned, len(content)):
+            char = content[index]
+            # 连续的句末标点（……、？！）与紧随的引号、括号算作同一个句末，不从中间截断
+            if self.count > self.limit and self.boundary is not None and index >= self.boundary \
+                    and char not in CLOSING_MARKS and not (char in SENTENCE_ENDINGS and index == self.boundary):
+                self.scanned = index
+                return self.boundary
+            if _CJK_RE.match(char):
+                self.count += 1
+            if self.count >= self.target and (char in SENTENCE_ENDINGS
+                                              or (char in CLOSING_MARKS and self.boundary == index)):
+                self.boundary = index + 1
+        self.scanned = len(content)
+        return None
+
+    def trim(self, content, cut):
+        return TrimmedText(content[:cut].rstrip())
+
+
+def make_length_guard(template_type, param_dict):
+    """故事、营销文案且填写了有效字数时返回 LengthGuard，否则返回 None"""
+    if not LENGTH_GUARD_ENABLED or template_type not in LENGTH_GUARD_TEMPLATES:
+        return None
+    try:
+        target = int(param_dict.get("字数"))
+    except (ValueError, TypeError):
+        return None
+    return LengthGuard(target) if target > 0 else None
@@ -0,0 +1,224 @@
+"""客户端限流与重试：按密钥的令牌桶（每分钟请求数/令牌数）+ 429 指数退避重试
+KIMI_SHARED_STATE=1 时令牌桶存放在 kimi.shared 的共享状态库中，同一主机上的各进程共用一份额度"""
+import email.utils
+import os
+import random
+import threading
+import time
+
+from kimi.client import key_fingerprint
+from kimi.shared import SHARED_STATE_ENABLED, get_shared_state
+
+# ===================== 1. 限流与重试配置（可通过环境变量覆盖） =====================
+RATE_LIMIT_RPM = float(os.environ.get("KIMI_RATE_LIMIT_RPM", "200"))  # 每个密钥每分钟请求数
+RATE_LIMIT_TPM = float(os.environ.get("KIMI_RATE_LIMIT_TPM", "128000"))  # 每个密钥每分钟令牌数
+RETRY_MAX_ATTEMPTS = int(os.environ.get("KIMI_RETRY_MAX_ATTEMPTS", "4"))  # 单个请求最多重试次数
+RETRY_BASE_DELAY = float(os.environ.get("KIMI_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("KIMI_RETRY_MAX_DELAY", "20"))
+RETRY_MAX_TOTAL_WAIT = float(os.environ.get("KIMI_RETRY_MAX_TOTAL_WAIT", "45"))  # 单个请求累计重试等待上限（秒）
+RETRY_BUDGET_RATIO = float(os.environ.get("KIMI_RETRY_BUDGET_RATIO", "0.2"))  # 全局重试量不超过请求量的比例
+
+
+# ===================== 2. 令牌桶限流 =====================
+class TokenBucket:
+    """预约式令牌桶：允许透支，透支部分即调用方需要等待的时间"""
+
+    def __init__(self, capacity, per_second):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """扣除 amount 并返回需等待的秒数"""
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.per_second)
+
+    def peek(self, amount, now):
+        """扣除 amount 时需等待的秒数（不扣除）"""
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.per_second)
+
+    def block_for(self, seconds, now):
+        """上游要求暂停时，让后续预约至少等待 seconds 秒"""
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.per_second)
+
+
+class RateLimiter:
+    """进程级限流器：每个密钥一组请求桶与令牌桶，所有会话共享"""
+
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._buckets = {}  # 密钥指纹 -> (请求桶, 令牌桶)
+
+    def _get_buckets(self, api_key):
+        fingerprint = key_fingerprint(api_key)
+        buckets = self._buckets.get(fingerprint)
+        if buckets is None:
+            buckets = self._buckets[fingerprint] = (
+                TokenBucket(self.rpm, self.rpm / 60),
+                TokenBucket(self.tpm, self.tpm / 60)
+            )
+        return buckets
+
+    def reserve(self, api_key, tokens):
+        """预约一次请求及其预计令牌数，返回需等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            request_bucket, token_bucket = self._get_buckets(api_key)
+            return max(request_bucket.reserve(1, now), token_bucket.reserve(min(tokens, self.tpm), now))
+
+    def estimate_wait(self, api_key, tokens):
+        """预约一次请求需要等待的秒数（不预约），供密钥池比较各密钥的排队情况"""
+        now = time.monotonic()
+        with self._lock:
+            request_bucket, token_bucket = self._get_buckets(api_key)
+            return max(request_bucket.peek(1, now), token_bucket.peek(min(tokens, self.tpm), now))
+
+    def charge(self, api_key, tokens):
+        """请求结束后补扣实际消耗的令牌（不等待，影响后续请求）"""
+        now = time.monotonic()
+        with self._lock:
+            self._get_buckets(api_key)[1].reserve(tokens, now)
+
+    def penalize(self, api_key, seconds):
+        """收到 429 时暂停该密钥的后续请求"""
+        now = time.monotonic()
+        with self._lock:
+            self._get_buckets(api_key)[0].block_for(seconds, now)
+
+
+class SharedRateLimiter(RateLimiter):
+    """跨进程限流器：与 RateLimiter 接口相同，桶状态存放在共享状态库中，
+    每次操作在一个写事务内读出两个桶、计算并写回，多个进程同时预约也不会丢失扣减"""
+
+    BUCKET_KINDS = ("requests", "tokens")
+
+    def _update(self, api_key, action, write=True):
+        """在写事务中取出该密钥的请求桶与令牌桶，执行 action(请求桶, 令牌桶, now) 并写回"""
+        fingerprint = key_fingerprint(api_key)
+        now = time.time()  # 各进程共用的时间基准（monotonic 的起点不保证跨进程一致）
+        with get_shared_state().transaction() as db:
+            buckets = []
+            for kind, capacity in zip(self.BUCKET_KINDS, (self.rpm, self.tpm)):
+                bucket = TokenBucket(capacity, capacity / 60)
+                row = db.execute("SELECT tokens, updated FROM buckets WHERE fingerprint = ? AND kind = ?",
+                                 (fingerprint, kind)).fetchone()
+                bucket.tokens, bucket.updated = (row[0], min(row[1], now)) if row else (capacity, now)
+                buckets.append(bucket)
+            result = action(*buckets, now)
+            if write:
+                rows = [(fingerprint, kind, bucket.tokens, bucket.updated)
+                        for kind, bucket in zip(self.BUCKET_KINDS, buckets)]
+                db.executemany("INSERT OR REPLACE INTO buckets (fingerprint, kind, tokens, updated) "
+                               "VALUES (?, ?, ?, ?)", rows)
+        return result
+
+    def reserve(self, api_key, tokens):
+        return self._update(api_key, lambda requests, token_bucket, now: max(
+            requests.reserve(1, now), token_bucket.reserve(min(tokens, self.tpm), now)))
+
+    def estimate_wait(self, api_key, tokens):
+        return self._update(api_key, lambda requests, token_bucket, now: max(
+            requests.peek(1, now), token_bucket.peek(min(tokens, self.tpm), now)), write=False)
+
+    def charge(self, api_key, tokens):
+        self._update(api_key, lambda requests, token_bucket, now: token_bucket.reserve(tokens, now))
+
+    def penalize(self, api_key, seconds):
+        self._update(api_key, lambda requests, token_bucket, now: requests.block_for(seconds, now))
+
+
+# ===================== 3. 429 重试策略 =====================
+def is_rate_limit_error(error):
+    """判断是否为可重试的频率限制错误（余额不足同样返回 429，但不应重试）"""
+    message = str(error).lower()
+    if "insufficient" in message or "quota" in message:
+        return False
+    return getattr(error, "status_code", None) == 429 or "rate limit" in message
+
+
+def retry_after_seconds(error):
+    """读取响应头中的 Retry-After（秒数或 HTTP 日期），没有时返回 None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+class RetryPolicy:
+    """指数退避 + 抖动，优先遵循 Retry-After；全局重试预算限制重试风暴"""
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 max_total_wait=RETRY_MAX_TOTAL_WAIT, budget_ratio=RETRY_BUDGET_RATIO):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total_wait = max_total_wait
+        self.budget_ratio = budget_ratio
+        self._lock = threading.Lock()
+        self._budget = 10.0  # 每个请求存入 budget_ratio，每次重试取出 1
+        self.retries = 0
+        self.rejected = 0
+
+    def record_request(self):
+        with self._lock:
+            self._budget = min(10.0, self._budget + self.budget_ratio)
+
+    def next_delay(self, error, attempt, waited):
+        """返回第 attempt 次重试前应等待的秒数；不应重试时返回 None"""
+        if not is_rate_limit_error(error) or attempt > self.max_attempts:
+            return None
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        else:
+            delay += random.uniform(0, 0.5)
+        if waited + delay > self.max_total_wait:
+            return None
+        with self._lock:
+            if self._budget < 1:
+                self.rejected += 1
+                return None
+            self._budget -= 1
+            self.retries += 1
+        return delay
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+_retry_policy = RetryPolicy()
+
+
+def get_rate_limiter():
+    """进程级限流器；KIMI_SHARED_STATE=1 时为跨进程共享的 SharedRateLimiter"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = SharedRateLimiter() if SHARED_STATE_ENABLED else RateLimiter()
+    return _limiter
+
+
+def get_retry_policy():
+    return _retry_policy
@@ -0,0 +1,225 @@
+"""长文分章节生成：先用模板生成大纲，再按大纲并发撰写各章节，按大纲顺序拼接成全文
+
+一次生成整篇长文时输出常被 max_tokens 截断，且耗时随总字数线性增长；
+分章节后每个章节是一次独立的小请求（输出上限按每章字数推导），各章节同时生成，
+总耗时约为 大纲耗时 + 最长章节耗时。各章节请求共享“文档说明 + 完整大纲”作为上下文，
+因此内容彼此衔接；每个章节照常经过响应缓存、请求合并、限流与生成历史。
+
+命令行用法：
+    python -m kimi.longform 论文提纲 -p 论文题目=基于深度学习的图像识别技术研究 -p 学科=计算机科学 \\
+        -p 章节数=8 --section-chars 1500 -o paper.md
+"""
+import argparse
+import os
+import re
+import sys
+from collections import namedtuple
+
+from kimi.backend import generate_stream, generate_stream_async
+from kimi.engine import DEFAULT_TEMPLATE_SET, LONGFORM_TEMPLATE_SET, merge_streams, merge_streams_async
+
+# ===================== 1. 长文配置（可通过环境变量覆盖） =====================
+LONGFORM_SECTION_CHARS = 1500  # 每章默认字数
+LONGFORM_MAX_SECTION_CHARS = 4000  # 每章字数上限（再长单章也可能被截断）
+LONGFORM_MAX_SECTIONS = int(os.environ.get("KIMI_LONGFORM_MAX_SECTIONS", "20"))  # 最多并发撰写的章节数
+SECTION_TEMPLATE = "章节撰写"
+PENDING_TEXT = "（撰写中…）"
+
+# 支持长文模式的模板：大纲由哪个模板生成、文档说明如何描述
+LONGFORM_TEMPLATES = {
+    "论文提纲": {
+        "outline_set": DEFAULT_TEMPLATE_SET,
+        "outline_template": "论文提纲",
+        "document": "论文《{论文题目}》（{学科}领域）"
+    },
+    "故事生成": {
+        "outline_set": LONGFORM_TEMPLATE_SET,
+        "outline_template": "故事大纲",
+        "document": "一篇以{主题}为核心的{风格}风格长篇故事"
+    }
+}
+
+Section = namedtuple("Section", ["title", "brief"])  # 章节标题、大纲中该章节的完整条目（含子条目）
+LongformProgress = namedtuple("LongformProgress", ["outline", "sections", "contents", "finished"])
+
+# 章节标题：第N章/节/部分、“一、”、“1.”（不含“1.1”这类子条目），允许 Markdown 标题、加粗等前缀
+_HEADING_PATTERNS = [
+    re.compile(r"第[一二三四五六七八九十百零〇\d]+[章节部分篇回]"),
+    re.compile(r"[一二三四五六七八九十]+[、.．]"),
+    re.compile(r"\d+[、.．](?!\d)"),
+]
+_HEADING_PREFIX_RE = re.compile(r"^[#*>\-\s]+")
+
+
+# ===================== 2. 大纲解析 =====================
+def _heading_kind(line):
+    text = _HEADING_PREFIX_RE.sub("", line)
+    for kind, pattern in enumerate(_HEADING_PATTERNS):
+        if pattern.match(text):
+            return kind
+    return None
+
+
+def _heading_title(line):
+    title = _HEADING_PREFIX_RE.sub("", line).replace("**", "").strip()
+    return re.split(r"[：:]", title, maxsplit=1)[0].strip() or title
+
+
+def parse_outline(outline):
+    """把大纲切分为章节：以第一个章节标题的格式作为一级标题，其后的子条目归入所属章节
+    识别不出章节时整份大纲作为一个章节"""
+    lines = [line.rstrip() for line in outline.splitlines() if line.strip()]
+    kind = next((k for k in map(_heading_kind, lines) if k is not None), None)
+    if kind is None:
+        return [Section("正文", outline.strip())]
+
+    sections, block = [], []
+    for line in lines:
+        if _heading_kind(line) == kind:
+            if block:
+                sections.append(Section(_heading_title(block[0]), "\n".join(block)))
+            block = [line.strip()]
+        elif block:
+            block.append(line.strip())
+    sections.append(Section(_heading_title(block[0]), "\n".join(block)))
+    return sections
+
+
+def section_chars(param_dict):
+    """每章字数（未填写或无效时使用默认值，超过上限时截断）"""
+    try:
+        chars = int(param_dict.get("每章字数") or LONGFORM_SECTION_CHARS)
+    except (ValueError, TypeError):
+        chars = LONGFORM_SECTION_CHARS
+    return max(1, min(chars, LONGFORM_MAX_SECTION_CHARS))
+
+
+def section_params(template_type, param_dict, outline, section):
+    """章节撰写模板的参数：文档说明、完整大纲（共享上下文）、本章条目与字数"""
+    document = LONGFORM_TEMPLATES[template_type]["document"].format_map(param_dict)
+    return {"文档": document, "大纲": outline.strip(), "章节": section.brief, "字数": section_chars(param_dict)}
+
+
+# ===================== 3. 拼接与进度 =====================
+def assemble(progress):
+    """按大纲顺序拼接全文；未完成的章节显示当前已生成的部分或占位文字"""
+    if not progress.sections:
+        return progress.outline
+    parts = []
+    for section, content in zip(progress.sections, progress.contents):
+        body = PENDING_TEXT if not content or content.startswith("⏳") else content
+        parts.append(f"## {section.title}\n\n{body.strip()}")
+    return "\n\n".join(parts)
+
+
+def describe_progress(progress):
+    """界面展示用的进度说明"""
+    if not progress.sections:
+        return "📝 正在生成大纲..."
+    done = sum(progress.finished)
+    failed = sum(1 for content in progress.contents if content.startswith("❌"))
+    caption = f"📚 大纲共 {len(progress.sections)} 章，已完成 {done - failed} 章"
+    if failed:
+        caption += f"，失败 {failed} 章"
+    return caption if done == len(progress.sections) else caption + "，其余章节并发撰写中..."
+
+
+def _check_template(template_type):
+    if template_type not in LONGFORM_TEMPLATES:
+        return f"❌ 长文模式仅支持：{'、'.join(LONGFORM_TEMPLATES)}"
+    return None
+
+
+# ===================== 4. 两阶段生成 =====================
+def generate_longform_stream(kimi_api_key, template_type, param_dict, use_cache=True, coalesce=True, cancel=None):
+    """长文流式生成：先产出大纲生成进度，再产出各章节并发撰写的进度（LongformProgress）
+    大纲生成失败时 outline 为以 ❌ 开头的提示，sections 为空；cancel 同时取消大纲与全部章节"""
+    error = _check_template(template_type)
+    if error:
+        yield LongformProgress(error, [], [], [])
+        return
+    plan = LONGFORM_TEMPLATES[template_type]
+
+    outline = ""
+    for outline in generate_stream(kimi_api_key, plan["outline_template"], param_dict, use_cache,
+                                   plan["outline_set"], coalesce, cancel=cancel):
+        yield LongformProgress(outline, [], [], [])
+    if not outline.strip() or outline.startswith("❌") or (cancel and cancel.cancelled):
+        return
+
+    sections = parse_outline(outline)[:LONGFORM_MAX_SECTIONS]
+    streams = [generate_stream(kimi_api_key, SECTION_TEMPLATE, section_params(template_type, param_dict, outline,
+                                                                               section),
+                               use_cache, LONGFORM_TEMPLATE_SET, coalesce, cancel=cancel)
+               for section in sections]
+    for contents, finished in merge_streams(streams):
+        yield LongformProgress(outline, sections, contents, finished)
+
+
+async def generate_longform_stream_async(kimi_api_key, template_type, param_dict, use_cache=True, coalesce=True,
+                                         cancel=None):
+    """异步长文流式生成：与 generate_longform_stream 行为一致"""
+    error = _check_template(template_type)
+    if error:
+        yield LongformProgress(error, [], [], [])
+        return
+    plan = LONGFORM_TEMPLATES[template_type]
+
+    outline = ""
+    async for outline in generate_stream_async(kimi_api_key, plan["outline_template"], param_dict, use_cache,
+                                               plan["outline_set"], coalesce, cancel=cancel):
+        yield LongformProgress(outline, [], [], [])
+    if not outline.strip() or outline.startswith("❌") or (cancel and cancel.cancelled):
+        return
+
+    sections = parse_outline(outline)[:LONGFORM_MAX_SECTIONS]
+    streams = [generate_stream_async(kimi_api_key, SECTION_TEMPLATE,
+                                     section_params(template_type, param_dict, outline, section),
+                                     use_cache, LONGFORM_TEMPLATE_SET, coalesce, cancel=cancel)
+               for section in sections]
+    async for contents, finished in merge_streams_async(streams):
+        yield LongformProgress(outline, sections, contents, finished)
+
+
+def generate_longform(kimi_api_key, template_type, param_dict, use_cache=True, coalesce=True):
+    """长文非流式生成：返回拼接后的全文（大纲失败时返回错误提示）"""
+    progress = LongformProgress("", [], [], [])
+    for progress in generate_longform_stream(kimi_api_key, template_type, param_dict, use_cache, coalesce):
+        pass
+    return assemble(progress)
+
+
+# ===================== 5. 命令行入口 =====================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kimi 长文分章节生成（大纲 → 并发撰写各章节 → 拼接）")
+    parser.add_argument("template", choices=list(LONGFORM_TEMPLATES), help="生成模板")
+    parser.add_argument("-p", "--param", action="append", default=[], metavar="名称=取值",
+                        help="模板参数，可重复，例如 -p 主题=星空 -p 章节数=8")
+    parser.add_argument("--section-chars", type=int, default=LONGFORM_SECTION_CHARS, help="每章字数")
+    parser.add_argument("-o", "--output", help="输出文件（默认输出到标准输出）")
+    parser.add_argument("--api-key", default=os.environ.get("KIMI_API_KEY", ""), help="默认读取环境变量 KIMI_API_KEY")
+    parser.add_argument("--no-cache", action="store_true", help="跳过响应缓存，全部重新生成")
+    args = parser.parse_args(argv)
+
+    param_dict = dict(item.split("=", 1) for item in args.param if "=" in item)
+    param_dict["每章字数"] = args.section_chars
+    progress, last_caption = LongformProgress("", [], [], []), ""
+    for progress in generate_longform_stream(args.api_key, args.template, param_dict, not args.no_cache,
+                                             not args.no_cache):
+        caption = describe_progress(progress)
+        if caption != last_caption:
+            print(caption, file=sys.stderr)
+            last_caption = caption
+
+    text = assemble(progress)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    failed = not progress.sections or any(content.startswith("❌") for content in progress.contents)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""运行指标：生成耗时、首字延迟、令牌用量、缓存命中、重试与错误分类，按模板与模型打标签
+
+指标保存在进程内存中，以 Prometheus 文本格式输出：
+- 2.py 与 1.py / 3.py 启动时在旁路端口开启 /metrics（start_metrics_server，同一进程只启动一次）；
+- kimi.server 在自身端口提供 /metrics（界面以服务模式运行时，生成指标记录在服务进程中）。
+记录一次指标只是加锁更新字典中的计数，开销可忽略，生产环境可常开；KIMI_METRICS=0 时完全关闭。
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# ===================== 1. 指标配置（可通过环境变量覆盖） =====================
+METRICS_ENABLED = os.environ.get("KIMI_METRICS", "1") != "0"
+METRICS_HOST = os.environ.get("KIMI_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.environ.get("KIMI_METRICS_PORT")  # 未设置时使用各界面自己的默认端口
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+RENDER_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+# ===================== 2. 计数器与直方图 =====================
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """带标签的单调计数器"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # 标签取值元组 -> 计数
+
+    def inc(self, labels=(), amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """带标签的累积直方图（桶上界固定）"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}  # 标签取值元组 -> [各桶计数..., 总和, 总数]
+
+    def observe(self, labels, value):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, labels=()):
+        with self._lock:
+            state = self._values.get(labels)
+            return state[-1] if state else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {state[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {state[-1]}")
+        return lines
+
+
+# ===================== 3. 生成相关指标 =====================
+GENERATION_SECONDS = Histogram("kimi_generation_seconds", "一次生成从发起到结束的耗时（含排队与重试）",
+                               ("template", "model", "outcome"), LATENCY_BUCKETS)
+TTFT_SECONDS = Histogram("kimi_time_to_first_token_seconds", "从发起生成到收到首个文本分块的耗时",
+                         ("template", "model"), TTFT_BUCKETS)
+TOKENS_TOTAL = Counter("kimi_tokens_total", "上游返回的令牌用量（kind=prompt/completion）",
+                       ("template", "model", "kind"))
+CACHE_LOOKUPS_TOTAL = Counter("kimi_cache_lookups_total", "响应缓存查询次数（result=hit/miss/bypass）",
+                              ("template", "model", "result"))
+RETRIES_TOTAL = Counter("kimi_retries_total", "因限流自动重试的次数", ("template", "model"))
+ERRORS_TOTAL = Counter("kimi_errors_total", "上游调用失败次数（按错误类型）", ("template", "model", "error_class"))
+HEDGES_TOTAL = Counter("kimi_hedges_total", "对冲请求次数（result=fired 发出 / won 先于原请求响应 / denied 预算不足未发出）",
+                       ("template", "model", "result"))
+RENDER_SECONDS = Histogram("kimi_render_seconds", "界面把生成结果渲染到页面上累计花费的时间",
+                           ("app", "template"), RENDER_BUCKETS)
+
+ALL_METRICS = [GENERATION_SECONDS, TTFT_SECONDS, TOKENS_TOTAL, CACHE_LOOKUPS_TOTAL, RETRIES_TOTAL, ERRORS_TOTAL,
+               HEDGES_TOTAL, RENDER_SECONDS]
+
+
+class GenerationTrace:
+    """单次生成的指标记录：由引擎在确定模型后创建，结束（含中途断开）时写入耗时"""
+
+    def __init__(self, template_type, model):
+        self.labels = (template_type, model)
+        self.started = time.perf_counter()
+        self.first_token_seen = False
+        self.finished = False
+        self.ttft = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+
+    def cache_lookup(self, result):
+        CACHE_LOOKUPS_TOTAL.inc(self.labels + (result,))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def first_token(self):
+        if not self.first_token_seen:
+            self.first_token_seen = True
+            self.ttft = self.elapsed()
+            TTFT_SECONDS.observe(self.labels, self.ttft)
+
+    def retry(self):
+        RETRIES_TOTAL.inc(self.labels)
+
+    def usage(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        if prompt_tokens:
+            TOKENS_TOTAL.inc(self.labels + ("prompt",), prompt_tokens)
+        if completion_tokens:
+            TOKENS_TOTAL.inc(self.labels + ("completion",), completion_tokens)
+
+    def error(self, error_class):
+        ERRORS_TOTAL.inc(self.labels + (error_class,))
+        self.finish("error")
+
+    def finish(self, outcome):
+        """outcome：ok / trimmed / cache / coalesced / empty / error / cancelled，只记录第一次"""
+        if self.finished:
+            return
+        self.finished = True
+        GENERATION_SECONDS.observe(self.labels + (outcome,), self.elapsed())
+
+    def close(self):
+        # 调用方提前关闭生成器（页面刷新、客户端断开）时记为取消
+        self.finish("cancelled")
+
+
+def observe_render(app, template_type, seconds):
+    """界面侧：记录一次生成过程中渲染页面累计花费的时间"""
+    RENDER_SECONDS.observe((app, template_type), seconds)
+
+
+def render_metrics():
+    """全部指标的 Prometheus 文本格式"""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ===================== 4. /metrics 旁路服务 =====================
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+_server = None
+_server_started = False
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(default_port, host=METRICS_HOST):
+    """在后台线程开启 /metrics（同一进程重复调用只尝试一次），返回监听端口；
+    端口被占用时不影响界面运行，返回 None"""
+    global _server, _server_started
+    if not METRICS_ENABLED:
+        return None
+    with _server_lock:
+        if not _server_started:
+            _server_started = True
+            port = int(METRICS_PORT) if METRICS_PORT else default_port
+            try:
+                _server = MetricsHTTPServer((host, port), MetricsHandler)
+            except OSError as e:
+                logger.warning("指标服务启动失败（%s:%s）：%s", host, port, e)
+                return None
+            threading.Thread(target=_server.serve_forever, name="kimi-metrics", daemon=True).start()
+        return _server.server_address[1] if _server else None
@@ -0,0 +1,145 @@
+"""局部修改：按修改要求只改写结果中的一个段落并拼回原文，不再整篇重新生成
+
+整篇重新生成时输入是完整提示词、输出是全文，耗时随全文字数线性增长；局部修改每次只发送
+原始要求、目标段落、前后文各不超过 REFINE_CONTEXT_CHARS 字与最近几次修改要求，
+输出上限按目标段落的字数推导，令牌数与等待时间都只与这一段相关。
+
+- 段落为文本中的非空行（Markdown 标题、列表项各算一段）；
+- 修改要求中写了“第3段”“最后一段”等时按要求定位段落，否则使用界面选中的段落；
+- RefineSession 保存一次结果的多轮修改：原始要求与修改记录，修改前的全文存入 kimi.content，只保留句柄（可撤销）；
+- 每次修改照常经过响应缓存、限流与生成历史（模板为“局部修改”）。
+"""
+import re
+from collections import namedtuple
+
+from kimi.backend import generate_stream
+from kimi.content import load_content, store_content
+from kimi.engine import REFINE_TEMPLATE_SET
+from kimi.length import count_cjk_chars
+
+# ===================== 1. 局部修改配置 =====================
+REFINE_TEMPLATE = "局部修改"
+REFINE_CONTEXT_CHARS = 100  # 前文、后文各最多发送的字数（紧邻目标段落的部分）
+REFINE_HISTORY_TURNS = 3  # 提示词中带上最近几次已采纳的修改要求
+REFINE_MAX_UNDO = 20  # 最多可撤销的修改次数
+NO_CONTEXT = "（无）"
+
+Paragraph = namedtuple("Paragraph", ["start", "end", "text"])  # 段落在全文中的起止位置与内容
+RefineTurn = namedtuple("RefineTurn", ["index", "instruction", "before"])  # 修改的段落、修改要求、修改前全文的句柄
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8,
+              "九": 9}
+_PARAGRAPH_REF_RE = re.compile(r"第\s*([\d一二两三四五六七八九十〇零]+)\s*段|paragraph\s*(\d+)", re.IGNORECASE)
+_LAST_REF_RE = re.compile(r"最后一段|末段|last paragraph", re.IGNORECASE)
+_FIRST_REF_RE = re.compile(r"首段|开头一段|first paragraph", re.IGNORECASE)
+_TARGET_CHARS_RE = re.compile(r"(\d+)\s*字")
+_MARKER_RE = re.compile(r"^(?:【[^】]*】|(?:改写后的?|原)段落[：:])\s*")
+
+
+# ===================== 2. 段落切分与定位 =====================
+def split_paragraphs(document):
+    """按行切分段落（跳过空行），返回 Paragraph 列表"""
+    paragraphs, offset = [], 0
+    for line in document.splitlines(keepends=True):
+        text = line.strip()
+        if text:
+            start = offset + line.index(text[0])
+            paragraphs.append(Paragraph(start, start + len(text), text))
+        offset += len(line)
+    return paragraphs
+
+
+def _parse_number(text):
+    if text.isdigit():
+        return int(text)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return _CN_DIGITS.get(tens, 1) * 10 + _CN_DIGITS.get(ones, 0)
+    return _CN_DIGITS.get(text)
+
+
+def paragraph_ref(instruction, count):
+    """修改要求中指定的段落序号（从 0 开始）；没有指定或超出范围时返回 None"""
+    if count <= 0:
+        return None
+    if _LAST_REF_RE.search(instruction):
+        return count - 1
+    if _FIRST_REF_RE.search(instruction):
+        return 0
+    match = _PARAGRAPH_REF_RE.search(instruction)
+    if not match:
+        return None
+    number = _parse_number(match.group(1) or match.group(2))
+    return number - 1 if number and number <= count else None
+
+
+def target_chars(paragraph, instruction):
+    """改写后的字数：修改要求写明“N字”时按要求，否则与原段落相近"""
+    match = _TARGET_CHARS_RE.search(instruction)
+    if match and int(match.group(1)) > 0:
+        return int(match.group(1))
+    return max(1, count_cjk_chars(paragraph.text) or len(paragraph.text))
+
+
+# ===================== 3. 提示词参数与拼接 =====================
+def refine_params(request, document, index, instruction, previous=()):
+    """局部修改模板的参数：原始要求、目标段落、截断后的前后文与最近几次修改要求"""
+    paragraphs = split_paragraphs(document)
+    paragraph = paragraphs[index]
+    before = document[:paragraph.start].strip()[-REFINE_CONTEXT_CHARS:]
+    after = document[paragraph.end:].strip()[:REFINE_CONTEXT_CHARS]
+    history = [item for item in previous if item.strip()][-REFINE_HISTORY_TURNS:]
+    return {
+        "原始要求": request.strip() or NO_CONTEXT,
+        "前文": before or NO_CONTEXT,
+        "段落": paragraph.text,
+        "后文": after or NO_CONTEXT,
+        "修改记录": "；".join(history) or NO_CONTEXT,
+        "修改要求": instruction.strip(),
+        "字数": target_chars(paragraph, instruction)
+    }
+
+
+def clean_revision(text):
+    """去掉模型偶尔照抄的“原段落：”等标记与首尾空白"""
+    return _MARKER_RE.sub("", text.strip()).strip()
+
+
+def splice(document, paragraph, revision):
+    """用改写后的内容替换全文中的该段落，其余内容（包括换行与缩进）保持不变"""
+    return document[:paragraph.start] + clean_revision(revision) + document[paragraph.end:]
+
+
+# ===================== 4. 多轮修改会话 =====================
+class RefineSession:
+    """一次生成结果的多轮局部修改：原始要求 + 修改记录；全文由调用方传入，会话本身不保留正文"""
+
+    def __init__(self, request, session_id=None):
+        self.request = request
+        self.session_id = session_id  # 修改前的全文记到该会话的正文内存预算下
+        self.turns = []
+
+    def stream(self, kimi_api_key, document, index, instruction, use_cache=True, cancel=None):
+        """流式改写 document 的第 index 段，产出改写后的段落（排队提示以 ⏳、错误以 ❌ 开头，与引擎一致）"""
+        if not instruction.strip():
+            yield "❌ 请填写修改要求！"
+            return
+        if not 0 <= index < len(split_paragraphs(document)):
+            yield "❌ 没有可修改的段落！"
+            return
+        param_dict = refine_params(self.request, document, index, instruction,
+                                   [turn.instruction for turn in self.turns])
+        yield from generate_stream(kimi_api_key, REFINE_TEMPLATE, param_dict, use_cache, REFINE_TEMPLATE_SET,
+                                   cancel=cancel)
+
+    def accept(self, document, index, instruction, revision):
+        """把改写结果拼回全文并记入修改记录，返回新的全文"""
+        before = store_content(document, self.session_id)
+        self.turns = (self.turns + [RefineTurn(index, instruction.strip(), before)])[-REFINE_MAX_UNDO:]
+        return splice(document, split_paragraphs(document)[index], revision)
+
+    def undo(self):
+        """撤销最近一次修改，返回修改前的全文；没有可撤销的修改或正文已过期清理时返回 None"""
+        if not self.turns:
+            return None
+        return load_content(self.turns.pop().before, self.session_id)
@@ -0,0 +1,62 @@
+"""按规模路由模型：估算提示词令牌数，按字数/章节数推导输出预算，选择能容纳的最小上下文模型"""
+import os
+from collections import namedtuple
+
+from kimi.tokens import _positive_int, estimate_tokens
+
+# ===================== 1. 路由配置 =====================
+# 候选模型按上下文窗口从小到大排列
+MODEL_CONTEXT_WINDOWS = [
+    ("moonshot-v1-8k", 8192),
+    ("moonshot-v1-32k", 32768),
+    ("moonshot-v1-128k", 131072),
+]
+AUTO_ROUTE = os.environ.get("KIMI_AUTO_ROUTE", "1") != "0"  # 关闭后固定使用默认模型与输出上限
+DEFAULT_MAX_TOKENS = 8192  # 无法从参数推导输出规模时（如自由创作）的输出上限
+MESSAGE_OVERHEAD_TOKENS = 16  # 消息格式本身占用的令牌
+PROMPT_SAFETY_MARGIN = 1.2  # 本地估算存在误差，判断上下文是否够用时放大提示词令牌数
+
+OUTPUT_TOKENS_PER_CHAR = 1.0  # 每个汉字对应的输出令牌数（偏保守）
+OUTPUT_SLACK = 1.5  # 模型常超出要求字数，为“左右/以内”留出余量
+OUTPUT_OVERHEAD_TOKENS = 128  # 标题、分段等额外输出
+TOKENS_PER_CHAPTER = 400  # 论文提纲每个章节的输出预算
+OUTLINE_OVERHEAD_TOKENS = 256
+
+Route = namedtuple("Route", ["model", "max_tokens", "prompt_tokens", "context_window"])
+
+
+# ===================== 2. 预算推导与模型选择 =====================
+def output_budget(param_dict):
+    """根据字数/章节数推导输出令牌上限，无法推导时返回 None"""
+    word_count = _positive_int(param_dict.get("字数"))
+    if word_count:
+        return int(word_count * OUTPUT_TOKENS_PER_CHAR * OUTPUT_SLACK) + OUTPUT_OVERHEAD_TOKENS
+    chapters = _positive_int(param_dict.get("章节数"))
+    if chapters:
+        return chapters * TOKENS_PER_CHAPTER + OUTLINE_OVERHEAD_TOKENS
+    return None
+
+
+def route_request(prompt, param_dict, default_model, default_max_tokens=DEFAULT_MAX_TOKENS):
+    """选择能容纳 提示词+输出预算 的最小模型；提示词超过最大窗口时返回 None"""
+    prompt_tokens = int(estimate_tokens(prompt) * PROMPT_SAFETY_MARGIN) + MESSAGE_OVERHEAD_TOKENS
+    if not AUTO_ROUTE:
+        context = dict(MODEL_CONTEXT_WINDOWS).get(default_model, DEFAULT_MAX_TOKENS)
+        return Route(default_model, default_max_tokens, prompt_tokens, context)
+
+    budget = output_budget(param_dict) or default_max_tokens
+    for model, context in MODEL_CONTEXT_WINDOWS:
+        if prompt_tokens + budget <= context:
+            return Route(model, budget, prompt_tokens, context)
+
+    # 最大窗口也放不下完整预算时，压缩输出上限
+    model, context = MODEL_CONTEXT_WINDOWS[-1]
+    if prompt_tokens >= context:
+        return None
+    return Route(model, context - prompt_tokens, prompt_tokens, context)
+
+
+def describe_route(route):
+    """界面展示用的路由说明"""
+    return (f"模型：{route.model} | 输出上限：{route.max_tokens} tokens | "
+            f"提示词约 {route.prompt_tokens} tokens")
@@ -0,0 +1,233 @@
+"""本地生成服务：JSON 与 SSE 流式接口，缓存、限流和连接池集中在这一个长驻进程中
+
+启动：python -m kimi.server --port 8765
+界面接入：启动界面前设置 KIMI_SERVICE_URL=http://127.0.0.1:8765
+
+接口（密钥通过请求头 Authorization: Bearer sk-... 传入；未传密钥且配置了 KIMI_KEY_POOL 时使用共享密钥池）：
+    GET  /health              存活检查
+    GET  /templates           全部模板集
+    GET  /stats               缓存命中、对冲请求、共享密钥池各密钥用量与冷却等统计
+    GET  /metrics             Prometheus 文本格式的运行指标
+    GET  /history             生成历史摘要，参数 q（关键词）、template、before（游标 id）、limit
+    GET  /history/<id>        单条历史记录全文
+    POST /estimate            生成前预估与模型路由
+    POST /similar             查找相似请求已生成的结果，返回 {"match": {"content", "similarity", "params"} 或 null}，
+                              请求体可带 threshold（相似度下限）
+    POST /generate            非流式生成，返回 {"status", "content", "trimmed"}
+    POST /generate/stream     SSE 流式生成，事件见 stream_events
+请求体：{"template": "故事生成", "params": {...}, "template_set": "default", "use_cache": true, "coalesce": true,
+        "variant": 0}
+（coalesce 为 true 时与进行中的相同请求合并，所有界面进程共享同一次上游调用；
+  多候选生成时客户端为每个候选并发发起一个请求，variant 为候选序号）
+请求体或查询参数的类型不对（params 不是对象、threshold / variant / before / limit 不是数字等）时返回 400。
+"""
+import argparse
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from kimi import engine
+from kimi.cancel import CancelToken, ticking
+from kimi.hedge import hedge_stats
+from kimi.history import HISTORY_PAGE_SIZE, get_history_entry, search_history
+from kimi.keypool import pool_stats
+from kimi.length import is_trimmed
+from kimi.metrics import render_metrics
+from kimi.similar import SIMILAR_THRESHOLD
+
+SERVICE_HOST = os.environ.get("KIMI_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("KIMI_SERVICE_PORT", "8765"))
+
+
+def _number(value, kind, name):
+    """把请求中的数值参数转换为 kind（int / float），无效时抛出 ValueError（处理函数返回 400）"""
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"参数 {name} 必须是数字") from None
+
+
+def stream_events(partials):
+    """把引擎产出的累计文本转换为 SSE 事件：
+    delta（追加文本）、replace（整体替换，如按字数预算截断）、notice（排队/重试提示）、
+    error（以 ❌ 开头的失败提示）、trimmed（结果已按字数预算在句末截断）、done（结束）；
+    partial 为 None（等待上游期间的心跳）时产出 ping，写出为 SSE 注释行"""
+    content = ""
+    for partial in partials:
+        if partial is None:
+            yield "ping", None
+        elif partial.startswith("⏳"):
+            yield "notice", {"text": partial}
+        elif partial.startswith("❌"):
+            yield "error", {"text": partial}
+        elif partial.startswith(content):
+            delta = partial[len(content):]
+            content = partial
+            if delta:
+                yield "delta", {"text": delta}
+        else:
+            content = partial
+            yield "replace", {"text": partial}
+    if is_trimmed(content):
+        yield "trimmed", {}
+    yield "done", {}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 只记录请求行，不输出请求头（密钥在 Authorization 中）
+        pass
+
+    # ---------- 请求解析 ----------
+    def _api_key(self):
+        auth = self.headers.get("Authorization", "")
+        return auth[len("Bearer "):].strip() if auth.startswith("Bearer ") else ""
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ValueError("请求体不是有效的 JSON") from None
+        if not isinstance(body, dict):
+            raise ValueError("请求体必须是 JSON 对象")
+        return body
+
+    def _request_args(self, body):
+        """读取模板、参数与模板集；类型不对时抛出 ValueError"""
+        template_type = body.get("template", "")
+        param_dict = body.get("params") or {}
+        template_set = body.get("template_set", engine.DEFAULT_TEMPLATE_SET)
+        if not isinstance(template_type, str) or not isinstance(template_set, str):
+            raise ValueError("参数 template 与 template_set 必须是字符串")
+        if not isinstance(param_dict, dict):
+            raise ValueError("参数 params 必须是 JSON 对象")
+        return template_type, param_dict, template_set
+
+    # ---------- 响应 ----------
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    # ---------- 路由 ----------
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/history":
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            try:
+                before = _number(query.get("before") or 0, int, "before") or None
+                limit = min(_number(query.get("limit") or HISTORY_PAGE_SIZE, int, "limit"), 100)
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(200, {"entries": search_history(query.get("q", ""), query.get("template") or None,
+                                                            before, limit)})
+        elif url.path.startswith("/history/") and url.path[len("/history/"):].isdigit():
+            entry = get_history_entry(int(url.path[len("/history/"):]))
+            self._send_json(200 if entry else 404, entry or {"error": "not found"})
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/templates":
+            self._send_json(200, engine.TEMPLATE_SETS)
+        elif self.path == "/stats":
+            self._send_json(200, {"cache": engine.cache_stats(), "hedge": hedge_stats(), "key_pool": pool_stats()})
+        elif self.path == "/metrics":
+            self._send_text(200, render_metrics(), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            body = self._body()
+            template_type, param_dict, template_set = self._request_args(body)
+            threshold = _number(body.get("threshold", SIMILAR_THRESHOLD), float, "threshold")
+            variant = _number(body.get("variant", 0), int, "variant")
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        if self.path == "/estimate":
+            self._send_json(200, {
+                "estimate": engine.estimate_caption(template_type, param_dict, template_set),
+                "route": engine.route_caption(template_type, param_dict, template_set)
+            })
+        elif self.path == "/similar":
+            self._send_json(200, {"match": engine.find_similar(template_type, param_dict, template_set, threshold)})
+        elif self.path == "/generate":
+            content = engine.generate(self._api_key(), template_type, param_dict, body.get("use_cache", True),
+                                      template_set, body.get("coalesce", True), variant)
+            self._send_json(200, {"status": "error" if content.startswith("❌") else "ok", "content": content,
+                                  "trimmed": is_trimmed(content)})
+        elif self.path == "/generate/stream":
+            self._stream(template_type, param_dict, template_set, body.get("use_cache", True),
+                         body.get("coalesce", True), variant)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _stream(self, template_type, param_dict, template_set, use_cache, coalesce, variant):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        cancel = CancelToken()
+        partials = engine.generate_stream(self._api_key(), template_type, param_dict, use_cache, template_set,
+                                          coalesce, variant, cancel)
+        # 等待上游期间定期写出心跳，客户端断开（停止生成、关闭页面）后最迟一个心跳间隔即可发现
+        updates = ticking(partials, cancel)
+        try:
+            for event, payload in stream_events(updates):
+                if payload is None:
+                    self._write_chunk(b": ping\n\n")
+                else:
+                    self._write_chunk(f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                                      .encode("utf-8"))
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已断开：取消生成，立即断开上游连接并保存已生成的部分
+            updates.close()
+
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kimi 本地生成服务（JSON + SSE）")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+    server = ServiceHTTPServer((args.host, args.port), ServiceHandler)
+    print(f"Kimi 生成服务已启动：http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""生成服务客户端：与 kimi.engine 同名同参的函数，通过 HTTP/SSE 调用 kimi.server"""
+import asyncio
+import json
+import os
+
+import httpx
+
+from kimi.cancel import CancelToken
+from kimi.engine import (  # noqa: F401  预估在本地计算
+    DEFAULT_TEMPLATE_SET, clamp_variants, estimate_caption, merge_streams, merge_streams_async, route_caption
+)
+from kimi.length import TrimmedText
+from kimi.similar import SIMILAR_THRESHOLD
+
+SERVICE_URL = os.environ.get("KIMI_SERVICE_URL", "http://127.0.0.1:8765").rstrip("/")
+SERVICE_TIMEOUT = httpx.Timeout(float(os.environ.get("KIMI_READ_TIMEOUT", "600")), connect=5.0)
+
+_client = httpx.Client(base_url=SERVICE_URL, timeout=SERVICE_TIMEOUT)
+_async_clients = {}  # 事件循环 -> httpx.AsyncClient（异步客户端不能跨事件循环复用）
+
+
+def _async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(base_url=SERVICE_URL, timeout=SERVICE_TIMEOUT)
+    return client
+
+
+def _request(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce, variant):
+    headers = {"Authorization": f"Bearer {str(kimi_api_key or '').strip()}"}
+    body = {"template": template_type, "params": param_dict, "template_set": template_set, "use_cache": use_cache,
+            "coalesce": coalesce, "variant": variant}
+    return headers, body
+
+
+def _apply_event(event, payload, content):
+    """根据 SSE 事件更新累计文本，返回 (累计文本, 需产出的文本或 None)"""
+    if event == "delta":
+        content += payload["text"]
+        return content, content
+    if event == "replace":
+        return payload["text"], payload["text"]
+    if event in ("notice", "error"):
+        return content, payload["text"]
+    if event == "trimmed":
+        return TrimmedText(content), TrimmedText(content)
+    return content, None
+
+
+def _unavailable(error):
+    return f"❌ 生成服务不可用：{str(error)}"
+
+
+def _status_error(response):
+    """非 2xx 响应的错误说明：服务端按 {"error": ...} 返回，无法解析（如代理返回的页面）时使用状态码"""
+    try:
+        return response.json().get("error") or f"HTTP {response.status_code}"
+    except (ValueError, AttributeError):
+        return f"HTTP {response.status_code}"
+
+
+# ===================== 1. 流式生成 =====================
+def generate_stream(kimi_api_key, template_type, param_dict, use_cache=True, template_set=DEFAULT_TEMPLATE_SET,
+                    coalesce=True, variant=0, cancel=None):
+    """流式生成：与 kimi.engine.generate_stream 行为一致；取消时关闭连接，服务端随即断开上游"""
+    cancel = cancel or CancelToken()
+    headers, body = _request(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce, variant)
+    content, event = "", "message"
+    try:
+        with _client.stream("POST", "/generate/stream", json=body, headers=headers) as response:
+            if not response.is_success:
+                response.read()
+                yield _unavailable(_status_error(response))
+                return
+            unregister = cancel.on_cancel(response.close)
+            try:
+                for line in response.iter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        content, output = _apply_event(event, json.loads(line[len("data:"):]), content)
+                        if output is not None:
+                            yield output
+            finally:
+                unregister()
+    except (httpx.HTTPError, httpx.StreamError) as e:
+        # 取消时连接被主动关闭，不是服务故障
+        if not cancel.cancelled:
+            yield _unavailable(e)
+
+
+async def generate_stream_async(kimi_api_key, template_type, param_dict, use_cache=True,
+                                template_set=DEFAULT_TEMPLATE_SET, coalesce=True, variant=0, cancel=None):
+    """异步流式生成：与 kimi.engine.generate_stream_async 行为一致"""
+    cancel = cancel or CancelToken()
+    headers, body = _request(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce, variant)
+    content, event = "", "message"
+    try:
+        async with _async_client().stream("POST", "/generate/stream", json=body, headers=headers) as response:
+            if not response.is_success:
+                await response.aread()
+                yield _unavailable(_status_error(response))
+                return
+            async for line in response.aiter_lines():
+                if cancel.cancelled:
+                    return
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    content, output = _apply_event(event, json.loads(line[len("data:"):]), content)
+                    if output is not None:
+                        yield output
+    except (httpx.HTTPError, httpx.StreamError) as e:
+        # 取消时连接被主动关闭，不是服务故障
+        if not cancel.cancelled:
+            yield _unavailable(e)
+
+
+def generate(kimi_api_key, template_type, param_dict, use_cache=True, template_set=DEFAULT_TEMPLATE_SET,
+             coalesce=True, variant=0):
+    """非流式生成：返回最终完整文本"""
+    headers, body = _request(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce, variant)
+    try:
+        response = _client.post("/generate", json=body, headers=headers)
+        if not response.is_success:
+            return _unavailable(_status_error(response))
+        result = response.json()
+        return TrimmedText(result["content"]) if result.get("trimmed") else result["content"]
+    except (httpx.HTTPError, ValueError, KeyError) as e:
+        return _unavailable(e)
+
+
+async def generate_async(kimi_api_key, template_type, param_dict, use_cache=True, template_set=DEFAULT_TEMPLATE_SET,
+                         coalesce=True, variant=0):
+    """异步非流式生成：返回最终完整文本"""
+    result = ""
+    async for result in generate_stream_async(kimi_api_key, template_type, param_dict, use_cache, template_set,
+                                              coalesce, variant):
+        pass
+    return result
+
+
+def generate_variants_stream(kimi_api_key, template_type, param_dict, variants=3, use_cache=True,
+                             template_set=DEFAULT_TEMPLATE_SET, coalesce=True, cancel=None):
+    """多候选流式生成：每个候选一个 SSE 请求并发发出，产出 (各候选当前文本, 各候选是否结束)"""
+    streams = [generate_stream(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce, variant,
+                               cancel)
+               for variant in range(clamp_variants(variants))]
+    yield from merge_streams(streams)
+
+
+async def generate_variants_stream_async(kimi_api_key, template_type, param_dict, variants=3, use_cache=True,
+                                         template_set=DEFAULT_TEMPLATE_SET, coalesce=True, cancel=None):
+    """异步多候选流式生成：与 generate_variants_stream 行为一致"""
+    streams = [generate_stream_async(kimi_api_key, template_type, param_dict, use_cache, template_set, coalesce,
+                                     variant, cancel)
+               for variant in range(clamp_variants(variants))]
+    async for update in merge_streams_async(streams):
+        yield update
+
+
+def generate_variants(kimi_api_key, template_type, param_dict, variants=3, use_cache=True,
+                      template_set=DEFAULT_TEMPLATE_SET, coalesce=True):
+    """多候选非流式生成：返回各候选最终文本的列表"""
+    contents = []
+    for contents, _ in generate_variants_stream(kimi_api_key, template_type, param_dict, variants, use_cache,
+                                                template_set, coalesce):
+        pass
+    return contents
+
+
+def find_similar(template_type, param_dict, template_set=DEFAULT_TEMPLATE_SET, threshold=SIMILAR_THRESHOLD):
+    """服务端查找相似请求已生成的结果，没有或服务不可用时返回 None"""
+    body = {"template": template_type, "params": param_dict, "template_set": template_set, "threshold": threshold}
+    try:
+        return _client.post("/similar", json=body).json()["match"]
+    except (httpx.HTTPError, ValueError, KeyError):
+        return None
+
+
+# ===================== 2. 统计与历史 =====================
+def search_history(query="", template_type=None, before_id=None, limit=10):
+    """服务端生成历史摘要（按时间倒序，游标翻页）"""
+    params = {"q": query, "template": template_type or "", "before": before_id or "", "limit": limit}
+    try:
+        return _client.get("/history", params=params).json()["entries"]
+    except (httpx.HTTPError, ValueError, KeyError):
+        return []
+
+
+def get_history_entry(entry_id):
+    """服务端单条历史记录全文，不存在或服务不可用时返回 None"""
+    try:
+        response = _client.get(f"/history/{int(entry_id)}")
+        return response.json() if response.status_code == 200 else None
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def cache_stats():
+    """服务端响应缓存统计"""
+    try:
+        return _client.get("/stats").json()["cache"]
+    except (httpx.HTTPError, ValueError, KeyError):
+        return {"hits": 0, "misses": 0}
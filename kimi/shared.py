@@ -0,0 +1,111 @@
+"""跨进程共享状态：同一主机上的多个工作进程（多份 2.py / Streamlit 页面）共用限流桶与进行中请求表
+
+进程内的限流器与进行中请求表在多进程部署时各管各的：每个进程都按完整额度放行请求，
+相同请求在不同进程中各调用一次上游。设置 KIMI_SHARED_STATE=1 后，这两者改存到
+DATA_DIR 下的 SQLite（WAL 模式）数据库中，读改写在 BEGIN IMMEDIATE 事务中完成，
+各进程看到的是同一份状态，不依赖外部服务：
+
+- 限流桶：kimi.limiter.SharedRateLimiter（每个密钥的请求桶与令牌桶各一行）；
+- 进行中请求：kimi.inflight.SharedInflightRegistry（领头进程把最新累计文本写入数据库，
+  其他进程的相同请求轮询读取；领头进程退出或长时间没有进展时由等待者接替）；
+- 响应缓存本来就有 SQLite 磁盘层，所有进程共用同一个 DATA_DIR 即可相互命中。
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from kimi import DATA_DIR
+
+# ===================== 1. 共享状态配置（可通过环境变量覆盖） =====================
+SHARED_STATE_ENABLED = os.environ.get("KIMI_SHARED_STATE", "0") == "1"
+SHARED_STATE_PATH = os.environ.get("KIMI_SHARED_STATE_PATH", os.path.join(DATA_DIR, "shared_state.db"))
+SHARED_BUSY_TIMEOUT = float(os.environ.get("KIMI_SHARED_BUSY_TIMEOUT", "30"))  # 等待其他进程释放写锁的秒数
+
+
+# ===================== 2. SQLite 共享状态库 =====================
+class SharedState:
+    """进程内共享一个连接（线程之间用锁串行），进程之间由 SQLite 的文件锁保证原子性"""
+
+    def __init__(self, db_path=SHARED_STATE_PATH, timeout=SHARED_BUSY_TIMEOUT):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        # isolation_level=None：自行控制事务，读改写用 BEGIN IMMEDIATE 一开始就拿到写锁
+        self._db = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                fingerprint TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (fingerprint, kind)
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS flights (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                latest TEXT NOT NULL DEFAULT '',
+                done INTEGER NOT NULL DEFAULT 0,
+                completed INTEGER NOT NULL DEFAULT 0,
+                followers INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL
+            )
+        """)
+
+    @contextmanager
+    def transaction(self):
+        """写事务：进入时取得数据库写锁，正常退出时提交，出错时回滚"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def query(self, sql, args=()):
+        """只读查询，返回第一行（没有时为 None）"""
+        with self._lock:
+            return self._db.execute(sql, args).fetchone()
+
+    def execute(self, sql, args=()):
+        """单条写语句（自动提交），返回影响的行数"""
+        with self._lock:
+            return self._db.execute(sql, args).rowcount
+
+
+def process_alive(pid):
+    """同一主机上的进程是否仍在运行；无法判断时（非 POSIX 系统）视为仍在运行"""
+    if pid == os.getpid():
+        return True
+    if os.name != "posix":
+        return True  # Windows 上 os.kill 会结束目标进程，只依靠超时判断
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state():
+    """进程级共享状态库连接；fork 出的子进程不沿用父进程的连接，首次使用时重新打开"""
+    global _state
+    if _state is None or _state.pid != os.getpid():
+        with _state_lock:
+            if _state is None or _state.pid != os.getpid():
+                _state = SharedState()
+    return _state
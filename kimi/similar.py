@@ -0,0 +1,259 @@
+"""相似请求缓存：参数只差空格、标点或卖点顺序的请求，直接提供以前生成的结果供采用或重新生成
+
+精确缓存（kimi.cache）按渲染后的提示词命中，“无线蓝牙耳机”与“无线蓝牙耳机 ”、调换两个卖点都会重新生成。
+本模块完全在本地计算，不依赖向量服务：
+- 归一化参数取值：全角转半角、去掉空白与标点、逗号/顿号等分隔的列表按项排序；
+- 以各参数字符 n-gram 的 MinHash 签名做 LSH 分桶（SIMILAR_BANDS 段 × SIMILAR_ROWS 行），
+  查询只比较与当前请求至少落入同一个桶的历史请求，再用 n-gram 集合的 Jaccard 相似度精确打分；
+- 模板集、模板、模型、输出上限与纯数字参数（如字数）必须完全相同，才在同一范围内比较；
+- 索引只保存归一化文本与响应缓存键，结果正文仍在响应缓存中，缓存过期后相似条目随之失效。
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+
+from kimi import DATA_DIR
+from kimi.cache import CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+# ===================== 1. 相似缓存配置（可通过环境变量覆盖） =====================
+SIMILAR_DB_PATH = os.environ.get("KIMI_SIMILAR_PATH", os.path.join(DATA_DIR, "similar_index.db"))
+SIMILAR_ENABLED = os.environ.get("KIMI_SIMILAR", "1") != "0"
+SIMILAR_THRESHOLD = float(os.environ.get("KIMI_SIMILAR_THRESHOLD", "0.8"))  # Jaccard 相似度下限（0~1）
+SIMILAR_NGRAM = int(os.environ.get("KIMI_SIMILAR_NGRAM", "2"))  # 字符 n-gram 长度
+SIMILAR_BANDS = 16  # LSH 段数
+SIMILAR_ROWS = 4  # 每段的 MinHash 行数（签名长度 = 段数 × 行数）
+SIMILAR_MAX_CANDIDATES = 200  # 每次查询最多精确打分的候选数（取最新的）
+SIMILAR_EVICT_EVERY = 100  # 每写入多少条检查一次条目上限
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)  # 固定种子：各进程、重启前后的签名一致
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(SIMILAR_BANDS * SIMILAR_ROWS)]
+_LIST_SEPARATOR_RE = re.compile(r"[,、;/|\n]+")  # 全角分隔符经 NFKC 转换后为半角
+
+
+# ===================== 2. 归一化与 MinHash =====================
+def normalize_value(value):
+    """归一化一个参数取值：全角转半角、小写、去掉空白与标点；列表按项排序"""
+    text = unicodedata.normalize("NFKC", str(value)).lower()
+    items = []
+    for item in _LIST_SEPARATOR_RE.split(text):
+        item = "".join(ch for ch in item if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+        if item:
+            items.append(item)
+    return ",".join(sorted(items))
+
+
+def normalize_params(param_dict):
+    """返回 (精确部分, 文本部分)：纯数字参数须完全相同，其余参数参与相似度计算"""
+    exact, fields = {}, {}
+    for name in sorted(param_dict):
+        value = normalize_value(param_dict[name])
+        if value.isdigit():
+            exact[name] = value
+        else:
+            fields[name] = value
+    return exact, fields
+
+
+def shingles(fields, n=SIMILAR_NGRAM):
+    """各参数的字符 n-gram 集合（带参数名，不同参数的相同片段不会混在一起）"""
+    result = set()
+    for name, value in fields.items():
+        if len(value) <= n:
+            result.add(f"{name}\x1f{value}")
+            continue
+        for i in range(len(value) - n + 1):
+            result.add(f"{name}\x1f{value[i:i + n]}")
+    return result
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(grams):
+    """MinHash 签名：每个哈希函数 (a·x + b) mod p 在集合上的最小值"""
+    if not grams:
+        return [0] * len(_PERMUTATIONS)
+    hashes = [zlib.crc32(gram.encode("utf-8")) for gram in grams]
+    return [min((a * x + b) % _MERSENNE_PRIME for x in hashes) for a, b in _PERMUTATIONS]
+
+
+def lsh_buckets(scope, signature):
+    """签名按段切分后的桶号（桶号包含比较范围，不同模板/模型的请求不会落入同一个桶）"""
+    buckets = []
+    for band in range(SIMILAR_BANDS):
+        rows = signature[band * SIMILAR_ROWS:(band + 1) * SIMILAR_ROWS]
+        digest = hashlib.blake2b(f"{scope}|{band}|{rows}".encode("utf-8"), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "big", signed=True))
+    return buckets
+
+
+def make_scope(template_set, template_type, model, max_tokens, exact):
+    """比较范围：这些取值不同的请求不视为相似"""
+    return json.dumps([template_set, template_type, model, max_tokens, exact], ensure_ascii=False, sort_keys=True)
+
+
+# ===================== 3. 相似请求索引 =====================
+class SimilarIndex:
+    """线程安全的 LSH 索引：entries 保存归一化参数与缓存键，bands 保存各条目的桶号"""
+
+    def __init__(self, db_path=SIMILAR_DB_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._added = 0
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                fields TEXT NOT NULL,
+                params TEXT NOT NULL,
+                cache_key TEXT NOT NULL UNIQUE,
+                created REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS bands (
+                bucket INTEGER NOT NULL,
+                entry_id INTEGER NOT NULL,
+                PRIMARY KEY (bucket, entry_id)
+            ) WITHOUT ROWID
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_bands_entry ON bands(entry_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_created ON entries(created)")
+        self._db.commit()
+
+    def add(self, scope, fields, param_dict, cache_key):
+        """索引一次完整生成；相同缓存键已在索引中时只刷新时间"""
+        buckets = lsh_buckets(scope, minhash(shingles(fields)))
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute("UPDATE entries SET created = ? WHERE cache_key = ?", (now, cache_key))
+            if cursor.rowcount == 0:
+                entry_id = self._db.execute(
+                    "INSERT INTO entries (scope, fields, params, cache_key, created) VALUES (?, ?, ?, ?, ?)",
+                    (scope, json.dumps(fields, ensure_ascii=False), json.dumps(param_dict, ensure_ascii=False),
+                     cache_key, now)
+                ).lastrowid
+                self._db.executemany("INSERT OR IGNORE INTO bands (bucket, entry_id) VALUES (?, ?)",
+                                     [(bucket, entry_id) for bucket in buckets])
+                self._added += 1
+                if self._added % SIMILAR_EVICT_EVERY == 0:
+                    self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """超过条目上限时淘汰最早的条目（调用方需持有锁；每写入 SIMILAR_EVICT_EVERY 条检查一次）"""
+        stale = [row[0] for row in self._db.execute(
+            "SELECT id FROM entries ORDER BY created DESC LIMIT -1 OFFSET ?", (self.max_entries,))]
+        self._remove(stale)
+
+    def _remove(self, entry_ids):
+        if not entry_ids:
+            return
+        marks = ",".join("?" * len(entry_ids))
+        self._db.execute(f"DELETE FROM bands WHERE entry_id IN ({marks})", entry_ids)
+        self._db.execute(f"DELETE FROM entries WHERE id IN ({marks})", entry_ids)
+
+    def query(self, scope, fields, threshold=SIMILAR_THRESHOLD, exclude_key=None):
+        """与当前请求相似度不低于 threshold 的历史条目，按相似度从高到低排列：
+        [(相似度, 缓存键, 原始参数)]；exclude_key 为当前请求自身的缓存键"""
+        grams = shingles(fields)
+        buckets = lsh_buckets(scope, minhash(grams))
+        marks = ",".join("?" * len(buckets))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, scope, fields, params, cache_key FROM entries WHERE id IN "
+                f"(SELECT DISTINCT entry_id FROM bands WHERE bucket IN ({marks})) ORDER BY created DESC LIMIT ?",
+                buckets + [SIMILAR_MAX_CANDIDATES]
+            ).fetchall()
+        matches = []
+        for _, entry_scope, entry_fields, params, cache_key in rows:
+            if entry_scope != scope or cache_key == exclude_key:
+                continue
+            similarity = jaccard(grams, shingles(json.loads(entry_fields)))
+            if similarity >= threshold:
+                matches.append((similarity, cache_key, json.loads(params)))
+        matches.sort(key=lambda match: match[0], reverse=True)
+        return matches
+
+    def discard(self, cache_key):
+        """响应缓存中已没有该结果时移除对应条目"""
+        with self._lock:
+            self._remove([row[0] for row in self._db.execute("SELECT id FROM entries WHERE cache_key = ?",
+                                                             (cache_key,))])
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM bands")
+            self._db.execute("DELETE FROM entries")
+            self._db.commit()
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_similar_index():
+    """进程级共享的相似请求索引（首次使用时才创建数据库文件）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SimilarIndex()
+    return _index
+
+
+# ===================== 4. 引擎使用的函数 =====================
+def index_similar(template_set, template_type, route, param_dict, cache_key):
+    """引擎在完整结果写入响应缓存后调用；索引写入失败不影响生成结果"""
+    if not SIMILAR_ENABLED:
+        return
+    exact, fields = normalize_params(param_dict)
+    try:
+        get_similar_index().add(make_scope(template_set, template_type, route.model, route.max_tokens, exact),
+                                fields, param_dict, cache_key)
+    except sqlite3.Error as e:
+        logger.warning("相似请求索引写入失败：%s", e)
+
+
+def similar_matches(template_set, template_type, route, param_dict, threshold=SIMILAR_THRESHOLD, exclude_key=None):
+    """与当前请求相似的历史请求 [(相似度, 缓存键, 原始参数)]，未启用时返回空列表"""
+    if not SIMILAR_ENABLED:
+        return []
+    exact, fields = normalize_params(param_dict)
+    scope = make_scope(template_set, template_type, route.model, route.max_tokens, exact)
+    try:
+        return get_similar_index().query(scope, fields, threshold, exclude_key)
+    except sqlite3.Error as e:
+        logger.warning("相似请求索引查询失败：%s", e)
+        return []
+
+
+def describe_match(match):
+    """界面展示用的相似结果说明"""
+    params = "；".join(f"{name}：{value}" for name, value in match["params"].items() if str(value).strip())
+    return f"♻️ 找到相似度 {match['similarity']:.0%} 的已生成结果（当时的参数：{params}）"
@@ -0,0 +1,99 @@
+"""本地令牌估算与成本/耗时预算：针对中英混合提示词，无需调用分词接口"""
+import math
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# ===================== 1. 估算系数（可按实际账单校准） =====================
+CJK_TOKENS_PER_CHAR = 0.6  # Moonshot 约 1 token ≈ 1.5~2 个汉字
+LATIN_CHARS_PER_TOKEN = 4.0  # 英文约 4 个字母 1 个 token
+DIGITS_PER_TOKEN = 3.0
+OTHER_TOKENS_PER_CHAR = 0.5  # 标点及其他符号
+OUTPUT_OVERSHOOT = 1.1  # 模型输出通常略超要求字数
+CHARS_PER_CHAPTER = 250  # 论文提纲每章的预计输出字数
+FREE_FORM_OUTPUT_CHARS = 1500  # 自由创作无字数参数时的预计输出字数
+
+# 预计耗时：首 token 固定开销 + 预填充 + 逐 token 解码
+TTFT_BASE_SECONDS = 1.0
+PREFILL_TOKENS_PER_SECOND = 2000.0
+DECODE_TOKENS_PER_SECOND = 40.0
+
+# 每百万 tokens 价格（元，输入输出同价）
+PRICE_PER_MILLION = {
+    "moonshot-v1-8k": 12.0,
+    "moonshot-v1-32k": 24.0,
+    "moonshot-v1-128k": 60.0,
+}
+
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff]")
+_LATIN_RE = re.compile(r"[A-Za-z]+")
+_DIGIT_RE = re.compile(r"\d+")
+_SPACE_RE = re.compile(r"\s")
+
+Estimate = namedtuple("Estimate", ["model", "input_tokens", "output_tokens", "latency_seconds", "cost_yuan"])
+
+
+# ===================== 2. 令牌估算 =====================
+@lru_cache(maxsize=4096)
+def estimate_tokens(text):
+    """估算文本令牌数（按文本缓存，Streamlit 每次重跑都可调用）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    latin_words = _LATIN_RE.findall(text)
+    digit_runs = _DIGIT_RE.findall(text)
+    latin_chars = sum(len(w) for w in latin_words)
+    digit_chars = sum(len(d) for d in digit_runs)
+    other = len(text) - len(_SPACE_RE.findall(text)) - cjk - latin_chars - digit_chars
+    tokens = (cjk * CJK_TOKENS_PER_CHAR
+              + sum(math.ceil(len(w) / LATIN_CHARS_PER_TOKEN) for w in latin_words)
+              + sum(math.ceil(len(d) / DIGITS_PER_TOKEN) for d in digit_runs)
+              + max(0, other) * OTHER_TOKENS_PER_CHAR)
+    return max(1, math.ceil(tokens))
+
+
+def _positive_int(value):
+    try:
+        number = int(value)
+    except (ValueError, TypeError):
+        return None
+    return number if number > 0 else None
+
+
+def estimate_output_tokens(param_dict):
+    """根据字数/章节数估算预计输出令牌数"""
+    word_count = _positive_int(param_dict.get("字数"))
+    if word_count:
+        chars = word_count * OUTPUT_OVERSHOOT
+    else:
+        chapters = _positive_int(param_dict.get("章节数"))
+        chars = chapters * CHARS_PER_CHAPTER if chapters else FREE_FORM_OUTPUT_CHARS
+    return math.ceil(chars * CJK_TOKENS_PER_CHAR)
+
+
+# ===================== 3. 耗时与成本 =====================
+def estimate_latency(input_tokens, output_tokens):
+    """预计总耗时（秒）"""
+    return TTFT_BASE_SECONDS + input_tokens / PREFILL_TOKENS_PER_SECOND + output_tokens / DECODE_TOKENS_PER_SECOND
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    """预计费用（元）"""
+    return (input_tokens + output_tokens) * PRICE_PER_MILLION.get(model, 0.0) / 1_000_000
+
+
+def estimate_generation(model, prompt, param_dict, max_tokens=None):
+    """一次生成的预计输入/输出令牌数、耗时与费用（输出不超过 max_tokens）"""
+    input_tokens = estimate_tokens(prompt)
+    output_tokens = estimate_output_tokens(param_dict)
+    if max_tokens:
+        output_tokens = min(output_tokens, max_tokens)
+    return Estimate(model, input_tokens, output_tokens, round(estimate_latency(input_tokens, output_tokens), 1),
+                    estimate_cost(model, input_tokens, output_tokens))
+
+
+def describe_estimate(estimate):
+    """界面展示用的预估说明"""
+    return (f"预计消耗约 {estimate.input_tokens + estimate.output_tokens} tokens"
+            f"（输入 {estimate.input_tokens} / 输出 {estimate.output_tokens}）| "
+            f"预计耗时约 {estimate.latency_seconds:.0f} 秒 | 约 ¥{estimate.cost_yuan:.4f}")